@@ -0,0 +1,158 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+
+import oncall
+
+# Benchmark suite for the generation, load, edit and save paths. Every phase
+# runs once for wall time and once under tracemalloc for peak memory, over a
+# grid of roster sizes and horizons, and the results are written as JSON.
+DEFAULT_SIZES = [18, 1000, 10000]
+DEFAULT_YEARS = [1, 3, 10]
+QUICK_SIZES = [18, 200]
+QUICK_YEARS = [1, 3]
+FIRST_YEAR = 2030
+
+def make_roster(size):
+    if size == len(oncall.DEVINTEST_EMPLOYEES):
+        return oncall.DEVINTEST_EMPLOYEES.copy()
+    return [f"Employee {idx:05d}" for idx in range(1, size + 1)]
+
+def measure(func, trace_memory):
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = func()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+def run_case(employees, years, seed, folder):
+    # (phase, callable) pairs in run order; later phases use the state earlier ones built
+    start_date = datetime.date(FIRST_YEAR, 1, 1)
+    end_date = datetime.date(FIRST_YEAR + years - 1, 12, 31)
+    year_list = list(range(FIRST_YEAR, FIRST_YEAR + years))
+    state = {}
+
+    def assign():
+        state['schedule'] = oncall.build_horizon_schedule(employees, start_date, end_date, seed=seed)
+
+    def create_calendar_sheets():
+        schedule = state['schedule']
+        for year in year_list:
+            workbook = Workbook()
+            oncall.create_calendar_sheets(workbook, schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'], year)
+
+    def full_save():
+        oncall.write_horizon_workbooks(state['schedule'], employees, out_dir=folder)
+
+    def load_schedule_data():
+        state['loaded'] = {year: oncall.load_schedule_data(year) for year in year_list}
+
+    def parse_calendar_sheets():
+        for year in year_list:
+            oncall.parse_calendar_sheets(oncall.open_workbook(oncall.get_schedule_file(year)), year)
+            oncall.evict_workbook(oncall.get_schedule_file(year))
+
+    def recalculate_counts():
+        for year in year_list:
+            oncall.recalculate_counts(employees, *state['loaded'][year])
+
+    return [
+        ('assign', assign),
+        ('create_calendar_sheets', create_calendar_sheets),
+        ('save', full_save),
+        ('load_schedule_data', load_schedule_data),
+        ('parse_calendar_sheets', parse_calendar_sheets),
+        ('recalculate_counts', recalculate_counts),
+    ]
+
+def run_benchmarks(sizes, horizons, seed=0, repeat=1):
+    results = []
+    for size in sizes:
+        employees = make_roster(size)
+        for years in horizons:
+            folder = tempfile.mkdtemp(prefix='oncall-bench-')
+            oncall.SCHEDULING_FOLDER = folder
+            oncall.HISTORY_FILE = os.path.join(folder, 'schedule_history.json')
+            try:
+                timings = {}
+                # Timing passes first; the state they leave behind feeds later phases
+                for _ in range(repeat):
+                    for phase, func in run_case(employees, years, seed, folder):
+                        _, elapsed, _ = measure(func, trace_memory=False)
+                        timings[phase] = min(elapsed, timings.get(phase, elapsed))
+                for phase, func in run_case(employees, years, seed, folder):
+                    _, _, peak = measure(func, trace_memory=True)
+                    results.append({
+                        'employees': size,
+                        'years': years,
+                        'phase': phase,
+                        'seconds': round(timings[phase], 6),
+                        'peak_bytes': peak,
+                    })
+                    print(f"{size:>6} employees {years:>2}y  {phase:<24}{timings[phase]:>10.4f}s {peak / 1e6:>10.1f} MB")
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+def compare_results(results, baseline_path, tolerance):
+    # Phases more than 'tolerance' slower than the baseline count as regressions
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['employees'], r['years'], r['phase']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['employees'], result['years'], result['phase']))
+        if previous and previous['seconds'] > 0 and result['seconds'] > previous['seconds'] * (1 + tolerance):
+            regressions.append((result, previous))
+    for result, previous in regressions:
+        print(f"Regression: {result['employees']} employees {result['years']}y {result['phase']}: "
+              f"{previous['seconds']:.4f}s -> {result['seconds']:.4f}s")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the on-call scheduling paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=None, help="Roster sizes (default 18 1000 10000)")
+    parser.add_argument('--years', type=int, nargs='+', default=None, help="Horizon lengths in years (default 1 3 10)")
+    parser.add_argument('--quick', action='store_true', help="Small grid for a fast smoke run")
+    parser.add_argument('--repeat', type=int, default=1, help="Timing passes per case; the fastest is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench_results.json', help="JSON results file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    horizons = args.years or (QUICK_YEARS if args.quick else DEFAULT_YEARS)
+    results = run_benchmarks(sizes, horizons, seed=args.seed, repeat=args.repeat)
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        return 1 if compare_results(results, args.compare, args.tolerance) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import argparse
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import oncall
+
+# Load test for the 'serve' lookup service. Without --url it generates a
+# schedule into a temporary folder and starts the server in a child process,
+# then keep-alive client threads send a mix of point and range queries and
+# the achieved requests/sec and latency percentiles are printed.
+FIRST_YEAR = 2030
+
+def prepare_folder(folder, employees, years):
+    oncall.SCHEDULING_FOLDER = folder
+    oncall.HISTORY_FILE = os.path.join(folder, 'schedule_history.json')
+    roster = [f"Employee {idx:05d}" for idx in range(1, employees + 1)]
+    schedule = oncall.build_horizon_schedule(roster, datetime.date(FIRST_YEAR, 1, 1),
+                                             datetime.date(FIRST_YEAR + years - 1, 12, 31), seed=0)
+    oncall.write_horizon_workbooks(schedule, roster, out_dir=folder)
+
+def run_server(folder, port, started):
+    oncall.SCHEDULING_FOLDER = folder
+    oncall.HISTORY_FILE = os.path.join(folder, 'schedule_history.json')
+    oncall.serve_lookups('127.0.0.1', port, ready=lambda server: started.set())
+
+def random_path(rng, years, range_share):
+    day = datetime.date(FIRST_YEAR, 1, 1) + datetime.timedelta(days=rng.randrange(365 * years))
+    if rng.random() < range_share:
+        return f"/on-call?start={day}&end={day + datetime.timedelta(days=rng.randrange(1, 31))}"
+    return f"/on-call?date={day}"
+
+def client(host, port, deadline, years, range_share, seed, latencies, errors):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        connection.request('GET', random_path(rng, years, range_share))
+        response = connection.getresponse()
+        body = response.read()
+        latencies.append(time.perf_counter() - started)
+        if response.status != 200 or not json.loads(body):
+            errors.append(response.status)
+    connection.close()
+
+def measure_index(folder, years, queries=100000):
+    # Direct ScheduleIndex lookups, without HTTP, for the in-memory cost
+    oncall.SCHEDULING_FOLDER = folder
+    index = oncall.ScheduleIndex()
+    index.refresh()
+    rng = random.Random(0)
+    days = [datetime.date(FIRST_YEAR, 1, 1) + datetime.timedelta(days=rng.randrange(365 * years)) for _ in range(queries)]
+    started = time.perf_counter()
+    for day in days:
+        index.lookup(day)
+    return (time.perf_counter() - started) / queries
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the on-call lookup service")
+    parser.add_argument('--url', default=None, help="Running server to test (default: start one on a generated schedule)")
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=4, help="Concurrent keep-alive client threads")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds to send requests for")
+    parser.add_argument('--range-share', type=float, default=0.2, help="Share of range queries")
+    parser.add_argument('--port', type=int, default=8766, help="Port for the server this script starts")
+    args = parser.parse_args(argv)
+
+    folder = None
+    server = None
+    try:
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            folder = tempfile.mkdtemp(prefix='oncall-loadtest-')
+            prepare_folder(folder, args.employees, args.years)
+            per_lookup = measure_index(folder, args.years)
+            print(f"In-memory point lookup: {per_lookup * 1e6:.2f} us")
+            started = multiprocessing.Event()
+            server = multiprocessing.Process(target=run_server, args=(folder, args.port, started), daemon=True)
+            server.start()
+            if not started.wait(60):
+                print("Server did not start.", file=sys.stderr)
+                return 1
+            host, port = '127.0.0.1', args.port
+
+        latencies = []
+        errors = []
+        deadline = time.perf_counter() + args.duration
+        threads = [threading.Thread(target=client, args=(host, port, deadline, args.years, args.range_share,
+                                                         seed, latencies, errors))
+                   for seed in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print(f"{len(latencies)} requests from {args.clients} clients in {args.duration:.1f}s: "
+              f"{len(latencies) / args.duration:.0f} requests/sec")
+        if latencies:
+            print(f"Latency p50 {percentile(latencies, 0.5) * 1e3:.2f} ms, "
+                  f"p99 {percentile(latencies, 0.99) * 1e3:.2f} ms")
+        if errors:
+            print(f"{len(errors)} failed requests", file=sys.stderr)
+            return 1
+        return 0
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+        if folder is not None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
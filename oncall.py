@@ -1,35 +1,73 @@
 import os
+import argparse
+import atexit
+import bisect
+import calendar
+import contextlib
+import cProfile
+import csv
+import heapq
+import io
 import random
 import datetime
+import functools
+import hashlib
+import json
+import logging
 import platform
+import re
+import struct
+import statistics
 import sys
-from collections import defaultdict
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Alignment, PatternFill, Font
-from openpyxl.utils import get_column_letter
-from openpyxl.cell.cell import MergedCell
-from openpyxl.styles.borders import Border, Side
-#import logging
-
-# Install colorama if not already installed
-try:
-    from colorama import init, Fore, Back, Style
-except ImportError:
-    os.system('pip install colorama')
-    from colorama import init, Fore, Back, Style
-
-init(autoreset=True)
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+
+# openpyxl, NumPy and colorama are imported where they are first used, so the
+# scheduling engine and the CLI's cached queries start without them
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    # NumPy is optional; without it validation is unavailable
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+@functools.lru_cache(maxsize=None)
+def load_colorama():
+    try:
+        import colorama
+    except ImportError:
+        return None
+    colorama.init(autoreset=True)
+    return colorama
+
+class LazyAnsi:
+    # Stands in for colorama's Fore, Back and Style until a code is first used;
+    # without colorama every code is an empty string
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        colorama = load_colorama()
+        value = getattr(getattr(colorama, self.name), attr) if colorama else ''
+        setattr(self, attr, value)
+        return value
+
+Fore = LazyAnsi('Fore')
+Back = LazyAnsi('Back')
+Style = LazyAnsi('Style')
 
 # Constants
 DESKTOP = os.path.join(os.path.expanduser("~"), "Desktop")
 SCHEDULING_FOLDER = os.path.join(DESKTOP, "On-Call Scheduling")
 # SCHEDULE_FILE will be set dynamically based on the year
-# Set up logging
+# Log file for --profile / ONCALL_PROFILE runs
 LOG_FILE = os.path.join(SCHEDULING_FOLDER, 'schedule_log.txt')
-#logging.basicConfig(filename=LOG_FILE, level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Ensure the folder exists
-os.makedirs(SCHEDULING_FOLDER, exist_ok=True)
+# The folder itself is created by the first write into it
 
 # Predefined employee list for 'devintest' mode
 DEVINTEST_EMPLOYEES = [
@@ -40,6 +78,83 @@ DEVINTEST_EMPLOYEES = [
     'Quincy Garcia', 'Rachel Martinez'
 ]
 
+# Logging and opt-in instrumentation. With ONCALL_PROFILE=1 (or --profile) the
+# main phases log their timings and counters as JSON lines to LOG_FILE;
+# ONCALL_PROFILE=debug also keeps the detailed debug messages, and
+# ONCALL_PROFILE_DUMP=<file> (or --profile-dump) writes a cProfile dump.
+logger = logging.getLogger('oncall')
+logger.addHandler(logging.NullHandler())
+profile_counters = Counter()
+_profiling = False
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        data = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'level': record.levelname}
+        fields = getattr(record, 'fields', None)
+        if fields is not None:
+            data.update(fields)
+        else:
+            data['message'] = record.getMessage()
+        return json.dumps(data, default=str)
+
+def log_event(event, **fields):
+    fields = dict({'event': event}, **fields)
+    logger.info(event, extra={'fields': fields})
+
+def start_profiling(level=logging.INFO, dump_path=None):
+    global _profiling
+    if _profiling:
+        return
+    _profiling = True
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+    handler.setFormatter(JsonLogFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    profiler = None
+    if dump_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = time.perf_counter()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(dump_path)
+        log_event('run', seconds=round(time.perf_counter() - started, 6), argv=sys.argv[1:], **profile_counters)
+
+    atexit.register(finish)
+
+def profiling_from_env():
+    value = os.environ.get('ONCALL_PROFILE', '').strip().lower()
+    if value and value not in ('0', 'false', 'no', 'off'):
+        start_profiling(logging.DEBUG if value == 'debug' else logging.INFO, os.environ.get('ONCALL_PROFILE_DUMP') or None)
+
+@contextlib.contextmanager
+def timed_phase(phase, **counters):
+    # Yields the counters dict so the block can add to it before it is logged
+    if not _profiling:
+        yield counters
+        return
+    started = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        seconds = time.perf_counter() - started
+        profile_counters[phase] += 1
+        profile_counters[phase + '_seconds'] = round(profile_counters[phase + '_seconds'] + seconds, 6)
+        log_event('phase', phase=phase, seconds=round(seconds, 6), **counters)
+
+def timed(phase):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed_phase(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
 def clear_screen():
     if platform.system() == "Windows":
         os.system('cls')
@@ -57,29 +172,277 @@ def print_centered(text, color=''):
 def pause(message="Press Enter to continue..."):
     input(message)
 
+def get_safe_name(name):
+    # File and folder names from employee or team names
+    return re.sub(r'[^\w.-]+', '_', name).strip('_')
+
 def get_schedule_file(year):
     return os.path.join(SCHEDULING_FOLDER, f"{year} On Call Scheduling.xlsx")
 
+# Workbook cache: path -> (mtime, workbook), most recently used last. An entry
+# is reloaded when the file changes on disk, so each file is opened at most
+# once per operation. Inside workbook_session() saves are collected and every
+# dirty workbook is written once when the session ends.
+WORKBOOK_CACHE_SIZE = 4
+_workbook_cache = OrderedDict()
+_session_saves = None
+
+_cache_lock = threading.RLock()
+
+def open_workbook(path):
+    if _session_saves is not None and path in _session_saves:
+        return _session_saves[path][0]
+    if _writer is not None and _writer.is_pending(path):
+        with _cache_lock:
+            cached = _workbook_cache.get(path)
+            if cached is not None:
+                # While our own save is still queued the in-memory copy is the newest
+                _workbook_cache.move_to_end(path)
+                return cached[1]
+        _writer.flush(path)
+    mtime = os.path.getmtime(path)
+    with _cache_lock:
+        cached = _workbook_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            _workbook_cache.move_to_end(path)
+            return cached[1]
+    from openpyxl import load_workbook
+    with timed_phase('workbook_load', path=path):
+        workbook = load_workbook(path)
+    cache_workbook(path, workbook, mtime)
+    return workbook
+
+def cache_workbook(path, workbook, mtime):
+    with _cache_lock:
+        _workbook_cache[path] = (mtime, workbook)
+        _workbook_cache.move_to_end(path)
+        while len(_workbook_cache) > WORKBOOK_CACHE_SIZE:
+            _workbook_cache.popitem(last=False)
+
+def evict_workbook(path):
+    with _cache_lock:
+        _workbook_cache.pop(path, None)
+
+def save_workbook(workbook, path, then=None):
+    # 'then' runs after the file is actually written, e.g. to refresh the store
+    callbacks = [then] if then is not None else []
+    if _session_saves is not None:
+        _session_saves.setdefault(path, (workbook, []))[1].extend(callbacks)
+        return
+    write_workbook(workbook, path, callbacks)
+
+def write_workbook(workbook, path, callbacks=()):
+    # With the background writer running only the serialization happens here;
+    # the file itself is written later by the writer thread
+    def written():
+        with _cache_lock:
+            cached = _workbook_cache.get(path)
+            if cached is not None and cached[1] is workbook:
+                cache_workbook(path, workbook, os.path.getmtime(path))
+        for callback in callbacks:
+            callback()
+
+    if _writer is not None:
+        buffer = io.BytesIO()
+        with timed_phase('workbook_serialize', path=path):
+            workbook.save(buffer)
+        cache_workbook(path, workbook, None)
+        _writer.submit(path, buffer.getvalue(), written)
+        return
+    with timed_phase('workbook_save', path=path):
+        write_file_atomic(path, workbook.save)
+    cache_workbook(path, workbook, os.path.getmtime(path))
+    for callback in callbacks:
+        callback()
+
+# Saves are atomic (a temporary file next to the target, then a rename) and
+# serialized across running instances by an advisory '<file>.lock' lock file.
+# A lock older than SAVE_LOCK_STALE seconds (ONCALL_LOCK_STALE overrides it)
+# is assumed to be left over from a crashed instance and is taken over, with a
+# warning. Each lock holds a token naming its owner, so an instance only ever
+# removes its own lock.
+SAVE_LOCK_TIMEOUT = 30
+SAVE_LOCK_STALE = float(os.environ.get('ONCALL_LOCK_STALE') or 120)
+
+def read_lock_token(lock_path):
+    try:
+        with open(lock_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def remove_lock_if_owned(lock_path, token):
+    if read_lock_token(lock_path) == token:
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+@contextlib.contextmanager
+def file_lock(path, timeout=SAVE_LOCK_TIMEOUT, stale=None):
+    stale = SAVE_LOCK_STALE if stale is None else stale
+    lock_path = path + '.lock'
+    token = f"{os.getpid()} {platform.node()} {os.urandom(8).hex()}\n"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(lock_path)
+            except FileNotFoundError:
+                continue
+            if age > stale:
+                holder = read_lock_token(lock_path)
+                if holder is None:
+                    continue
+                logger.warning('Taking over %s held by %s for %.0f seconds', lock_path, holder.strip() or 'unknown', age)
+                remove_lock_if_owned(lock_path, holder)
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{path} is locked by another instance ({lock_path})")
+            time.sleep(0.1)
+    try:
+        os.write(fd, token.encode('utf-8'))
+        os.close(fd)
+        yield
+    finally:
+        remove_lock_if_owned(lock_path, token)
+
+def write_file_atomic(path, write):
+    # 'write' is bytes or a callable taking the temporary file's path
+    if _writer is not None and threading.current_thread() is not _writer.thread:
+        _writer.flush(path)  # Never let an older queued save land on top of this one
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with file_lock(path):
+        try:
+            if callable(write):
+                write(tmp_path)
+            else:
+                with open(tmp_path, 'wb') as f:
+                    f.write(write)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+# Background writer for the interactive menu: the newest bytes per file wait
+# in a queue, so several saves of the same file coalesce into one write, and
+# the menu returns as soon as a workbook is serialized
+class BackgroundWriter:
+    def __init__(self):
+        self.pending = OrderedDict()  # path -> (data, callbacks)
+        self.busy = set()
+        self.errors = []
+        self.condition = threading.Condition(threading.RLock())
+        self.thread = threading.Thread(target=self.run, name='oncall-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, path, data, callback):
+        with self.condition:
+            callbacks = self.pending.pop(path)[1] if path in self.pending else []
+            self.pending[path] = (data, callbacks + [callback])
+            self.condition.notify_all()
+
+    def is_pending(self, path=None):
+        # Whether the given file (or any file) still has a save queued or in flight
+        with self.condition:
+            if path is None:
+                return bool(self.pending or self.busy)
+            return path in self.pending or path in self.busy
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                path, (data, callbacks) = self.pending.popitem(last=False)
+                self.busy.add(path)
+            try:
+                with timed_phase('workbook_save', path=path, background=True, coalesced=len(callbacks)):
+                    write_file_atomic(path, data)
+                for callback in callbacks:
+                    callback()
+            except Exception as e:
+                logger.exception('Background save of %s failed', path)
+                with self.condition:
+                    self.errors.append(f"Could not save {os.path.basename(path)}: {e}")
+            finally:
+                with self.condition:
+                    self.busy.discard(path)
+                    self.condition.notify_all()
+
+    def flush(self, path=None):
+        # Wait until the given file (or every file) is written
+        with self.condition:
+            while self.is_pending(path):
+                self.condition.wait()
+
+    def take_errors(self):
+        with self.condition:
+            errors, self.errors = self.errors, []
+        return errors
+
+_writer = None
+
+def start_background_writer():
+    global _writer
+    if _writer is None:
+        _writer = BackgroundWriter()
+        atexit.register(_writer.flush)
+    return _writer
+
+@contextlib.contextmanager
+def workbook_session():
+    global _session_saves
+    if _session_saves is not None:
+        # Nested sessions join the outer one
+        yield
+        return
+    _session_saves = {}
+    try:
+        yield
+    except BaseException:
+        # Discard the unsaved in-memory changes along with the session
+        for path in _session_saves:
+            evict_workbook(path)
+        raise
+    else:
+        pending = _session_saves
+        _session_saves = None
+        for path, (workbook, callbacks) in pending.items():
+            write_workbook(workbook, path, callbacks)
+    finally:
+        _session_saves = None
+
+def new_schedule_workbook(year):
+    from openpyxl import Workbook
+    workbook = Workbook()
+    # Remove default sheet
+    if 'Sheet' in workbook.sheetnames:
+        sheet = workbook['Sheet']
+        workbook.remove(sheet)
+    # Create required sheets
+    workbook.create_sheet('Employee List')
+    workbook.create_sheet('Schedule Changes')
+    workbook.create_sheet('Reports')
+    workbook.create_sheet('Original Reports')
+    # Create sheets for each month
+    for month in range(1, 13):
+        month_name = datetime.date(year, month, 1).strftime('%B')
+        workbook.create_sheet(month_name)
+    return workbook
+
 def get_workbook(year):
     schedule_file = get_schedule_file(year)
-    if os.path.exists(schedule_file):
-        workbook = load_workbook(schedule_file)
+    if (os.path.exists(schedule_file) or (_session_saves is not None and schedule_file in _session_saves)
+            or (_writer is not None and _writer.is_pending(schedule_file))):
+        workbook = open_workbook(schedule_file)
     else:
-        workbook = Workbook()
-        # Remove default sheet
-        if 'Sheet' in workbook.sheetnames:
-            sheet = workbook['Sheet']
-            workbook.remove(sheet)
-        # Create required sheets
-        workbook.create_sheet('Employee List')
-        workbook.create_sheet('Schedule Changes')
-        workbook.create_sheet('Reports')
-        workbook.create_sheet('Original Reports')
-        # Create sheets for each month
-        for month in range(1, 13):
-            month_name = datetime.date(year, month, 1).strftime('%B')
-            workbook.create_sheet(month_name)
-        workbook.save(schedule_file)
+        workbook = new_schedule_workbook(year)
+        save_workbook(workbook, schedule_file)
     return workbook
 
 def load_employees():
@@ -89,7 +452,7 @@ def load_employees():
     workbook = get_workbook(year)
     if 'Employee List' not in workbook.sheetnames:
         workbook.create_sheet('Employee List')
-        workbook.save(get_schedule_file(year))
+        save_workbook(workbook, get_schedule_file(year))
     sheet = workbook['Employee List']
     employees = []
     for row in sheet.iter_rows(min_row=2, values_only=True):
@@ -103,14 +466,41 @@ def save_employees(employees):
     if 'Employee List' not in workbook.sheetnames:
         workbook.create_sheet('Employee List')
     sheet = workbook['Employee List']
+    teams = read_employee_teams(sheet)
     # Clear existing data
     sheet.delete_rows(2, sheet.max_row)
-    # Write employees
+    # Write employees, keeping the team of everyone who stays on the list
     for idx, emp in enumerate(employees, start=2):
         sheet.cell(row=idx, column=1, value=emp)
-    workbook.save(get_schedule_file(year))
+        if emp in teams:
+            sheet.cell(row=idx, column=2, value=format_teams(teams[emp]))
+    save_workbook(workbook, get_schedule_file(year))
+
+# Teams: an optional second 'Team' column on the Employee List. Employees on
+# several teams list them separated by ',' or ';'.
+def parse_teams(value):
+    return [team.strip() for team in re.split(r'[,;]', str(value or '')) if team.strip()]
+
+def format_teams(teams):
+    return '; '.join(teams)
+
+def read_employee_teams(sheet):
+    # {employee: [teams]} for employees with a team
+    teams = {}
+    for row in sheet.iter_rows(min_row=2, max_col=2, values_only=True):
+        if row[0] and len(row) > 1 and parse_teams(row[1]):
+            teams[row[0]] = parse_teams(row[1])
+    return teams
+
+def load_employee_teams():
+    workbook = get_workbook(datetime.datetime.now().year)
+    if 'Employee List' not in workbook.sheetnames:
+        return {}
+    return read_employee_teams(workbook['Employee List'])
 
 def get_existing_schedule_years():
+    if not os.path.isdir(SCHEDULING_FOLDER):
+        return set()
     years = set()
     for filename in os.listdir(SCHEDULING_FOLDER):
         if filename.endswith('On Call Scheduling.xlsx'):
@@ -119,43 +509,126 @@ def get_existing_schedule_years():
                 years.add(int(year_part))
     return years
 
+def read_report_counts(workbook, sheet_name='Reports'):
+    primary_counts = {}
+    backup_counts = {}
+    if sheet_name not in workbook.sheetnames:
+        return None
+    for row in workbook[sheet_name].iter_rows(min_row=2, values_only=True):
+        emp, primary_count, backup_count = row[:3]
+        if emp:
+            primary_counts[emp] = primary_count or 0
+            backup_counts[emp] = backup_count or 0
+    return primary_counts, backup_counts
+
+# History cache: the 'Reports' and 'Original Reports' counts of every year in
+# the scheduling folder, persisted as JSON and keyed by each workbook's mtime
+# and the last seq of its journal. Only years that changed since the summary
+# was written are read again.
+HISTORY_FILE = os.path.join(SCHEDULING_FOLDER, 'schedule_history.json')
+HISTORY_VERSION = 3
+_history_cache = None
+
+def summarize_schedule_year(year):
+    workbook = open_workbook(get_schedule_file(year))
+    summary = {}
+    for key, sheet_name in (('reports', 'Reports'), ('original_reports', 'Original Reports')):
+        counts = read_report_counts(workbook, sheet_name)
+        summary[key] = {'primary': counts[0], 'backup': counts[1]} if counts else None
+    summary['original_days'] = read_original_days(workbook)
+    if read_journal(get_journal_file(year), get_journal_sheet_seq(workbook)):
+        # Journal entries not written into 'Reports' yet (undos) count too
+        counts = {}
+        date_primary, date_backup1, date_backup2 = load_schedule_data(year, counts=counts)
+        if not counts:
+            employees = list(summary['reports']['primary']) if summary['reports'] else load_employees()
+            primary_counts, backup_counts = recalculate_counts(employees, date_primary, date_backup1, date_backup2)
+            counts = {'primary': primary_counts, 'backup': backup_counts}
+        summary['reports'] = counts
+    return summary
+
+def read_original_days(workbook):
+    # Primary and backup days at generation, from an 'Original Reports' sheet
+    # with a 'Primary Days' column (backup counts are already in days)
+    if 'Original Reports' not in workbook.sheetnames:
+        return None
+    rows = workbook['Original Reports'].iter_rows(values_only=True)
+    header = next(rows, ())
+    if 'Primary Days' not in header:
+        return None
+    column = header.index('Primary Days')
+    primary_days = {}
+    backup_days = {}
+    for row in rows:
+        if row and row[0]:
+            primary_days[row[0]] = row[column] or 0
+            backup_days[row[0]] = row[2] or 0
+    return {'primary': primary_days, 'backup': backup_days}
+
+def load_schedule_history():
+    global _history_cache
+    if _history_cache is None:
+        try:
+            with open(HISTORY_FILE, encoding='utf-8') as f:
+                _history_cache = json.load(f)
+            if _history_cache.get('version') != HISTORY_VERSION:
+                _history_cache = None
+        except (OSError, ValueError):
+            _history_cache = None
+        if _history_cache is None:
+            _history_cache = {'version': HISTORY_VERSION, 'years': {}}
+
+    cached_years = _history_cache['years']
+    changed = False
+    existing_years = get_existing_schedule_years()
+    for key in list(cached_years):
+        if int(key) not in existing_years:
+            del cached_years[key]
+            changed = True
+    for year in existing_years:
+        mtime = os.path.getmtime(get_schedule_file(year))
+        journal_seq = last_journal_seq(get_journal_file(year))
+        entry = cached_years.get(str(year))
+        if entry is None or entry['mtime'] != mtime or entry['journal_seq'] != journal_seq:
+            entry = summarize_schedule_year(year)
+            entry['mtime'] = mtime
+            entry['journal_seq'] = journal_seq
+            cached_years[str(year)] = entry
+            changed = True
+    if changed:
+        write_file_atomic(HISTORY_FILE, json.dumps(_history_cache).encode('utf-8'))
+    return {int(key): entry for key, entry in cached_years.items()}
+
 def load_previous_year_counts(year):
-    # Load the workbook for the previous year
-    prev_schedule_file = get_schedule_file(year)
-    if not os.path.exists(prev_schedule_file):
+    # Counts from the year's 'Reports' sheet
+    entry = load_schedule_history().get(year)
+    if not entry or not entry['reports']:
         return {}, {}
-    workbook = load_workbook(prev_schedule_file)
-    # Load counts from the 'Reports' sheet
-    if 'Reports' not in workbook.sheetnames:
-        return {}, {}
-    report_sheet = workbook['Reports']
-    prev_primary_counts = {}
-    prev_backup_counts = {}
-    for row in report_sheet.iter_rows(min_row=2, values_only=True):
-        emp, primary_count, backup_count = row
-        prev_primary_counts[emp] = primary_count
-        prev_backup_counts[emp] = backup_count
-    return prev_primary_counts, prev_backup_counts
+    return dict(entry['reports']['primary']), dict(entry['reports']['backup'])
 
 def load_previous_year_edit_differences(year):
-    # Load original and edited counts from previous year's data
-    original_counts = load_counts_from_sheet(year, 'Original Reports')
-    edited_counts = load_counts_from_sheet(year, 'Reports')
+    # Load original and edited primary counts from previous year's data
+    entry = load_schedule_history().get(year)
+    if not entry:
+        return {}, {}
+    original_counts = dict(entry['original_reports']['primary']) if entry['original_reports'] else {}
+    edited_counts = dict(entry['reports']['primary']) if entry['reports'] else {}
     return original_counts, edited_counts
 
-def load_counts_from_sheet(year, sheet_name):
-    schedule_file = get_schedule_file(year)
-    if not os.path.exists(schedule_file):
-        return {}
-    workbook = load_workbook(schedule_file)
-    if sheet_name not in workbook.sheetnames:
-        return {}
-    sheet = workbook[sheet_name]
-    counts = {}
-    for row in sheet.iter_rows(min_row=2, values_only=True):
-        emp, primary_count, _ = row
-        counts[emp] = primary_count
-    return counts
+def decayed_history_counts(year, employees, decay=0.5):
+    # Long-term prior counts: the year before weighs 1, the one before that
+    # 'decay', then decay**2 and so on, with edit compensation left to the caller
+    prior_primary_counts = {emp: 0 for emp in employees}
+    prior_backup_counts = {emp: 0 for emp in employees}
+    for past_year, entry in load_schedule_history().items():
+        if past_year >= year or not entry['reports']:
+            continue
+        weight = decay ** (year - 1 - past_year)
+        for emp in employees:
+            prior_primary_counts[emp] += weight * entry['reports']['primary'].get(emp, 0)
+            prior_backup_counts[emp] += weight * entry['reports']['backup'].get(emp, 0)
+    return ({emp: round(count, 3) for emp, count in prior_primary_counts.items()},
+            {emp: round(count, 3) for emp, count in prior_backup_counts.items()})
 
 def calculate_workload_differences(original_counts, edited_counts):
     differences = {}
@@ -165,65 +638,7 @@ def calculate_workload_differences(original_counts, edited_counts):
         differences[emp] = original - edited  # Positive if employee worked less
     return differences
 
-def generate_schedule():
-    clear_screen()
-    employees = load_employees()
-
-    if not employees:
-        print_centered("Employee list is empty. Add employees first.", Fore.RED)
-        pause()
-        return
-
-    # Prompt for the year
-    while True:
-        year_input = input("Enter the year for which you want to generate the schedule (e.g., 2025): ").strip()
-        if year_input.isdigit() and int(year_input) >= datetime.datetime.now().year:
-            year = int(year_input)
-            break
-        else:
-            print_centered("Please enter a valid future year.", Fore.RED)
-
-    # Check if schedule already exists
-    existing_years = get_existing_schedule_years()
-    if year in existing_years:
-        confirm = input(f"A schedule for {year} already exists. Do you want to overwrite it? (y/n): ").strip().lower()
-        if confirm != 'y':
-            print_centered("Schedule generation canceled.", Fore.BLUE)
-            pause()
-            return
-
-    # Load previous year's counts
-    previous_year = year - 1
-    prev_primary_counts, prev_backup_counts = load_previous_year_counts(previous_year)
-
-    # Load differences due to schedule edits
-    prev_original_counts, prev_edited_counts = load_previous_year_edit_differences(previous_year)
-    workload_differences = calculate_workload_differences(prev_original_counts, prev_edited_counts)
-
-    # Combine current and previous counts
-    total_primary_counts = {emp: prev_primary_counts.get(emp, 0) for emp in employees}
-    total_backup_counts = {emp: prev_backup_counts.get(emp, 0) for emp in employees}
-
-    # Inform the user about workload differences
-    if workload_differences:
-        print_centered("Detected workload differences due to schedule edits in the previous year:", Fore.YELLOW)
-        for emp, diff in workload_differences.items():
-            if diff != 0:
-                print_centered(f"{emp}: {'Worked less' if diff > 0 else 'Worked more'} by {abs(diff)} assignments.")
-        adjust = input("Do you want to adjust the new schedule to compensate? (y/n): ").strip().lower()
-        if adjust == 'y':
-            # Adjust counts to compensate
-            for emp in employees:
-                total_primary_counts[emp] += workload_differences.get(emp, 0)
-                # Ensure counts don't go negative
-                total_primary_counts[emp] = max(total_primary_counts[emp], 0)
-
-    # Proceed with schedule generation using 'total_primary_counts' and 'total_backup_counts'
-
-    # Initialize counts
-    primary_counts = {emp: 0 for emp in employees}
-    backup_counts = {emp: 0 for emp in employees}
-
+def get_week_dates(year):
     # Create a list of all weeks in the year starting from the first Monday
     start_date = datetime.date(year, 1, 1)
     if start_date.weekday() != 0:
@@ -234,133 +649,1034 @@ def generate_schedule():
     for week in range(weeks_in_year):
         week_start = start_date + datetime.timedelta(weeks=week)
         week_dates.append(week_start)
+    return week_dates
+
+@timed('primary_assignment')
+def assign_primaries(employees, week_dates, total_primary_counts, rng):
+    primary_counts = {emp: 0 for emp in employees}
 
     # Assign primaries evenly
     primary_schedule = {}
     employee_cycle = employees.copy()
-    random.shuffle(employee_cycle)
+    rng.shuffle(employee_cycle)
+    # Min-heap keyed by (total count, rotation order). An employee who was just
+    # assigned goes to the back of the rotation, so ties resolve the same way
+    # as re-sorting the rotated cycle every week.
+    heap = [(total_primary_counts.get(emp, 0), order, emp) for order, emp in enumerate(employee_cycle)]
+    heapq.heapify(heap)
+    next_order = len(heap)
     for week_start in week_dates:
-        # Find employee with the least total primary assignments
-        employee_cycle.sort(key=lambda emp: (total_primary_counts.get(emp, 0) + primary_counts[emp]))
-        emp = employee_cycle[0]
+        # Take the employee with the least total primary assignments
+        total, _, emp = heapq.heappop(heap)
         primary_schedule[week_start] = emp
         primary_counts[emp] += 1
-        # Rotate the employee list to distribute assignments
-        employee_cycle = employee_cycle[1:] + [emp]
-
-    # Build date_primary mapping from primary_schedule
-    date_primary = {}
-    all_dates = []
-    for week_start in week_dates:
-        for i in range(7):
-            date = week_start + datetime.timedelta(days=i)
-            if date.year == year:
-                date_primary[date] = primary_schedule[week_start]
-                all_dates.append(date)
+        heapq.heappush(heap, (total + 1, next_order, emp))
+        next_order += 1
+    return primary_schedule, primary_counts
+
+class BackupLoadIndex:
+    # Min-heap of (backup load, roster position, employee) with lazy removal.
+    # Entries whose load no longer matches are stale and dropped when popped.
+    def __init__(self, employees, loads):
+        self.position = {emp: idx for idx, emp in enumerate(employees)}
+        self.load = {emp: loads.get(emp, 0) for emp in employees}
+        self.heap = [(self.load[emp], idx, emp) for idx, emp in enumerate(employees)]
+        heapq.heapify(self.heap)
+
+    def increment(self, emp):
+        self.load[emp] += 1
+        heapq.heappush(self.heap, (self.load[emp], self.position[emp], emp))
+
+    def lowest(self, excluded):
+        # Pop excluded employees aside, peek at the best remaining one, then restore them
+        held = []
+        found = None
+        while self.heap:
+            load, _, emp = self.heap[0]
+            if load != self.load[emp]:
+                heapq.heappop(self.heap)
+            elif emp in excluded:
+                held.append(heapq.heappop(self.heap))
+            else:
+                found = emp
+                break
+        for entry in held:
+            heapq.heappush(self.heap, entry)
+        return found
 
+@timed('backup_assignment')
+def assign_backups(employees, all_dates, date_primary, total_backup_counts):
     # Initialize backup counts
     backup_counts = {emp: 0 for emp in employees}
+    index = BackupLoadIndex(employees, total_backup_counts)
 
     # Assign backups for each date
     date_backup1 = {}
     date_backup2 = {}
-    last_backup1_date = {emp: datetime.date(year - 1, 12, 31) for emp in employees}
-    last_backup2_date = {emp: datetime.date(year - 1, 12, 31) for emp in employees}
+    one_day = datetime.timedelta(days=1)
 
     for date in all_dates:
         primary = date_primary[date]
 
-        # Exclude primary and apply constraints
-        eligible_employees = [emp for emp in employees if emp != primary]
-
-        # Remove employees who were backup the previous day
-        previous_date = date - datetime.timedelta(days=1)
+        # Exclude primary, employees who were backup the previous day and
+        # employees who are primary the next day. Since yesterday's backups are
+        # excluded, the lowest-load candidate never works consecutive backup days.
+        excluded = {primary}
+        previous_date = date - one_day
         if previous_date in date_backup1:
-            prev_backup1 = date_backup1[previous_date]
-            eligible_employees = [emp for emp in eligible_employees if emp != prev_backup1]
+            excluded.add(date_backup1[previous_date])
         if previous_date in date_backup2:
-            prev_backup2 = date_backup2[previous_date]
-            eligible_employees = [emp for emp in eligible_employees if emp != prev_backup2]
-
-        # Remove employees who are primary the next day
-        next_date = date + datetime.timedelta(days=1)
+            excluded.add(date_backup2[previous_date])
+        next_date = date + one_day
         if next_date in date_primary:
-            next_primary = date_primary[next_date]
-            eligible_employees = [emp for emp in eligible_employees if emp != next_primary]
-
-        # Sort eligible employees by least total backup assignments
-        eligible_employees.sort(key=lambda emp: (total_backup_counts.get(emp, 0) + backup_counts[emp]))
+            excluded.add(date_primary[next_date])
 
         # Assign Backup 1
-        if eligible_employees:
-            for emp in eligible_employees:
-                if last_backup1_date[emp] + datetime.timedelta(days=1) < date:
-                    date_backup1[date] = emp
-                    backup_counts[emp] += 1
-                    last_backup1_date[emp] = date
-                    eligible_employees.remove(emp)
-                    break
-            else:
-                # If no suitable candidate found, assign the next available
-                emp = eligible_employees[0]
-                date_backup1[date] = emp
-                backup_counts[emp] += 1
-                last_backup1_date[emp] = date
-                eligible_employees.remove(emp)
-        else:
+        emp = index.lowest(excluded)
+        if emp is None:
             # If no eligible employees, assign any employee not primary
             emp = [e for e in employees if e != primary][0]
-            date_backup1[date] = emp
-            backup_counts[emp] += 1
-            last_backup1_date[emp] = date
+        date_backup1[date] = emp
+        backup_counts[emp] += 1
+        index.increment(emp)
+        excluded.add(emp)
 
         # Assign Backup 2
-        eligible_employees = [emp for emp in eligible_employees if emp != date_backup1[date]]
-        if eligible_employees:
-            for emp in eligible_employees:
-                if last_backup2_date[emp] + datetime.timedelta(days=1) < date:
-                    date_backup2[date] = emp
-                    backup_counts[emp] += 1
-                    last_backup2_date[emp] = date
+        emp = index.lowest(excluded)
+        if emp is None:
+            # If no eligible employees, assign any employee not primary or backup1
+            emp = [e for e in employees if e not in [primary, date_backup1[date]]][0]
+        date_backup2[date] = emp
+        backup_counts[emp] += 1
+        index.increment(emp)
+
+    return date_backup1, date_backup2, backup_counts
+
+def build_schedule(employees, year, prior_primary_counts=None, prior_backup_counts=None, seed=None):
+    # Pure assignment engine: no prompts, no workbook access
+    prior_primary_counts = prior_primary_counts or {}
+    prior_backup_counts = prior_backup_counts or {}
+    rng = random.Random(seed)
+
+    # Combine current and previous counts
+    total_primary_counts = {emp: prior_primary_counts.get(emp, 0) for emp in employees}
+    total_backup_counts = {emp: prior_backup_counts.get(emp, 0) for emp in employees}
+
+    week_dates = get_week_dates(year)
+    primary_schedule, primary_counts = assign_primaries(employees, week_dates, total_primary_counts, rng)
+
+    # Build date_primary mapping from primary_schedule
+    date_primary = {}
+    all_dates = []
+    for week_start in week_dates:
+        for i in range(7):
+            date = week_start + datetime.timedelta(days=i)
+            if date.year == year:
+                date_primary[date] = primary_schedule[week_start]
+                all_dates.append(date)
+
+    date_backup1, date_backup2, backup_counts = assign_backups(employees, all_dates, date_primary, total_backup_counts)
+
+    return {
+        'year': year,
+        'seed': seed,
+        'date_primary': date_primary,
+        'date_backup1': date_backup1,
+        'date_backup2': date_backup2,
+        'primary_counts': primary_counts,
+        'backup_counts': backup_counts,
+    }
+
+def get_horizon_week_dates(start_date, end_date):
+    # Every week that touches the range, starting from the Monday on or before start_date
+    week_start = start_date - datetime.timedelta(days=start_date.weekday())
+    week_dates = []
+    while week_start <= end_date:
+        week_dates.append(week_start)
+        week_start += datetime.timedelta(weeks=1)
+    return week_dates
+
+def build_horizon_schedule(employees, start_date, end_date, prior_primary_counts=None, prior_backup_counts=None, seed=None):
+    # Generate an arbitrary date range in one pass. Fairness counts carry over
+    # in memory from one year to the next and weeks spanning New Year keep a
+    # single primary, so 53-week years and boundary weeks are fully covered.
+    prior_primary_counts = prior_primary_counts or {}
+    prior_backup_counts = prior_backup_counts or {}
+    rng = random.Random(seed)
+
+    total_primary_counts = {emp: prior_primary_counts.get(emp, 0) for emp in employees}
+    total_backup_counts = {emp: prior_backup_counts.get(emp, 0) for emp in employees}
+
+    week_dates = get_horizon_week_dates(start_date, end_date)
+    primary_schedule, primary_counts = assign_primaries(employees, week_dates, total_primary_counts, rng)
+
+    date_primary = {}
+    all_dates = []
+    year_primary_counts = defaultdict(lambda: {emp: 0 for emp in employees})
+    for week_start in week_dates:
+        emp = primary_schedule[week_start]
+        # A week is reported in the year its first scheduled day falls in
+        year_primary_counts[max(week_start, start_date).year][emp] += 1
+        for i in range(7):
+            date = week_start + datetime.timedelta(days=i)
+            if start_date <= date <= end_date:
+                date_primary[date] = emp
+                all_dates.append(date)
+
+    date_backup1, date_backup2, backup_counts = assign_backups(employees, all_dates, date_primary, total_backup_counts)
+
+    year_backup_counts = defaultdict(lambda: {emp: 0 for emp in employees})
+    for date in all_dates:
+        year_backup_counts[date.year][date_backup1[date]] += 1
+        year_backup_counts[date.year][date_backup2[date]] += 1
+
+    years = {}
+    for year in range(start_date.year, end_date.year + 1):
+        years[year] = {
+            'primary_counts': dict(year_primary_counts[year]),
+            'backup_counts': dict(year_backup_counts[year]),
+        }
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'seed': seed,
+        'date_primary': date_primary,
+        'date_backup1': date_backup1,
+        'date_backup2': date_backup2,
+        'primary_counts': primary_counts,
+        'backup_counts': backup_counts,
+        'years': years,
+    }
+
+def split_schedule_by_year(schedule):
+    # Per-year views of a horizon schedule, in the shape build_schedule() returns
+    by_year = {}
+    for year, counts in schedule['years'].items():
+        by_year[year] = {
+            'year': year,
+            'seed': schedule['seed'],
+            'solver_iterations': schedule.get('solver_iterations'),
+            'date_primary': {d: e for d, e in schedule['date_primary'].items() if d.year == year},
+            'date_backup1': {d: e for d, e in schedule['date_backup1'].items() if d.year == year},
+            'date_backup2': {d: e for d, e in schedule['date_backup2'].items() if d.year == year},
+            'primary_counts': counts['primary_counts'],
+            'backup_counts': counts['backup_counts'],
+        }
+    return by_year
+
+def get_horizon_workbook_path(year, out_dir=None):
+    return os.path.join(out_dir, os.path.basename(get_schedule_file(year))) if out_dir else get_schedule_file(year)
+
+def get_replaced_partial_years(start_date, end_date, out_dir=None):
+    # Years the range covers only in part that already have a workbook. Their
+    # workbook is rewritten as a whole, so the days outside the range would be lost.
+    return [year for year in range(start_date.year, end_date.year + 1)
+            if (start_date > datetime.date(year, 1, 1) or end_date < datetime.date(year, 12, 31))
+            and os.path.exists(get_horizon_workbook_path(year, out_dir))]
+
+def write_horizon_workbooks(schedule, employees, out_dir=None, teams=None, force=False):
+    # Each year's workbook is written exactly once. An existing year the range
+    # only partly covers is only replaced with force.
+    replaced = [] if force else get_replaced_partial_years(schedule['start_date'], schedule['end_date'], out_dir)
+    if replaced:
+        raise FileExistsError(f"A schedule already exists for {', '.join(map(str, replaced))}, "
+                              f"which the range only partly covers")
+    paths = []
+    for year, year_schedule in sorted(split_schedule_by_year(schedule).items()):
+        path = get_horizon_workbook_path(year, out_dir)
+        paths.append(write_schedule_workbook(year_schedule, employees, path=path, teams=teams))
+    return paths
+
+# Local-search fairness solver. Starting from the greedy result it moves single
+# backup days and whole primary weeks from the most loaded people to the least
+# loaded ones, only when the move keeps every scheduling rule, until nothing
+# improves or the time budget runs out.
+def load_spread(loads):
+    return max(loads.values()) - min(loads.values()) if loads else 0
+
+def schedule_fairness(employees, schedule, prior_primary_counts=None, prior_backup_counts=None):
+    # Counted from the calendar, so a greedy and an improved schedule compare
+    # in the same units
+    prior_primary_counts = prior_primary_counts or {}
+    prior_backup_counts = prior_backup_counts or {}
+    primary_counts, backup_counts = recalculate_counts(employees, schedule['date_primary'], schedule['date_backup1'],
+                                                       schedule['date_backup2'])
+    primary_loads = {emp: prior_primary_counts.get(emp, 0) + primary_counts[emp] for emp in employees}
+    backup_loads = {emp: prior_backup_counts.get(emp, 0) + backup_counts[emp] for emp in employees}
+    fairness = {
+        'primary_spread': load_spread(primary_loads),
+        'backup_spread': load_spread(backup_loads),
+    }
+    if load_numpy() is not None:
+        fairness['violations'] = len(validate_schedule(schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'], employees))
+    return fairness
+
+def can_take_backup(emp, date, role, date_primary, date_backup1, date_backup2):
+    one_day = datetime.timedelta(days=1)
+    other_backup = date_backup2 if role == 'Backup 1' else date_backup1
+    if date_primary.get(date) == emp or other_backup.get(date) == emp:
+        return False
+    for adjacent in (date - one_day, date + one_day):
+        if date_backup1.get(adjacent) == emp or date_backup2.get(adjacent) == emp:
+            return False
+    # Not the day before their own primary week starts
+    return not (date_primary.get(date + one_day) == emp and date_primary.get(date) != emp)
+
+def can_take_primary_week(emp, week, date_primary, date_backup1, date_backup2):
+    for date in week:
+        if date_backup1.get(date) == emp or date_backup2.get(date) == emp:
+            return False
+    before = week[0] - datetime.timedelta(days=1)
+    if date_primary.get(before) != emp and emp in (date_backup1.get(before), date_backup2.get(before)):
+        return False
+    return True
+
+def swap_backup_days(date, role, role_maps, date_primary, window=7):
+    # Exchange the holder of (date, role) with the holder of another backup day
+    # within the window when both end up within the rules. Loads are unchanged.
+    date_backup1 = role_maps['Backup 1']
+    date_backup2 = role_maps['Backup 2']
+    holder = role_maps[role][date]
+    for offset in sorted(range(-window, window + 1), key=abs):
+        other_date = date + datetime.timedelta(days=offset)
+        for other_role, other_map in role_maps.items():
+            other = other_map.get(other_date)
+            if not other or other == holder or (other_date, other_role) == (date, role):
+                continue
+            role_maps[role][date] = None
+            other_map[other_date] = None
+            if can_take_backup(other, date, role, date_primary, date_backup1, date_backup2):
+                role_maps[role][date] = other
+                if can_take_backup(holder, other_date, other_role, date_primary, date_backup1, date_backup2):
+                    other_map[other_date] = holder
+                    return True
+            role_maps[role][date] = holder
+            other_map[other_date] = other
+    return False
+
+def rebalance(employees, loads, slots, try_move, step, weight=lambda slot: 1):
+    # Repeatedly move a slot from a heavier employee to a lighter one when the
+    # gap between them is more than the slot's weight, so the move narrows it
+    moves = 0
+    improved = True
+    while improved and step():
+        improved = False
+        order = sorted(employees, key=lambda emp: loads[emp])
+        for heavy in reversed(order):
+            if not step():
+                break
+            for light in order:
+                gap = loads[heavy] - loads[light]
+                if gap < 2:
+                    break
+                slot = next((slot for slot in slots[heavy] if weight(slot) < gap and try_move(slot, light)), None)
+                if slot is not None:
+                    slots[heavy].remove(slot)
+                    slots[light].append(slot)
+                    loads[heavy] -= weight(slot)
+                    loads[light] += weight(slot)
+                    moves += 1
+                    improved = True
                     break
+    return moves
+
+def improve_schedule(employees, schedule, prior_primary_counts=None, prior_backup_counts=None, time_budget=2.0, seed=None,
+                     iterations=None):
+    # Returns (improved schedule, report); the input schedule is left untouched.
+    # The search runs in steps until time_budget is spent, or for exactly
+    # 'iterations' steps when given. The same seed and the step count a run
+    # reached (report['iterations']) give the same schedule on any machine.
+    prior_primary_counts = prior_primary_counts or {}
+    prior_backup_counts = prior_backup_counts or {}
+    started = time.perf_counter()
+    deadline = started + time_budget
+    rng = random.Random(seed)
+    steps = 0
+
+    def step():
+        nonlocal steps
+        exhausted = steps >= iterations if iterations is not None else time.perf_counter() >= deadline
+        if exhausted:
+            return False
+        steps += 1
+        return True
+
+    date_primary = dict(schedule['date_primary'])
+    date_backup1 = dict(schedule['date_backup1'])
+    date_backup2 = dict(schedule['date_backup2'])
+    role_maps = {'Backup 1': date_backup1, 'Backup 2': date_backup2}
+    # Loads are kept in recalculate_counts() units, primary days included
+    primary_counts, backup_counts = recalculate_counts(employees, date_primary, date_backup1, date_backup2)
+
+    # Repair greedy fallbacks first: hand rule-breaking backup days to the
+    # least loaded employee who can take them
+    repaired = 0
+    for role, mapping in role_maps.items():
+        for date in sorted(mapping):
+            holder = mapping[date]
+            mapping[date] = None
+            if holder and can_take_backup(holder, date, role, date_primary, date_backup1, date_backup2):
+                mapping[date] = holder
+                continue
+            candidates = [emp for emp in employees if can_take_backup(emp, date, role, date_primary, date_backup1, date_backup2)]
+            if not step():
+                mapping[date] = holder
+                continue
+            if not candidates:
+                # Nobody is free that day: swap with a backup day nearby instead
+                mapping[date] = holder
+                if holder and swap_backup_days(date, role, role_maps, date_primary):
+                    repaired += 1
+                continue
+            replacement = min(candidates, key=lambda emp: prior_backup_counts.get(emp, 0) + backup_counts[emp])
+            mapping[date] = replacement
+            if holder in backup_counts:
+                backup_counts[holder] -= 1
+            backup_counts[replacement] += 1
+            repaired += 1
+
+    # Primary weeks, identified by their Monday; a partial week at either end
+    # of the schedule weighs only the days it has
+    weeks = defaultdict(list)
+    for date in sorted(date_primary):
+        weeks[date - datetime.timedelta(days=date.weekday())].append(date)
+    primary_loads = {emp: prior_primary_counts.get(emp, 0) + primary_counts[emp] for emp in employees}
+    primary_slots = {emp: [] for emp in employees}
+    for week in weeks.values():
+        holder = date_primary[week[0]]
+        if holder in primary_slots:
+            primary_slots[holder].append(week)
+    for week_list in primary_slots.values():
+        rng.shuffle(week_list)
+
+    def move_primary_week(week, emp):
+        if not can_take_primary_week(emp, week, date_primary, date_backup1, date_backup2):
+            return False
+        for date in week:
+            date_primary[date] = emp
+        return True
+
+    primary_moves = rebalance(employees, primary_loads, primary_slots, move_primary_week, step, weight=len)
+
+    # Backup days
+    backup_loads = {emp: prior_backup_counts.get(emp, 0) + backup_counts[emp] for emp in employees}
+    backup_slots = {emp: [] for emp in employees}
+    for role, mapping in role_maps.items():
+        for date, holder in mapping.items():
+            if holder in backup_slots:
+                backup_slots[holder].append((date, role))
+    for slot_list in backup_slots.values():
+        rng.shuffle(slot_list)
+
+    def move_backup_day(slot, emp):
+        date, role = slot
+        if not can_take_backup(emp, date, role, date_primary, date_backup1, date_backup2):
+            return False
+        role_maps[role][date] = emp
+        return True
+
+    backup_moves = rebalance(employees, backup_loads, backup_slots, move_backup_day, step)
+
+    improved = dict(schedule)
+    improved.update({
+        'date_primary': date_primary,
+        'date_backup1': date_backup1,
+        'date_backup2': date_backup2,
+        'primary_counts': {emp: primary_loads[emp] - prior_primary_counts.get(emp, 0) for emp in employees},
+        'backup_counts': {emp: backup_loads[emp] - prior_backup_counts.get(emp, 0) for emp in employees},
+        'solver_iterations': steps,
+    })
+    if 'years' in schedule:
+        improved['years'] = recount_years(employees, date_primary, date_backup1, date_backup2)
+
+    report = {
+        'greedy': schedule_fairness(employees, schedule, prior_primary_counts, prior_backup_counts),
+        'improved': schedule_fairness(employees, improved, prior_primary_counts, prior_backup_counts),
+        'repaired_days': repaired,
+        'primary_moves': primary_moves,
+        'backup_moves': backup_moves,
+        'iterations': steps,
+        'elapsed': time.perf_counter() - started,
+    }
+    return improved, report
+
+def recount_years(employees, date_primary, date_backup1, date_backup2):
+    # Per-year counts as each year's workbook reports them
+    by_year = defaultdict(lambda: ({}, {}, {}))
+    for role_idx, mapping in enumerate((date_primary, date_backup1, date_backup2)):
+        for date, emp in mapping.items():
+            by_year[date.year][role_idx][date] = emp
+    years = {}
+    for year in range(min(date_primary).year, max(date_primary).year + 1):
+        primary_counts, backup_counts = recalculate_counts(employees, *by_year[year])
+        years[year] = {'primary_counts': primary_counts, 'backup_counts': backup_counts}
+    return years
+
+def format_solver_report(report):
+    greedy = report['greedy']
+    improved = report['improved']
+    lines = [
+        f"Primary spread: {greedy['primary_spread']} -> {improved['primary_spread']}",
+        f"Backup spread: {greedy['backup_spread']} -> {improved['backup_spread']}",
+    ]
+    if 'violations' in greedy:
+        lines.append(f"Rule violations: {greedy['violations']} -> {improved['violations']}")
+    lines.append(f"{report['repaired_days']} days repaired, {report['primary_moves']} primary weeks and "
+                 f"{report['backup_moves']} backup days moved in {report['elapsed']:.2f}s ({report['iterations']} steps)")
+    return lines
+
+# Multi-seed search: score many seeded greedy runs on a process pool and keep
+# the fairest. Workers only send back (score, seed); the winner is rebuilt
+# locally from its seed, so that seed alone reproduces the greedy schedule. A
+# local-search pass on top is seeded with it too and also needs its step count.
+def score_schedule(employees, schedule, prior_primary_counts=None, prior_backup_counts=None):
+    # Lower is fairer: combined max-min gap first, then combined load variance
+    prior_primary_counts = prior_primary_counts or {}
+    prior_backup_counts = prior_backup_counts or {}
+    primary_loads = [prior_primary_counts.get(emp, 0) + schedule['primary_counts'].get(emp, 0) for emp in employees]
+    backup_loads = [prior_backup_counts.get(emp, 0) + schedule['backup_counts'].get(emp, 0) for emp in employees]
+    gap = (max(primary_loads) - min(primary_loads)) + (max(backup_loads) - min(backup_loads))
+    return gap, statistics.pvariance(primary_loads) + statistics.pvariance(backup_loads)
+
+def build_seeded_schedule(employees, horizon, prior_primary_counts, prior_backup_counts, seed):
+    # horizon is a year, or a (start_date, end_date) pair for horizon mode
+    if isinstance(horizon, tuple):
+        return build_horizon_schedule(employees, horizon[0], horizon[1], prior_primary_counts, prior_backup_counts, seed=seed)
+    return build_schedule(employees, horizon, prior_primary_counts, prior_backup_counts, seed=seed)
+
+def score_seed_batch(employees, horizon, prior_primary_counts, prior_backup_counts, seeds):
+    best = None
+    for seed in seeds:
+        schedule = build_seeded_schedule(employees, horizon, prior_primary_counts, prior_backup_counts, seed)
+        candidate = (score_schedule(employees, schedule, prior_primary_counts, prior_backup_counts), seed)
+        if best is None or candidate < best:
+            best = candidate
+    return best
+
+def generate_best_schedule(employees, horizon, prior_primary_counts=None, prior_backup_counts=None,
+                           candidates=100, base_seed=0, workers=None):
+    started = time.perf_counter()
+    seeds = list(range(base_seed, base_seed + candidates))
+    workers = workers or os.cpu_count() or 1
+    # A few batches per worker keeps every core busy without per-seed overhead
+    batch_count = min(len(seeds), workers * 4)
+    batches = [seeds[i::batch_count] for i in range(batch_count)]
+    if workers == 1:
+        results = [score_seed_batch(employees, horizon, prior_primary_counts, prior_backup_counts, batch) for batch in batches]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(score_seed_batch, employees, horizon, prior_primary_counts, prior_backup_counts, batch)
+                       for batch in batches]
+            results = [future.result() for future in futures]
+    score, seed = min(results)
+    schedule = build_seeded_schedule(employees, horizon, prior_primary_counts, prior_backup_counts, seed)
+    report = {
+        'seed': seed,
+        'score': score,
+        'candidates': len(seeds),
+        'workers': workers,
+        'elapsed': time.perf_counter() - started,
+    }
+    return schedule, report
+
+# What-if absences: blackout dates per employee are worked into an existing
+# schedule by reassigning only the slots they touch, so every other day keeps
+# its assignments. Monte-Carlo runs draw random absences on a process pool and
+# measure how often that leaves slots uncovered and how far it skews loads.
+def get_day_loads(employees, date_primary, date_backup1, date_backup2):
+    primary_loads = {emp: 0 for emp in employees}
+    backup_loads = {emp: 0 for emp in employees}
+    for mapping, loads in ((date_primary, primary_loads), (date_backup1, backup_loads), (date_backup2, backup_loads)):
+        for emp in mapping.values():
+            if emp in loads:
+                loads[emp] += 1
+    return primary_loads, backup_loads
+
+def group_blackout_runs(dates):
+    # Consecutive dates, split at week boundaries like the primary rotation
+    runs = []
+    for date in sorted(dates):
+        if runs and date - runs[-1][-1] == datetime.timedelta(days=1) and date.weekday() != 0:
+            runs[-1].append(date)
+        else:
+            runs.append([date])
+    return runs
+
+def apply_blackouts(employees, schedule, blackouts):
+    # blackouts maps an employee to the dates they are away. Returns (schedule,
+    # report); the input schedule is left untouched. Uncovered slots are left
+    # blank and listed under 'gaps'.
+    date_primary = dict(schedule['date_primary'])
+    date_backup1 = dict(schedule['date_backup1'])
+    date_backup2 = dict(schedule['date_backup2'])
+    role_maps = {'Primary': date_primary, 'Backup 1': date_backup1, 'Backup 2': date_backup2}
+    primary_loads, backup_loads = get_day_loads(employees, date_primary, date_backup1, date_backup2)
+    unavailable = defaultdict(set)
+    for emp, dates in blackouts.items():
+        for date in dates:
+            if date in date_primary:
+                unavailable[date].add(emp)
+    changes = []
+    gaps = []
+
+    def reassign(date, role, emp, loads):
+        old_employee = role_maps[role][date]
+        # Counts are recounted once every slot is settled
+        changes.extend(apply_schedule_changes(date_primary, date_backup1, date_backup2, [(date, role, emp)], {}, {}))
+        if old_employee in loads:
+            loads[old_employee] -= 1
+        if emp in loads:
+            loads[emp] += 1
+        if not emp:
+            gaps.append((date, role))
+
+    # Primary days first: one cover per run of absent days within a week
+    absent_primary = defaultdict(list)
+    for date, absent in unavailable.items():
+        if date_primary[date] in absent:
+            absent_primary[date_primary[date]].append(date)
+    def primary_cover(holder, days):
+        candidates = [emp for emp in employees
+                      if emp != holder and not any(emp in unavailable.get(date, ()) for date in days)
+                      and can_take_primary_week(emp, days, date_primary, date_backup1, date_backup2)]
+        return min(candidates, key=lambda emp: primary_loads[emp], default='')
+
+    for holder, dates in absent_primary.items():
+        for run in group_blackout_runs(dates):
+            cover = primary_cover(holder, run)
+            if cover:
+                for date in run:
+                    reassign(date, 'Primary', cover, primary_loads)
             else:
-                # If no suitable candidate found, assign the next available
-                emp = eligible_employees[0]
-                date_backup2[date] = emp
-                backup_counts[emp] += 1
-                last_backup2_date[emp] = date
+                # Nobody is free for the whole run: cover it day by day
+                for date in run:
+                    reassign(date, 'Primary', primary_cover(holder, [date]), primary_loads)
+
+    # Then backup days, each to the least loaded employee who can take it
+    for date in sorted(unavailable):
+        for role in ('Backup 1', 'Backup 2'):
+            holder = role_maps[role][date]
+            if not holder or holder not in unavailable[date]:
+                continue
+            role_maps[role][date] = None
+            candidates = [emp for emp in employees if emp not in unavailable[date]
+                          and can_take_backup(emp, date, role, date_primary, date_backup1, date_backup2)]
+            role_maps[role][date] = holder
+            reassign(date, role, min(candidates, key=lambda emp: backup_loads[emp], default=''), backup_loads)
+
+    primary_counts, backup_counts = recalculate_counts(employees, date_primary, date_backup1, date_backup2)
+    simulated = dict(schedule)
+    simulated.update({
+        'date_primary': date_primary,
+        'date_backup1': date_backup1,
+        'date_backup2': date_backup2,
+        'primary_counts': primary_counts,
+        'backup_counts': backup_counts,
+    })
+    if 'years' in schedule:
+        simulated['years'] = recount_years(employees, date_primary, date_backup1, date_backup2)
+    report = {
+        'changes': changes,
+        'gaps': gaps,
+        'primary_spread': load_spread(primary_loads),
+        'backup_spread': load_spread(backup_loads),
+    }
+    return simulated, report
+
+def random_blackouts(employees, dates, rng, absence_rate, max_days):
+    # Each employee is away with probability absence_rate, for 1..max_days days
+    blackouts = {}
+    for emp in employees:
+        if rng.random() < absence_rate:
+            start = rng.choice(dates)
+            blackouts[emp] = [start + datetime.timedelta(days=i) for i in range(rng.randint(1, max_days))]
+    return blackouts
+
+def simulate_absence_batch(employees, schedule, seeds, absence_rate, max_days):
+    dates = sorted(schedule['date_primary'])
+    results = []
+    for seed in seeds:
+        blackouts = random_blackouts(employees, dates, random.Random(seed), absence_rate, max_days)
+        _, report = apply_blackouts(employees, schedule, blackouts)
+        results.append({
+            'seed': seed,
+            'absent': len(blackouts),
+            'changes': len(report['changes']),
+            'gaps': len(report['gaps']),
+            'primary_spread': report['primary_spread'],
+            'backup_spread': report['backup_spread'],
+        })
+    return results
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def simulate_absences(employees, schedule, runs=1000, absence_rate=0.1, max_days=10, base_seed=0, workers=None):
+    # Run i draws its absences from seed base_seed + i, so any run can be replayed
+    started = time.perf_counter()
+    seeds = list(range(base_seed, base_seed + runs))
+    workers = workers or os.cpu_count() or 1
+    batch_count = min(len(seeds), workers * 4)
+    batches = [seeds[i::batch_count] for i in range(batch_count)]
+    if workers == 1:
+        results = [simulate_absence_batch(employees, schedule, batch, absence_rate, max_days) for batch in batches]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(simulate_absence_batch, employees, schedule, batch, absence_rate, max_days)
+                       for batch in batches]
+            results = [future.result() for future in futures]
+    results = sorted((run for batch in results for run in batch), key=lambda run: run['seed'])
+    baseline = get_day_loads(employees, schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'])
+    return {
+        'runs': len(results),
+        'gap_probability': sum(1 for run in results if run['gaps']) / len(results),
+        'mean_gaps': statistics.mean(run['gaps'] for run in results),
+        'mean_changes': statistics.mean(run['changes'] for run in results),
+        'baseline_primary_spread': load_spread(baseline[0]),
+        'baseline_backup_spread': load_spread(baseline[1]),
+        'primary_spread_p50': percentile([run['primary_spread'] for run in results], 0.5),
+        'primary_spread_p95': percentile([run['primary_spread'] for run in results], 0.95),
+        'backup_spread_p50': percentile([run['backup_spread'] for run in results], 0.5),
+        'backup_spread_p95': percentile([run['backup_spread'] for run in results], 0.95),
+        'worst_seed': max(results, key=lambda run: (run['gaps'], run['primary_spread'] + run['backup_spread']))['seed'],
+        'workers': workers,
+        'elapsed': time.perf_counter() - started,
+    }
+
+def format_simulation_report(summary):
+    return [
+        f"{summary['runs']} runs in {summary['elapsed']:.2f}s on {summary['workers']} worker(s)",
+        f"Runs with uncovered slots: {summary['gap_probability']:.1%} (mean {summary['mean_gaps']:.2f} slots)",
+        f"Reassigned slots per run: {summary['mean_changes']:.1f}",
+        f"Primary day spread: {summary['baseline_primary_spread']} -> "
+        f"p50 {summary['primary_spread_p50']}, p95 {summary['primary_spread_p95']}",
+        f"Backup day spread: {summary['baseline_backup_spread']} -> "
+        f"p50 {summary['backup_spread_p50']}, p95 {summary['backup_spread_p95']}",
+        f"Worst run: seed {summary['worst_seed']}",
+    ]
+
+# Multi-team generation: every team gets its own schedule, built in parallel
+# on a process pool, and its own workbook under Teams/<team>/. Employees on
+# several teams may hold only one role per day, so once the shards are back
+# the teams are merged in name order: each team treats its shared members'
+# days in earlier teams as blackout dates, and apply_blackouts() hands those
+# slots to someone else with minimal churn.
+TEAMS_FOLDER_NAME = 'Teams'
+
+def group_teams(teams):
+    # {team: [employees]} in employee-list order from {employee: [teams]}
+    members = defaultdict(list)
+    for emp, emp_teams in teams.items():
+        for team in emp_teams:
+            if emp not in members[team]:
+                members[team].append(emp)
+    return dict(sorted(members.items()))
+
+def get_team_folder(team):
+    return os.path.join(SCHEDULING_FOLDER, TEAMS_FOLDER_NAME, get_safe_name(team))
+
+def get_team_schedule_file(team, year):
+    return os.path.join(get_team_folder(team), os.path.basename(get_schedule_file(year)))
+
+def load_team_prior_counts(team, year, employees):
+    # The team's 'Reports' counts from the year before, when that workbook exists
+    path = get_team_schedule_file(team, year - 1)
+    counts = read_report_counts(open_workbook(path)) if os.path.exists(path) else None
+    primary_counts, backup_counts = counts or ({}, {})
+    return ({emp: primary_counts.get(emp, 0) for emp in employees},
+            {emp: backup_counts.get(emp, 0) for emp in employees})
+
+def build_team_schedule(team, employees, year, prior_primary_counts, prior_backup_counts, seed):
+    return team, build_schedule(employees, year, prior_primary_counts, prior_backup_counts, seed=seed)
+
+def resolve_shared_employees(members, schedules):
+    # Returns {team: (schedule, report)} with no employee on two teams' rolls
+    # on the same day; earlier teams (by name) keep their assignments. Each
+    # team's counts are recounted from its final mappings, as its workbook
+    # 'Reports' would be after any edit.
+    busy = defaultdict(set)  # employee -> dates already held in an earlier team
+    resolved = {}
+    for team, employees in members.items():
+        schedule = schedules[team]
+        blackouts = {emp: busy[emp] for emp in employees if busy.get(emp)}
+        if blackouts:
+            schedule, report = apply_blackouts(employees, schedule, blackouts)
         else:
-            # If no eligible employees, assign any employee not primary or backup1
-            emp = [e for e in employees if e not in [primary, date_backup1[date]]][0]
-            date_backup2[date] = emp
-            backup_counts[emp] += 1
-            last_backup2_date[emp] = date
+            schedule = dict(schedule)
+            schedule['primary_counts'], schedule['backup_counts'] = recalculate_counts(
+                employees, schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'])
+            report = {'changes': [], 'gaps': []}
+        resolved[team] = (schedule, report)
+        for mapping in (schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2']):
+            for date, emp in mapping.items():
+                if emp:
+                    busy[emp].add(date)
+    return resolved
+
+def merge_team_reports(members, resolved):
+    # Per-employee day loads summed over every team, plus each team's spreads
+    employee_loads = {}
+    team_rows = []
+    for team, employees in members.items():
+        schedule, report = resolved[team]
+        primary_loads, backup_loads = get_day_loads(employees, schedule['date_primary'],
+                                                    schedule['date_backup1'], schedule['date_backup2'])
+        for emp in employees:
+            loads = employee_loads.setdefault(emp, {'teams': [], 'primary': 0, 'backup': 0})
+            loads['teams'].append(team)
+            loads['primary'] += primary_loads[emp]
+            loads['backup'] += backup_loads[emp]
+        team_rows.append({
+            'team': team,
+            'employees': len(employees),
+            'primary_spread': load_spread(primary_loads),
+            'backup_spread': load_spread(backup_loads),
+            'reassigned': len(report['changes']),
+            'gaps': len(report['gaps']),
+        })
+    return employee_loads, team_rows
+
+def write_team_report(path, year, employee_loads, team_rows):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    report_sheet = workbook.create_sheet('Reports')
+    report_sheet.append(['Employee', 'Teams', 'Primary Days', 'Backup Days'])
+    for emp, loads in employee_loads.items():
+        report_sheet.append([emp, format_teams(loads['teams']), loads['primary'], loads['backup']])
+    team_sheet = workbook.create_sheet('Teams')
+    team_sheet.append(['Team', 'Employees', 'Primary Spread', 'Backup Spread', 'Reassigned Slots', 'Uncovered Slots'])
+    for row in team_rows:
+        team_sheet.append([row['team'], row['employees'], row['primary_spread'], row['backup_spread'],
+                           row['reassigned'], row['gaps']])
+    write_file_atomic(path, workbook.save)
+    return path
+
+def generate_team_schedules(teams, year, seed=0, workers=None, use_prior=True):
+    # teams is {employee: [teams]}. Returns (paths, employee_loads, team_rows).
+    members = group_teams(teams)
+    priors = {team: load_team_prior_counts(team, year, employees) if use_prior else ({}, {})
+              for team, employees in members.items()}
+    jobs = [(team, employees, year, *priors[team], seed + idx) for idx, (team, employees) in enumerate(members.items())]
+    workers = workers or os.cpu_count() or 1
+    with timed_phase('team_generation', teams=len(jobs), workers=workers):
+        if workers == 1 or len(jobs) == 1:
+            schedules = dict(build_team_schedule(*job) for job in jobs)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                schedules = dict(pool.map(build_team_schedule, *zip(*jobs)))
+    resolved = resolve_shared_employees(members, schedules)
+
+    paths = []
+    for team, employees in members.items():
+        schedule = resolved[team][0]
+        path = get_team_schedule_file(team, year)
+        team_of = {emp: teams[emp] for emp in employees}
+        paths.append(write_schedule_workbook(schedule, employees, path=path, teams=team_of))
+    employee_loads, team_rows = merge_team_reports(members, resolved)
+    report_path = os.path.join(SCHEDULING_FOLDER, TEAMS_FOLDER_NAME, f"{year} Team Reports.xlsx")
+    paths.append(write_team_report(report_path, year, employee_loads, team_rows))
+    return paths, employee_loads, team_rows
+
+@timed('prior_year_loading')
+def load_prior_counts(year, employees, compensate=False, decay=None):
+    # Load previous year's counts, or decayed counts over every earlier year
+    previous_year = year - 1
+    if decay is None:
+        prev_primary_counts, prev_backup_counts = load_previous_year_counts(previous_year)
+    else:
+        prev_primary_counts, prev_backup_counts = decayed_history_counts(year, employees, decay)
+    prior_primary_counts = {emp: prev_primary_counts.get(emp, 0) for emp in employees}
+    prior_backup_counts = {emp: prev_backup_counts.get(emp, 0) for emp in employees}
+    if compensate:
+        apply_workload_compensation(prior_primary_counts, get_workload_differences(previous_year))
+    return prior_primary_counts, prior_backup_counts
+
+def get_workload_differences(previous_year):
+    # Load differences due to schedule edits
+    prev_original_counts, prev_edited_counts = load_previous_year_edit_differences(previous_year)
+    return calculate_workload_differences(prev_original_counts, prev_edited_counts)
+
+def apply_workload_compensation(total_primary_counts, workload_differences):
+    # Adjust counts to compensate
+    for emp in total_primary_counts:
+        total_primary_counts[emp] += workload_differences.get(emp, 0)
+        # Ensure counts don't go negative
+        total_primary_counts[emp] = max(total_primary_counts[emp], 0)
+
+def write_schedule_workbook(schedule, employees, path=None, teams=None):
+    year = schedule['year']
+    path = path or get_schedule_file(year)
+
+    # Stream the calendar and both report sheets, then save the store it renders
+    export_schedule_workbook(path, year, employees, schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'],
+                             schedule['primary_counts'], schedule['backup_counts'], teams=teams)
+    # A regenerated year starts from here; older journal entries are history only
+    metadata = {'year': year, 'seed': schedule['seed'], 'journal_seq': last_journal_seq(get_journal_path(path)),
+                'counts': get_store_counts(*recalculate_counts(employees, schedule['date_primary'], schedule['date_backup1'],
+                                                              schedule['date_backup2']))}
+    if schedule.get('solver_iterations') is not None:
+        metadata['solver_iterations'] = schedule['solver_iterations']
+    write_schedule_store(get_store_path(path), schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'],
+                         metadata)
+    return path
 
-    # Create workbook and sheets
-    workbook = get_workbook(year)
+def generate_schedule():
+    clear_screen()
+    employees = load_employees()
 
-    # Clear existing month sheets
-    for month in range(1, 13):
-        month_name = datetime.date(year, month, 1).strftime('%B')
-        if month_name in workbook.sheetnames:
-            sheet = workbook[month_name]
-            workbook.remove(sheet)
-        workbook.create_sheet(month_name)
+    if not employees:
+        print_centered("Employee list is empty. Add employees first.", Fore.RED)
+        pause()
+        return
+
+    # Prompt for the year
+    while True:
+        year_input = input("Enter the year for which you want to generate the schedule (e.g., 2025): ").strip()
+        if year_input.isdigit() and int(year_input) >= datetime.datetime.now().year:
+            year = int(year_input)
+            break
+        else:
+            print_centered("Please enter a valid future year.", Fore.RED)
 
-    # Populate calendar sheets
-    create_calendar_sheets(workbook, date_primary, date_backup1, date_backup2, year)
+    # Check if schedule already exists
+    existing_years = get_existing_schedule_years()
+    if year in existing_years:
+        confirm = input(f"A schedule for {year} already exists. Do you want to overwrite it? (y/n): ").strip().lower()
+        if confirm != 'y':
+            print_centered("Schedule generation canceled.", Fore.BLUE)
+            pause()
+            return
 
-    # Generate reports
-    generate_reports(workbook, employees, primary_counts, backup_counts)
-    # Save original counts to 'Original Reports' sheet
-    generate_reports(workbook, employees, primary_counts, backup_counts, sheet_name='Original Reports')
+    prior_primary_counts, prior_backup_counts = load_prior_counts(year, employees)
 
-    # Save the workbook
-    workbook.save(get_schedule_file(year))
-    print_centered(f"Schedule generated and saved to {get_schedule_file(year)}", Fore.BLUE)
+    # Inform the user about workload differences
+    workload_differences = get_workload_differences(year - 1)
+    if workload_differences:
+        print_centered("Detected workload differences due to schedule edits in the previous year:", Fore.YELLOW)
+        for emp, diff in workload_differences.items():
+            if diff != 0:
+                print_centered(f"{emp}: {'Worked less' if diff > 0 else 'Worked more'} by {abs(diff)} assignments.")
+        adjust = input("Do you want to adjust the new schedule to compensate? (y/n): ").strip().lower()
+        if adjust == 'y':
+            apply_workload_compensation(prior_primary_counts, workload_differences)
+
+    schedule = build_schedule(employees, year, prior_primary_counts, prior_backup_counts)
+    path = write_schedule_workbook(schedule, employees, teams=load_employee_teams())
+    print_centered(f"Schedule generated and saved to {path}", Fore.BLUE)
     pause()
 
+CALENDAR_WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+CALENDAR_ROW_HEIGHT = 15 + 7.5  # Default row height plus extra space (~10 pixels)
+
+def get_calendar_styles():
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+    thin_border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    return [
+        NamedStyle(
+            name='Calendar Title',
+            font=Font(size=14, bold=True),
+            alignment=Alignment(horizontal='center'),
+            border=Border(bottom=Side(style='medium')),
+        ),
+        NamedStyle(
+            name='Calendar Weekday',
+            font=Font(bold=True),
+            alignment=Alignment(horizontal='center', vertical='top'),
+            border=thin_border,
+            fill=PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid"),
+        ),
+        NamedStyle(
+            name='Calendar Day',
+            font=Font(name='Calibri', size=11),
+            alignment=Alignment(wrap_text=True, horizontal='left', vertical='top'),
+            border=thin_border,
+            fill=PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid"),
+        ),
+    ]
+
+def register_calendar_styles(workbook):
+    # Named styles are stored once per workbook and shared by every cell
+    for style in get_calendar_styles():
+        if style.name not in workbook.named_styles:
+            workbook.add_named_style(style)
+
+def format_calendar_cell(day_num, primary, backup1, backup2):
+    return f"Day {day_num}\nP:\n{primary}\n\nB1:\n{backup1}\n\nB2:\n{backup2}"
+
+# Reverse of format_calendar_cell(); tolerates the stray whitespace and CRLF
+# line breaks that editing a cell by hand in Excel can leave behind
+CALENDAR_CELL_PATTERN = re.compile(
+    r'\s*Day[ \t]+(\d+)[ \t]*\r?\n'
+    r'[ \t]*P:[ \t]*\r?\n(.*)\r?\n\s*'
+    r'B1:[ \t]*\r?\n(.*)\r?\n\s*'
+    r'B2:[ \t]*(?:\r?\n(.*?))?\s*')
+
+# Hidden sheet with one row per month: the month number and a JSON list of
+# [primary, backup 1, backup 2] for each of its days. The calendar cells stay
+# authoritative: the parser only uses a day's entry while its cell text still
+# matches it.
+SCHEDULE_DATA_SHEET = 'Schedule Data'
+SCHEDULE_DATA_HEADER = ['Month', 'Assignments']
+
+def get_schedule_data_row(year, month, date_primary, date_backup1, date_backup2):
+    days = []
+    for day_num in range(1, calendar.monthrange(year, month)[1] + 1):
+        date = datetime.date(year, month, day_num)
+        days.append([date_primary.get(date, ''), date_backup1.get(date, ''), date_backup2.get(date, '')])
+    return [month, json.dumps(days)]
+
+def write_schedule_data_sheet(workbook, year, date_primary, date_backup1, date_backup2, months=range(1, 13)):
+    if SCHEDULE_DATA_SHEET not in workbook.sheetnames:
+        sheet = workbook.create_sheet(SCHEDULE_DATA_SHEET)
+        sheet.sheet_state = 'hidden'
+        sheet.append(SCHEDULE_DATA_HEADER)
+        months = range(1, 13)
+    sheet = workbook[SCHEDULE_DATA_SHEET]
+    for month in months:
+        for col, value in enumerate(get_schedule_data_row(year, month, date_primary, date_backup1, date_backup2), start=1):
+            sheet.cell(row=month + 1, column=col, value=value)
+
+def get_calendar_layout(year, month, date_primary, date_backup1, date_backup2):
+    # Title, weeks of 7 cell texts (None for blank cells) from row 3, and the
+    # column widths, all computed from the data before anything is written
+    first_day = datetime.date(year, month, 1)
+    num_days = calendar.monthrange(year, month)[1]
+    title = first_day.strftime('%B %Y')
+
+    weeks = []
+    week = [None] * first_day.weekday()  # Monday is 0
+    for day_num in range(1, num_days + 1):
+        date = datetime.date(year, month, day_num)
+        week.append(format_calendar_cell(day_num, date_primary.get(date, ''), date_backup1.get(date, ''), date_backup2.get(date, '')))
+        if len(week) == 7:
+            weeks.append(week)
+            week = []
+    if week:
+        weeks.append(week + [None] * (7 - len(week)))
+
+    # Adjust the column widths based on the maximum content width
+    widths = [len(day) for day in CALENDAR_WEEKDAYS]
+    widths[0] = max(widths[0], len(title))
+    for week in weeks:
+        for idx, text in enumerate(week):
+            if text:
+                widths[idx] = max(widths[idx], max(len(line) for line in text.split('\n')))
+    widths = [width + 2 for width in widths]
+    return title, weeks, widths
+
+@timed('sheet_rendering')
 def create_calendar_sheets(workbook, date_primary, date_backup1, date_backup2, year):
+    register_calendar_styles(workbook)
     for month in range(1, 13):
         month_name = datetime.date(year, month, 1).strftime('%B')
         if month_name not in workbook.sheetnames:
@@ -369,94 +1685,143 @@ def create_calendar_sheets(workbook, date_primary, date_backup1, date_backup2, y
         create_calendar_sheet(sheet, year, month, date_primary, date_backup1, date_backup2)
 
 def create_calendar_sheet(sheet, year, month, date_primary, date_backup1, date_backup2):
+    # Expects the 'Calendar ...' named styles to be registered on the workbook
+    from openpyxl.utils import get_column_letter
     sheet.sheet_view.showGridLines = False  # Hide default gridlines
-
-    # Styling
-    day_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    font = Font(name='Calibri', size=11)
-    align = Alignment(horizontal='center', vertical='top')
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-
-    # Get first day of the month and number of days
-    first_day = datetime.date(year, month, 1)
-    if month == 12:
-        num_days = 31
-    else:
-        next_month = datetime.date(year, month + 1, 1)
-        num_days = (next_month - first_day).days
-    start_day = first_day.weekday()  # Monday is 0
+    title, weeks, widths = get_calendar_layout(year, month, date_primary, date_backup1, date_backup2)
 
     # Add month and year title
     sheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=7)
     title_cell = sheet.cell(row=1, column=1)
-    title_cell.value = first_day.strftime('%B %Y')
-    title_cell.font = Font(size=14, bold=True)
-    title_cell.alignment = Alignment(horizontal='center')
-    title_cell.border = Border(bottom=Side(style='medium'))
+    title_cell.value = title
+    title_cell.style = 'Calendar Title'
 
     # Weekday headers
-    weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    for i, day in enumerate(weekdays, start=1):
+    for i, day in enumerate(CALENDAR_WEEKDAYS, start=1):
         cell = sheet.cell(row=2, column=i)
         cell.value = day
-        cell.font = Font(bold=True)
-        cell.alignment = align
-        cell.border = thin_border
-        cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-
-    row = 3
-    col = start_day + 1
-    day_num = 1
-
-    while day_num <= num_days:
-        for col in range(col, 8):
-            if day_num > num_days:
-                break
-            date = datetime.date(year, month, day_num)
-            primary = date_primary.get(date, '')
-            backup1 = date_backup1.get(date, '')
-            backup2 = date_backup2.get(date, '')
-            cell = sheet.cell(row=row, column=col)
-            cell.value = f"Day {day_num}\nP:\n{primary}\n\nB1:\n{backup1}\n\nB2:\n{backup2}"
-            cell.alignment = Alignment(wrap_text=True, horizontal='left', vertical='top')
-            cell.fill = day_fill
-            cell.font = font
-            cell.border = thin_border
-            day_num += 1
-
-        col = 1
-        row += 1
+        cell.style = 'Calendar Weekday'
 
-    # Adjust the column widths based on the maximum content width
-    for idx, col in enumerate(sheet.columns, 1):
-        max_length = 0
-        col_letter = get_column_letter(idx)  # Get the column letter using the index
-        for cell in col:
-            # Skip merged cells
-            if isinstance(cell, MergedCell):
-                continue
-            if cell.value:
-                cell_length = max(len(line) for line in str(cell.value).split('\n'))
-                if cell_length > max_length:
-                    max_length = cell_length
-        adjusted_width = (max_length + 2)
-        sheet.column_dimensions[col_letter].width = adjusted_width
-
-    # Adjust row heights to add extra space between rows
-    for row_idx in range(3, sheet.max_row + 1):
-        row_height = sheet.row_dimensions[row_idx].height
-        if not row_height:
-            row_height = 15  # Default row height
-        sheet.row_dimensions[row_idx].height = row_height + 7.5  # Add extra space (~10 pixels)
+    for row, week in enumerate(weeks, start=3):
+        for col, text in enumerate(week, start=1):
+            if text is not None:
+                cell = sheet.cell(row=row, column=col)
+                cell.value = text
+                cell.style = 'Calendar Day'
+        sheet.row_dimensions[row].height = CALENDAR_ROW_HEIGHT
+
+    for idx, width in enumerate(widths, start=1):
+        sheet.column_dimensions[get_column_letter(idx)].width = width
 
     # Freeze panes so that the weekday headers stay visible
     sheet.freeze_panes = 'A3'
 
+def stream_calendar_sheet(workbook, year, month, date_primary, date_backup1, date_backup2):
+    # Write-only counterpart of create_calendar_sheet(): rows are streamed to
+    # disk once and every cell refers to a shared named style
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+    title, weeks, widths = get_calendar_layout(year, month, date_primary, date_backup1, date_backup2)
+    sheet = workbook.create_sheet(datetime.date(year, month, 1).strftime('%B'))
+    sheet.sheet_view.showGridLines = False
+    sheet.freeze_panes = 'A3'
+    for idx, width in enumerate(widths, start=1):
+        sheet.column_dimensions[get_column_letter(idx)].width = width
+    for row in range(3, len(weeks) + 3):
+        sheet.row_dimensions[row].height = CALENDAR_ROW_HEIGHT
+    sheet.merged_cells.add('A1:G1')
+
+    def styled(value, style):
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.style = style
+        return cell
+
+    sheet.append([styled(title, 'Calendar Title')])
+    sheet.append([styled(day, 'Calendar Weekday') for day in CALENDAR_WEEKDAYS])
+    for week in weeks:
+        sheet.append([styled(text, 'Calendar Day') if text is not None else None for text in week])
+
+def get_schedule_sheet_names(year):
+    return (['Employee List', JOURNAL_SHEET] + [datetime.date(year, month, 1).strftime('%B') for month in range(1, 13)]
+            + ['Reports', 'Original Reports', SCHEDULE_DATA_SHEET])
+
+def get_extra_sheets(path, year):
+    # Sheets a user added to an existing year workbook; regenerating keeps them
+    if _writer is not None:
+        _writer.flush(path)
+    if not os.path.exists(path):
+        return []
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    names = workbook.sheetnames
+    workbook.close()
+    generated = set(get_schedule_sheet_names(year))
+    return [name for name in names if name not in generated]
+
+def export_schedule_workbook(path, year, employees, date_primary, date_backup1, date_backup2, primary_counts, backup_counts,
+                             teams=None):
+    # Stream a complete year workbook with openpyxl's write-only mode so time
+    # and memory stay flat no matter how many sheets are written. A workbook
+    # with sheets of its own is regenerated in place instead, so they survive.
+    extra_sheets = get_extra_sheets(path, year)
+    if extra_sheets:
+        workbook = open_workbook(path)
+        for name in get_schedule_sheet_names(year):
+            if name in workbook.sheetnames:
+                del workbook[name]
+    else:
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        for style in get_calendar_styles():
+            workbook.add_named_style(style)
+
+    employee_sheet = workbook.create_sheet('Employee List')
+    if teams:
+        employee_sheet.append(['Employee', 'Team'])
+        for emp in employees:
+            employee_sheet.append([emp, format_teams(teams.get(emp, []))])
+    else:
+        employee_sheet.append(['Employee'])
+        for emp in employees:
+            employee_sheet.append([emp])
+    journal_sheet = workbook.create_sheet(JOURNAL_SHEET)
+    journal_sheet.append(JOURNAL_HEADER)
+    for entry in read_journal(get_journal_path(path)):
+        journal_sheet.append(get_journal_row(entry))
+
+    with timed_phase('sheet_rendering', year=year, streaming=not extra_sheets):
+        if extra_sheets:
+            render_calendar_months(workbook, year, range(1, 13), date_primary, date_backup1, date_backup2)
+        else:
+            for month in range(1, 13):
+                stream_calendar_sheet(workbook, year, month, date_primary, date_backup1, date_backup2)
+
+    report_sheet = workbook.create_sheet('Reports')
+    report_sheet.append(['Employee', 'Primary Count', 'Backup Count'])
+    for emp in employees:
+        report_sheet.append([emp, primary_counts.get(emp, 0), backup_counts.get(emp, 0)])
+    # The original primary load in days too, so edits can be measured in days
+    primary_days = Counter(date_primary.values())
+    original_sheet = workbook.create_sheet('Original Reports')
+    original_sheet.append(['Employee', 'Primary Count', 'Backup Count', 'Primary Days'])
+    for emp in employees:
+        original_sheet.append([emp, primary_counts.get(emp, 0), backup_counts.get(emp, 0), primary_days[emp]])
+
+    data_sheet = workbook.create_sheet(SCHEDULE_DATA_SHEET)
+    data_sheet.sheet_state = 'hidden'
+    data_sheet.append(SCHEDULE_DATA_HEADER)
+    for month in range(1, 13):
+        data_sheet.append(get_schedule_data_row(year, month, date_primary, date_backup1, date_backup2))
+
+    # The user's sheets go back behind the generated ones, in their old order
+    for name in extra_sheets:
+        workbook.move_sheet(name, len(workbook.sheetnames) - 1 - workbook.sheetnames.index(name))
+
+    with timed_phase('workbook_save', path=path, streaming=not extra_sheets):
+        write_file_atomic(path, workbook.save)
+    evict_workbook(path)
+
+@timed('report_generation')
 def generate_reports(workbook, employees, primary_counts, backup_counts, sheet_name='Reports'):
     # Create or get the reports sheet
     if sheet_name in workbook.sheetnames:
@@ -469,122 +1834,1245 @@ def generate_reports(workbook, employees, primary_counts, backup_counts, sheet_n
     for emp in employees:
         report_sheet.append([emp, primary_counts.get(emp, 0), backup_counts.get(emp, 0)])
 
+@timed('count_recalculation')
 def recalculate_counts(employees, date_primary, date_backup1, date_backup2):
     primary_counts = {emp: 0 for emp in employees}
     backup_counts = {emp: 0 for emp in employees}
 
-    #logging.debug('Starting to recalculate counts.')
-    #logging.debug('Employees: %s', employees)
+    logger.debug('Starting to recalculate counts.')
+    logger.debug('Employees: %s', employees)
 
     for date in date_primary:
         primary = date_primary[date]
         if primary in primary_counts:
             primary_counts[primary] += 1
-            #logging.debug('Incremented primary count for %s on %s. New count: %d', primary, date, primary_counts[primary])
-        #else:
-            #logging.warning('Primary employee %s on %s not found in employee list.', primary, date)
+            logger.debug('Incremented primary count for %s on %s. New count: %d', primary, date, primary_counts[primary])
+        elif primary:
+            logger.warning('Primary employee %s on %s not found in employee list.', primary, date)
 
     for date in date_backup1:
         backup1 = date_backup1[date]
         if backup1 in backup_counts:
             backup_counts[backup1] += 1
-            #logging.debug('Incremented backup1 count for %s on %s. New count: %d', backup1, date, backup_counts[backup1])
-        #else:
-            #logging.warning('Backup1 employee %s on %s not found in employee list.', backup1, date)
+            logger.debug('Incremented backup1 count for %s on %s. New count: %d', backup1, date, backup_counts[backup1])
+        elif backup1:
+            logger.warning('Backup1 employee %s on %s not found in employee list.', backup1, date)
 
     for date in date_backup2:
         backup2 = date_backup2[date]
         if backup2 in backup_counts:
             backup_counts[backup2] += 1
-            #logging.debug('Incremented backup2 count for %s on %s. New count: %d', backup2, date, backup_counts[backup2])
-        #else:
-            #logging.warning('Backup2 employee %s on %s not found in employee list.', backup2, date)
+            logger.debug('Incremented backup2 count for %s on %s. New count: %d', backup2, date, backup_counts[backup2])
+        elif backup2:
+            logger.warning('Backup2 employee %s on %s not found in employee list.', backup2, date)
 
-    #logging.debug('Finished recalculating counts.')
-    #logging.debug('Final primary counts: %s', primary_counts)
-    #logging.debug('Final backup counts: %s', backup_counts)
+    logger.debug('Finished recalculating counts.')
+    logger.debug('Final primary counts: %s', primary_counts)
+    logger.debug('Final backup counts: %s', backup_counts)
 
     return primary_counts, backup_counts
 
 
-def load_schedule_data(year):
-    workbook = get_workbook(year)
+# Schedule rule validation. Assignments become NumPy arrays of employee ids
+# (-1 for unassigned) over consecutive days so every rule is one array pass.
+VIOLATION_RULES = {
+    'double-role': "holds more than one role on the same day",
+    'consecutive-backup': "is backup on two consecutive days",
+    'backup-before-primary': "is backup the day before their primary week",
+    'max-primary-load': "exceeds the maximum primary days",
+    'max-backup-load': "exceeds the maximum backup days",
+}
+
+def schedule_to_arrays(date_primary, date_backup1, date_backup2, employees=None):
+    np = load_numpy()
+    names = list(employees or [])
+    ids = {name: idx for idx, name in enumerate(names)}
+    dates = set(date_primary) | set(date_backup1) | set(date_backup2)
+    if not dates:
+        return None, names, np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.int32)
+    first = min(dates).toordinal()
+    span = max(dates).toordinal() - first + 1
+
+    def column(mapping):
+        values = np.full(span, -1, dtype=np.int32)
+        for date, name in mapping.items():
+            if name:
+                if name not in ids:
+                    ids[name] = len(names)
+                    names.append(name)
+                values[date.toordinal() - first] = ids[name]
+        return values
+
+    return first, names, column(date_primary), column(date_backup1), column(date_backup2)
+
+def validate_schedule(date_primary, date_backup1, date_backup2, employees=None, max_primary_days=None, max_backup_days=None):
+    np = load_numpy()
+    if np is None:
+        raise RuntimeError("Schedule validation needs NumPy (pip install numpy).")
+    first, names, primary, backup1, backup2 = schedule_to_arrays(date_primary, date_backup1, date_backup2, employees)
+    found = []  # (rule, day offsets, employee ids)
+
+    # No double roles on a day
+    for a, b in ((primary, backup1), (primary, backup2), (backup1, backup2)):
+        days = np.flatnonzero((a == b) & (a >= 0))
+        found.append(('double-role', days, a[days]))
+
+    # No backup on consecutive days, in either backup role
+    for a, b in ((backup1, backup1), (backup1, backup2), (backup2, backup1), (backup2, backup2)):
+        days = np.flatnonzero((a[:-1] == b[1:]) & (a[:-1] >= 0)) + 1
+        found.append(('consecutive-backup', days, b[days]))
+
+    # No backup on the day before a primary week starts
+    week_start = (primary[1:] >= 0) & (primary[1:] != primary[:-1])
+    for backup in (backup1, backup2):
+        days = np.flatnonzero(week_start & (backup[:-1] == primary[1:]))
+        found.append(('backup-before-primary', days, backup[days]))
+
+    violations = []
+    seen = set()
+    for rule, days, emp_ids in found:
+        for day, emp_id in zip(days.tolist(), emp_ids.tolist()):
+            if (rule, day, emp_id) not in seen:
+                seen.add((rule, day, emp_id))
+                violations.append({
+                    'rule': rule,
+                    'date': datetime.date.fromordinal(first + day),
+                    'employee': names[emp_id],
+                    'detail': f"{names[emp_id]} {VIOLATION_RULES[rule]}",
+                })
+    violations.sort(key=lambda v: (v['date'], v['rule'], v['employee']))
+
+    # Maximum load per person over the whole horizon
+    for rule, limit, columns in (('max-primary-load', max_primary_days, (primary,)),
+                                 ('max-backup-load', max_backup_days, (backup1, backup2))):
+        if limit is None:
+            continue
+        assigned = np.concatenate(columns)
+        loads = np.bincount(assigned[assigned >= 0], minlength=len(names))
+        for emp_id in np.flatnonzero(loads > limit).tolist():
+            violations.append({
+                'rule': rule,
+                'date': None,
+                'employee': names[emp_id],
+                'detail': f"{names[emp_id]} {VIOLATION_RULES[rule]} ({loads[emp_id]} > {limit})",
+            })
+    return violations
+
+def print_violations(violations, limit=20):
+    if not violations:
+        print_centered("All schedule rules are satisfied.", Fore.GREEN)
+        return
+    print_centered(f"{len(violations)} schedule rule violation(s):", Fore.YELLOW)
+    for violation in violations[:limit]:
+        when = violation['date'].strftime('%Y-%m-%d') if violation['date'] else 'Whole schedule'
+        print_centered(f"{when}: {violation['detail']}", Fore.YELLOW)
+    if len(violations) > limit:
+        print_centered(f"... and {len(violations) - limit} more", Fore.YELLOW)
+
+
+# Fairness analytics across years. Every year is packed into one set of
+# per-day employee id arrays (-1 for nobody); per-employee figures come from
+# bincounts and ufunc reductions over the sorted (employee, day) duty pairs,
+# so the cost grows with the number of days, not with the roster.
+ANALYTICS_COLUMNS = [
+    'employee', 'primary_days', 'backup_days', 'weekend_days', 'holiday_days',
+    'mean_gap', 'min_gap', 'longest_stretch', 'primary_edit_delta', 'backup_edit_delta',
+]
+
+def load_schedule_arrays(years):
+    # (day ordinals, names, primary, backup 1, backup 2) over all the years.
+    # Years without a single assignment (a workbook opened but never
+    # generated) are left out.
+    np = load_numpy()
+    ids = {}
+    ordinals = []
+    columns = ([], [], [])
+    for year in sorted(years):
+        store = load_schedule_store(year)
+        if store is None or has_journal_tail(year, store):
+            store = pack_schedule(*load_schedule_data(year), dates=get_year_dates(year))
+        local = [np.frombuffer(store[key], dtype=np.uint16).astype(np.int64) for key in ('primary', 'backup1', 'backup2')]
+        if all((year_ids == STORE_UNASSIGNED).all() for year_ids in local):
+            continue
+        # Year-local ids to global ones; the extra last entry maps 'unassigned' to -1
+        lookup = np.array([ids.setdefault(name, len(ids)) for name in store['names']] + [-1], dtype=np.int64)
+        ordinals.append(np.frombuffer(store['days'], dtype=np.uint32).astype(np.int64))
+        for column, year_ids in zip(columns, local):
+            column.append(lookup[np.where(year_ids == STORE_UNASSIGNED, len(lookup) - 1, year_ids)])
+    names = sorted(ids, key=ids.get)
+    if not ordinals:
+        empty = np.empty(0, np.int64)
+        return empty, names, empty, empty, empty
+    return (np.concatenate(ordinals), names) + tuple(np.concatenate(column) for column in columns)
+
+def gini(values):
+    # 0 when everyone carries the same load, approaching 1 when one person carries it all
+    np = load_numpy()
+    values = np.sort(np.asarray(values, dtype=np.float64))
+    total = values.sum()
+    if not len(values) or total == 0:
+        return 0.0
+    ranks = np.arange(1, len(values) + 1)
+    return float(2 * (ranks * values).sum() / (len(values) * total) - (len(values) + 1) / len(values))
+
+def get_edit_deltas(years, names, ordinals, primary, backup1, backup2):
+    # Days on the calendar now minus the days 'Original Reports' recorded at
+    # generation, per employee, summed over the years. Both sides are in days;
+    # years generated before 'Original Reports' had a 'Primary Days' column
+    # cannot be compared and are left out.
+    np = load_numpy()
+    count = len(names)
+    index = {name: idx for idx, name in enumerate(names)}
+    deltas = {'primary': np.zeros(count, np.int64), 'backup': np.zeros(count, np.int64)}
+    history = load_schedule_history()
+    for year in years:
+        entry = history.get(year)
+        if not entry or not entry.get('original_days'):
+            continue
+        in_year = (ordinals >= datetime.date(year, 1, 1).toordinal()) & (ordinals < datetime.date(year + 1, 1, 1).toordinal())
+        if not in_year.any():
+            continue
+        for key, columns in (('primary', (primary,)), ('backup', (backup1, backup2))):
+            for column in columns:
+                ids = column[in_year]
+                deltas[key] += np.bincount(ids[ids >= 0], minlength=count)
+            for emp, days in entry['original_days'][key].items():
+                if emp in index:
+                    deltas[key][index[emp]] -= days or 0
+    return deltas
+
+@timed('fairness_analytics')
+def compute_fairness_analytics(years, employees=None, holidays=None):
+    # Returns (rows, summary): one dict per employee with ANALYTICS_COLUMNS and
+    # Gini/variance scores of the day loads. Gaps count the days off between
+    # two stretches on duty; NaN when there is only one stretch.
+    np = load_numpy()
+    if np is None:
+        raise RuntimeError("Fairness analytics need NumPy (pip install numpy).")
+    ordinals, names, primary, backup1, backup2 = load_schedule_arrays(years)
+    for emp in employees or []:
+        if emp not in names:
+            names.append(emp)
+    count = len(names)
+
+    def per_employee(ids, weights=None):
+        mask = ids >= 0
+        return np.bincount(ids[mask], weights=None if weights is None else weights[mask], minlength=count)
+
+    # Ordinal 1 (0001-01-01) was a Monday
+    weekend = ((ordinals - 1) % 7) >= 5
+    holiday = np.isin(ordinals, np.array(sorted(day.toordinal() for day in holidays or ()), dtype=np.int64))
+    roles = (primary, backup1, backup2)
+    weekend_days = sum(per_employee(column[weekend]) for column in roles)
+    holiday_days = sum(per_employee(column[holiday]) for column in roles)
+    primary_days = per_employee(primary)
+    backup_days = per_employee(backup1) + per_employee(backup2)
+
+    # Sorted unique (employee, day) pairs with any role
+    first = int(ordinals.min()) if len(ordinals) else 0
+    span = int(ordinals.max()) - first + 1 if len(ordinals) else 1
+    all_ids = np.concatenate(roles)
+    all_days = np.tile(ordinals - first, len(roles))
+    on_duty = all_ids >= 0
+    keys = np.unique(all_ids[on_duty] * span + all_days[on_duty])
+    owner, day = keys // span, keys % span
+    same = owner[1:] == owner[:-1]
+    step = np.diff(day)
+
+    gap_mask = same & (step > 1)
+    gap_owner = owner[1:][gap_mask]
+    gaps = step[gap_mask] - 1
+    gap_count = np.bincount(gap_owner, minlength=count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_gap = np.bincount(gap_owner, weights=gaps, minlength=count) / gap_count
+    min_gap = np.full(count, np.inf)
+    np.minimum.at(min_gap, gap_owner, gaps)
+    min_gap[gap_count == 0] = np.nan
+
+    run_start = np.concatenate(([True], ~(same & (step == 1)))) if len(keys) else np.zeros(0, bool)
+    run_lengths = np.bincount(np.cumsum(run_start) - 1) if len(keys) else np.zeros(0, np.int64)
+    longest_stretch = np.zeros(count, np.int64)
+    np.maximum.at(longest_stretch, owner[run_start], run_lengths)
+
+    deltas = get_edit_deltas(years, names, ordinals, primary, backup1, backup2)
+    columns = [names, primary_days, backup_days, weekend_days, holiday_days, mean_gap, min_gap, longest_stretch,
+               deltas['primary'], deltas['backup']]
+    rows = [dict(zip(ANALYTICS_COLUMNS, values))
+            for values in zip(*[column if isinstance(column, list) else column.tolist() for column in columns])]
+    rows.sort(key=lambda row: row['employee'])
+
+    summary = {'employees': count, 'days': len(ordinals)}
+    for key, loads in (('primary', primary_days), ('backup', backup_days), ('weekend', weekend_days)):
+        summary[f'{key}_gini'] = gini(loads)
+        summary[f'{key}_variance'] = float(np.var(loads)) if count else 0.0
+    return rows, summary
+
+def write_analytics_table(path, rows):
+    def write(tmp_path):
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=ANALYTICS_COLUMNS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({key: '' if isinstance(value, float) and value != value else
+                                 round(value, 2) if isinstance(value, float) else value
+                                 for key, value in row.items()})
+    write_file_atomic(path, write)
+
+
+# Compact schedule store: the source of truth next to each workbook. Layout is
+# a magic header, a JSON metadata block with the name table, then day ordinals
+# as array('I') and primary/B1/B2 employee ids as array('H'), little-endian.
+STORE_MAGIC = b'ONCALL\x00\x01'
+STORE_HEADER = struct.Struct('<II')
+STORE_UNASSIGNED = 0xFFFF
+
+def get_store_path(schedule_file):
+    return os.path.splitext(schedule_file)[0] + '.oncall'
+
+def get_store_file(year):
+    return get_store_path(get_schedule_file(year))
+
+def get_year_dates(year):
+    date = datetime.date(year, 1, 1)
+    dates = []
+    while date.year == year:
+        dates.append(date)
+        date += datetime.timedelta(days=1)
+    return dates
+
+def pack_schedule(date_primary, date_backup1, date_backup2, dates=None):
+    names = []
+    ids = {}
+
+    def emp_id(name):
+        if not name:
+            return STORE_UNASSIGNED
+        if name not in ids:
+            if len(names) >= STORE_UNASSIGNED:
+                raise ValueError("Too many employees for the schedule store.")
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    if dates is None:
+        dates = sorted(set(date_primary) | set(date_backup1) | set(date_backup2))
+    return {
+        'names': names,
+        'days': array('I', [date.toordinal() for date in dates]),
+        'primary': array('H', [emp_id(date_primary.get(date, '')) for date in dates]),
+        'backup1': array('H', [emp_id(date_backup1.get(date, '')) for date in dates]),
+        'backup2': array('H', [emp_id(date_backup2.get(date, '')) for date in dates]),
+    }
+
+def unpack_schedule(store):
+    names = store['names']
+    lookup = lambda emp_id: '' if emp_id == STORE_UNASSIGNED else names[emp_id]
+    dates = [datetime.date.fromordinal(day) for day in store['days']]
+    date_primary = {date: lookup(emp_id) for date, emp_id in zip(dates, store['primary'])}
+    date_backup1 = {date: lookup(emp_id) for date, emp_id in zip(dates, store['backup1'])}
+    date_backup2 = {date: lookup(emp_id) for date, emp_id in zip(dates, store['backup2'])}
+    return date_primary, date_backup1, date_backup2
+
+def write_schedule_store(path, date_primary, date_backup1, date_backup2, metadata=None):
+    meta = dict(metadata or {})
+    # A year store covers every calendar day, like the rendered month sheets
+    dates = get_year_dates(meta['year']) if 'year' in meta else None
+    store = pack_schedule(date_primary, date_backup1, date_backup2, dates)
+    meta['names'] = store['names']
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    columns = [store['days'], store['primary'], store['backup1'], store['backup2']]
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            f.write(STORE_MAGIC)
+            f.write(STORE_HEADER.pack(len(meta_bytes), len(store['days'])))
+            f.write(meta_bytes)
+            for column in columns:
+                column.tofile(f)
+    write_file_atomic(path, write)
+
+def get_store_counts(primary_counts, backup_counts):
+    # Per-day counts as recalculate_counts() gives them, kept in the store
+    # metadata so an edit can move them by delta instead of recounting
+    return {'primary': dict(primary_counts), 'backup': dict(backup_counts)}
+
+def read_schedule_store(path):
+    with open(path, 'rb') as f:
+        if f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+            raise ValueError(f"{path} is not a schedule store.")
+        meta_len, day_count = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+        metadata = json.loads(f.read(meta_len).decode('utf-8'))
+        store = {'names': metadata.pop('names'), 'metadata': metadata}
+        for key, typecode in (('days', 'I'), ('primary', 'H'), ('backup1', 'H'), ('backup2', 'H')):
+            column = array(typecode)
+            column.fromfile(f, day_count)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            store[key] = column
+    return store
+
+def load_schedule_store(year):
+    # Use the store unless the workbook was edited by hand after it was written
+    store_file = get_store_file(year)
+    schedule_file = get_schedule_file(year)
+    if not os.path.exists(store_file):
+        return None
+    if _writer is not None and _writer.is_pending(schedule_file):
+        return None  # The workbook in memory is newer than both files
+    if os.path.exists(schedule_file) and os.path.getmtime(schedule_file) > os.path.getmtime(store_file):
+        return None
+    return read_schedule_store(store_file)
+
+# Interval model: the holders of one role as sorted, non-overlapping runs of
+# consecutive days (first ordinal, last ordinal, employee id). Lookups bisect
+# the run starts; range edits split the runs they cut and merge neighbours
+# with the same holder, so a primary week stays a single run.
+class AssignmentRuns:
+    def __init__(self, names=None):
+        self.names = list(names or [])
+        self.ids = {name: idx for idx, name in enumerate(self.names)}
+        self.starts = array('I')
+        self.ends = array('I')
+        self.holders = array('H')
+
+    @classmethod
+    def from_mapping(cls, mapping, names=None):
+        runs = cls(names)
+        for date in sorted(mapping):
+            if mapping[date]:
+                runs.append(date.toordinal(), mapping[date])
+        return runs
+
+    @classmethod
+    def from_columns(cls, days, column, names):
+        # From a schedule store's day and employee id columns
+        runs = cls(names)
+        for day, emp_id in zip(days, column):
+            if emp_id != STORE_UNASSIGNED:
+                runs.append(day, runs.names[emp_id])
+        return runs
+
+    def employee_id(self, name):
+        if name not in self.ids:
+            if len(self.names) >= STORE_UNASSIGNED:
+                raise ValueError("Too many employees for the interval model.")
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def append(self, ordinal, name):
+        # Extend the last run or start a new one; days must come in order
+        emp_id = self.employee_id(name)
+        if self.starts and self.ends[-1] + 1 == ordinal and self.holders[-1] == emp_id:
+            self.ends[-1] = ordinal
+        else:
+            self.starts.append(ordinal)
+            self.ends.append(ordinal)
+            self.holders.append(emp_id)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        # (first date, last date, employee) per run
+        for start, end, emp_id in zip(self.starts, self.ends, self.holders):
+            yield datetime.date.fromordinal(start), datetime.date.fromordinal(end), self.names[emp_id]
+
+    def find(self, ordinal):
+        # Index of the run covering the day, or -1
+        idx = bisect.bisect_right(self.starts, ordinal) - 1
+        return idx if idx >= 0 and self.ends[idx] >= ordinal else -1
+
+    def get(self, date, default=''):
+        idx = self.find(date.toordinal())
+        return self.names[self.holders[idx]] if idx >= 0 else default
+
+    def between(self, start_date, end_date):
+        # Runs overlapping the range, clipped to it
+        first, last = start_date.toordinal(), end_date.toordinal()
+        idx = max(bisect.bisect_right(self.starts, first) - 1, 0)
+        while idx < len(self.starts) and self.starts[idx] <= last:
+            if self.ends[idx] >= first:
+                yield (datetime.date.fromordinal(max(self.starts[idx], first)),
+                       datetime.date.fromordinal(min(self.ends[idx], last)), self.names[self.holders[idx]])
+            idx += 1
+
+    def assign(self, start_date, end_date, name):
+        # Give every day in the range to name ('' leaves the range unassigned)
+        first, last = start_date.toordinal(), end_date.toordinal()
+        lo = bisect.bisect_right(self.starts, first) - 1
+        if lo < 0 or self.ends[lo] < first:
+            lo += 1
+        hi = bisect.bisect_right(self.starts, last)
+        pieces = []
+        if lo < hi and self.starts[lo] < first:
+            pieces.append((self.starts[lo], first - 1, self.holders[lo]))
+        if name:
+            pieces.append((first, last, self.employee_id(name)))
+        if lo < hi and self.ends[hi - 1] > last:
+            pieces.append((last + 1, self.ends[hi - 1], self.holders[hi - 1]))
+        self.starts[lo:hi] = array('I', [piece[0] for piece in pieces])
+        self.ends[lo:hi] = array('I', [piece[1] for piece in pieces])
+        self.holders[lo:hi] = array('H', [piece[2] for piece in pieces])
+        # Merge with equal neighbours on either side of the new pieces
+        idx = max(lo - 1, 0)
+        while idx < min(lo + len(pieces), len(self.starts) - 1):
+            if self.ends[idx] + 1 == self.starts[idx + 1] and self.holders[idx] == self.holders[idx + 1]:
+                self.ends[idx] = self.ends[idx + 1]
+                del self.starts[idx + 1], self.ends[idx + 1], self.holders[idx + 1]
+            else:
+                idx += 1
+
+    def day_counts(self):
+        counts = Counter()
+        for start, end, emp_id in zip(self.starts, self.ends, self.holders):
+            counts[self.names[emp_id]] += end - start + 1
+        return counts
+
+    def to_mapping(self):
+        mapping = {}
+        for start, end, emp_id in zip(self.starts, self.ends, self.holders):
+            for ordinal in range(start, end + 1):
+                mapping[datetime.date.fromordinal(ordinal)] = self.names[emp_id]
+        return mapping
+
+# Change journal: every assignment change is appended to '<year file>.journal'
+# as one JSON line (seq, timestamp, date, role, old, new, who) and never
+# rewritten. The store is the compacted snapshot and records the last seq it
+# includes; loading replays only the entries after it and never writes. An
+# undo only appends, and once the tail reaches JOURNAL_SNAPSHOT_EVERY entries
+# it is folded into a new snapshot. Saves write a new snapshot too and copy
+# new entries into the 'Schedule Changes' sheet, so the workbook carries the
+# same audit trail.
+JOURNAL_SNAPSHOT_EVERY = 100
+JOURNAL_SHEET = 'Schedule Changes'
+JOURNAL_HEADER = ['Seq', 'Timestamp', 'Date', 'Role', 'Old', 'New', 'Who', 'Note']
+
+def get_journal_path(schedule_file):
+    return os.path.splitext(schedule_file)[0] + '.journal'
+
+def get_journal_file(year):
+    return get_journal_path(get_schedule_file(year))
+
+def get_current_user():
+    try:
+        import getpass
+        return getpass.getuser()
+    except Exception:
+        return os.environ.get('USER') or os.environ.get('USERNAME') or 'unknown'
+
+def read_journal(path, after_seq=0):
+    # Entries with seq > after_seq, oldest first. A torn last line from an
+    # interrupted append is skipped.
+    entries = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning('Skipping unreadable journal line in %s', path)
+                    continue
+                if entry['seq'] > after_seq:
+                    entries.append(entry)
+    except FileNotFoundError:
+        pass
+    return entries
+
+def last_journal_seq(path):
+    # Only the end of the file is read, however long the journal is
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            block = 4096
+            while True:
+                f.seek(max(0, size - block))
+                lines = f.read().splitlines()
+                if block >= size or len(lines) > 2:
+                    break
+                block *= 4
+    except FileNotFoundError:
+        return 0
+    for line in reversed(lines):
+        try:
+            return json.loads(line)['seq']
+        except (ValueError, KeyError):
+            continue
+    return 0
+
+def append_journal(path, changes, who=None):
+    # (date, role, old, new[, undo_of]) tuples; the lock keeps seq unique
+    # across running instances
+    if not changes:
+        return []
+    who = who or get_current_user()
+    timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with file_lock(path):
+        seq = last_journal_seq(path)
+        entries = []
+        for date, role, old, new, *undo_of in changes:
+            seq += 1
+            entry = {'seq': seq, 'timestamp': timestamp, 'date': date.isoformat(), 'role': role,
+                     'old': old, 'new': new, 'who': who}
+            if undo_of:
+                entry['undo_of'] = undo_of[0]
+            entries.append(entry)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+    return entries
+
+def record_schedule_changes(year, changes, who=None):
+    return append_journal(get_journal_file(year), changes, who)
+
+def replay_journal(entries, date_primary, date_backup1, date_backup2, counts=None):
+    # 'counts', store counts as get_store_counts() builds them, are moved along
+    role_maps = {'Primary': date_primary, 'Backup 1': date_backup1, 'Backup 2': date_backup2}
+    for entry in entries:
+        date = datetime.date.fromisoformat(entry['date'])
+        mapping = role_maps[entry['role']]
+        if date in mapping:
+            if counts:
+                move_count(counts['primary' if entry['role'] == 'Primary' else 'backup'], mapping[date], entry['new'])
+            mapping[date] = entry['new']
+
+def get_journal_sheet_seq(workbook):
+    # Last seq copied into the 'Schedule Changes' sheet; rows are in seq order
+    if JOURNAL_SHEET not in workbook.sheetnames:
+        return 0
+    sheet = workbook[JOURNAL_SHEET]
+    if sheet.max_row < 2:
+        return 0
+    value = sheet.cell(row=sheet.max_row, column=1).value
+    return value if isinstance(value, int) else 0
+
+def get_journal_row(entry):
+    note = f"Undo of {entry['undo_of']}" if 'undo_of' in entry else None
+    return [entry['seq'], entry['timestamp'], entry['date'], entry['role'], entry['old'], entry['new'], entry['who'], note]
+
+def sync_journal_sheet(workbook, journal_path):
+    # Append the entries the sheet does not have yet; returns the last seq
+    if JOURNAL_SHEET not in workbook.sheetnames:
+        workbook.create_sheet(JOURNAL_SHEET, 1)
+    sheet = workbook[JOURNAL_SHEET]
+    if sheet.cell(row=1, column=1).value is None:
+        for col, title in enumerate(JOURNAL_HEADER, 1):
+            sheet.cell(row=1, column=col, value=title)
+    last_seq = get_journal_sheet_seq(workbook)
+    for entry in read_journal(journal_path, last_seq):
+        sheet.append(get_journal_row(entry))
+        last_seq = entry['seq']
+    return last_seq
+
+def has_journal_tail(year, store):
+    return last_journal_seq(get_journal_file(year)) > store['metadata'].get('journal_seq', 0)
+
+def undo_schedule_change(year, seq=None, who=None, force=False):
+    # Append the inverse of an entry (the latest one not yet undone by
+    # default). The workbook is left alone; loads replay the undo and the
+    # next save writes it out.
+    journal_path = get_journal_file(year)
+    entries = read_journal(journal_path)
+    undone = {entry['undo_of'] for entry in entries if 'undo_of' in entry}
+    if seq is None:
+        candidates = [entry for entry in entries if 'undo_of' not in entry and entry['seq'] not in undone]
+        if not candidates:
+            raise ValueError(f"No change to undo for {year}")
+        target = candidates[-1]
+    else:
+        target = next((entry for entry in entries if entry['seq'] == seq), None)
+        if target is None:
+            raise ValueError(f"No journal entry {seq} for {year}")
+        if seq in undone:
+            raise ValueError(f"Journal entry {seq} has already been undone")
+    date = datetime.date.fromisoformat(target['date'])
+    role_maps = dict(zip(SCHEDULE_ROLES, load_schedule_data(year)))
+    current = role_maps[target['role']].get(date, '')
+    if current != target['new'] and not force:
+        raise ValueError(f"{target['role']} on {date} is now {current or 'unassigned'}, "
+                         f"not {target['new'] or 'unassigned'}; a later change would be overwritten")
+    entry = append_journal(journal_path, [(date, target['role'], current, target['old'], target['seq'])], who)[0]
+    compact_journal(year)
+    return entry
+
+def compact_journal(year):
+    # Fold the journal tail into a new store snapshot once it has
+    # JOURNAL_SNAPSHOT_EVERY entries; returns whether it did. Only the store
+    # is written, under the journal lock so no append lands in between.
+    journal_path = get_journal_file(year)
+    with file_lock(journal_path):
+        store = load_schedule_store(year)
+        if store is None:
+            return False
+        metadata = dict(store['metadata'])
+        tail = read_journal(journal_path, metadata.get('journal_seq', 0))
+        if len(tail) < JOURNAL_SNAPSHOT_EVERY:
+            return False
+        schedule = unpack_schedule(store)
+        counts = {key: dict(value) for key, value in metadata['counts'].items()} if 'counts' in metadata else None
+        replay_journal(tail, *schedule, counts=counts)
+        metadata['journal_seq'] = tail[-1]['seq']
+        if counts is not None:
+            metadata['counts'] = counts
+        write_schedule_store(get_store_file(year), *schedule, metadata)
+    log_event('journal_compacted', year=year, entries=len(tail))
+    return True
+
+def load_schedule_runs(year):
+    # {role: AssignmentRuns} for a year, straight from the store when it is
+    # current so no per-day dicts are built
+    store = load_schedule_store(year)
+    if store is not None and not has_journal_tail(year, store):
+        return {role: AssignmentRuns.from_columns(store['days'], store[key], store['names'])
+                for role, key in zip(SCHEDULE_ROLES, ('primary', 'backup1', 'backup2'))}
+    mappings = load_schedule_data(year)
+    return {role: AssignmentRuns.from_mapping(mapping) for role, mapping in zip(SCHEDULE_ROLES, mappings)}
+
+def load_schedule_data(year, replayed=None, counts=None):
+    # The store or the calendar sheets, plus the journal entries after them.
+    # 'replayed', when given, is extended with those entries; 'counts', when
+    # given, is filled with the store's saved counts as of the same point, or
+    # left empty when they have to be recounted.
+    with timed_phase('schedule_loading', year=year) as counters:
+        store = load_schedule_store(year)
+        counters['source'] = 'store' if store is not None else 'xlsx'
+        if store is not None:
+            schedule = unpack_schedule(store)
+            metadata = store['metadata']
+            if counts is not None and 'counts' in metadata:
+                counts.update({key: dict(value) for key, value in metadata['counts'].items()})
+        else:
+            workbook = get_workbook(year)
+            schedule = parse_calendar_sheets(workbook, year)
+            metadata = {'year': year, 'journal_seq': get_journal_sheet_seq(workbook)}
+        tail = read_journal(get_journal_file(year), metadata.get('journal_seq', 0))
+        counters['journal_tail'] = len(tail)
+        if tail:
+            replay_journal(tail, *schedule, counts=counts)
+            if replayed is not None:
+                replayed.extend(tail)
+        return schedule
+
+def read_schedule_data_sheet(workbook):
+    # {month: [(primary, backup 1, backup 2) per day]} from the hidden sheet;
+    # empty when the sheet is missing or unreadable
+    if SCHEDULE_DATA_SHEET not in workbook.sheetnames:
+        return {}
+    months = {}
+    for month, assignments in workbook[SCHEDULE_DATA_SHEET].iter_rows(min_row=2, max_col=2, values_only=True):
+        try:
+            months[int(month)] = [tuple(day) for day in json.loads(assignments)]
+        except (TypeError, ValueError):
+            return {}
+    return months
+
+def parse_calendar_cell(text, date, sheet_name, row, col):
+    from openpyxl.utils import get_column_letter
+    match = CALENDAR_CELL_PATTERN.fullmatch(text)
+    where = f"{sheet_name}!{get_column_letter(col)}{row}"
+    if match is None:
+        raise ValueError(f"Malformed calendar cell {where} for {date}: {text!r}")
+    if int(match.group(1)) != date.day:
+        raise ValueError(f"Calendar cell {where} holds day {match.group(1)}, expected day {date.day}")
+    return tuple((group or '').strip() for group in match.groups()[1:])
+
+@timed('calendar_parsing')
+def parse_calendar_sheets(workbook, year):
+    # Every day of a month sits at a fixed grid position (see
+    # get_calendar_cell_position()), so only those cells are read and each is
+    # matched once against CALENDAR_CELL_PATTERN. Cells that still match the
+    # hidden 'Schedule Data' row are taken from it without a regex. A month
+    # sheet with no day cells at all is skipped; anything else that does not
+    # parse raises ValueError.
+    from openpyxl.utils import get_column_letter
     date_primary = {}
     date_backup1 = {}
     date_backup2 = {}
-
-    #logging.debug('Loading schedule data for year %d', year)
+    structured = read_schedule_data_sheet(workbook)
 
     for month in range(1, 13):
-        month_name = datetime.date(year, month, 1).strftime('%B')
-        if month_name in workbook.sheetnames:
-            sheet = workbook[month_name]
-            #logging.debug('Processing sheet: %s', month_name)
-            for row in sheet.iter_rows(min_row=3):
-                for cell in row:
-                    if cell.value and not isinstance(cell, MergedCell):
-                        content = cell.value
-                        day_num = None
-                        primary = ''
-                        backup1 = ''
-                        backup2 = ''
-                        lines = content.split('\n')
-                        i = 0
-                        while i < len(lines):
-                            line = lines[i]
-                            if line.startswith('Day '):
-                                day_num = int(line.strip().split()[1])
-                                i += 1
-                            elif line.strip() == 'P:':
-                                if i + 1 < len(lines):
-                                    primary = lines[i + 1].strip()
-                                    i += 2
-                                else:
-                                    i += 1
-                            elif line.strip() == 'B1:':
-                                if i + 1 < len(lines):
-                                    backup1 = lines[i + 1].strip()
-                                    i += 2
-                                else:
-                                    i += 1
-                            elif line.strip() == 'B2:':
-                                if i + 1 < len(lines):
-                                    backup2 = lines[i + 1].strip()
-                                    i += 2
-                                else:
-                                    i += 1
-                            else:
-                                i += 1
-                        if day_num:
-                            date = datetime.date(year, month, day_num)
-                            date_primary[date] = primary
-                            date_backup1[date] = backup1
-                            date_backup2[date] = backup2
-                            #logging.debug('Loaded assignments for %s: Primary=%s, Backup1=%s, Backup2=%s', date, primary, backup1, backup2)
-    return date_primary, date_backup1, date_backup2
-
-
+        first_day = datetime.date(year, month, 1)
+        month_name = first_day.strftime('%B')
+        if month_name not in workbook.sheetnames:
+            continue
+        num_days = calendar.monthrange(year, month)[1]
+        offset = first_day.weekday()
+        last_row = 3 + (offset + num_days - 1) // 7
+        grid = list(workbook[month_name].iter_rows(min_row=3, max_row=last_row, max_col=7, values_only=True))
+        if not any(value for cells in grid for value in cells):
+            continue
+        month_data = structured.get(month) or []
 
+        for day_num in range(1, num_days + 1):
+            date = datetime.date(year, month, day_num)
+            row, col = divmod(offset + day_num - 1, 7)
+            text = grid[row][col] if row < len(grid) and col < len(grid[row]) else None
+            if text is None:
+                raise ValueError(f"Calendar cell {month_name}!{get_column_letter(col + 1)}{row + 3} for {date} is empty")
+            text = str(text)
+            assignment = month_data[day_num - 1] if day_num <= len(month_data) else None
+            if assignment is None or len(assignment) != 3 or text != format_calendar_cell(day_num, *assignment):
+                assignment = parse_calendar_cell(text, date, month_name, row + 3, col + 1)
+            date_primary[date], date_backup1[date], date_backup2[date] = assignment
+    logger.debug('Loaded %d days of schedule data for year %d', len(date_primary), year)
+    return date_primary, date_backup1, date_backup2
 
-def save_schedule_data(date_primary, date_backup1, date_backup2, year):
+def save_schedule_data(date_primary, date_backup1, date_backup2, year, dirty_dates=None, counts=None):
+    # Without dirty_dates every month is re-rendered; otherwise only the cells
+    # of the changed dates are rewritten in place. 'counts' is the
+    # (primary_counts, backup_counts) pair saved in the store for the next edit.
     workbook = get_workbook(year)
-    #logging.debug('Saving schedule data for year %d', year)
-    # Remove existing month sheets
-    for month in range(1, 13):
+    journal_path = get_journal_file(year)
+    logger.debug('Saving schedule data for year %d', year)
+    if dirty_dates is not None:
+        # Journal entries the workbook does not have yet (undos, possibly
+        # already compacted into the store) are written out with the edit
+        dirty_dates = set(dirty_dates)
+        dirty_dates.update(datetime.date.fromisoformat(entry['date'])
+                           for entry in read_journal(journal_path, get_journal_sheet_seq(workbook)))
+    if dirty_dates is None:
+        render_calendar_months(workbook, year, range(1, 13), date_primary, date_backup1, date_backup2)
+    else:
+        stale_months = update_calendar_cells(workbook, year, dirty_dates, date_primary, date_backup1, date_backup2)
+        if stale_months:
+            render_calendar_months(workbook, year, stale_months, date_primary, date_backup1, date_backup2)
+    months = range(1, 13) if dirty_dates is None else {date.month for date in dirty_dates if date.year == year}
+    write_schedule_data_sheet(workbook, year, date_primary, date_backup1, date_backup2, months)
+    journal_seq = sync_journal_sheet(workbook, journal_path)
+    # The store is written after the workbook, possibly by the background
+    # writer, so it gets a copy of the assignments as they are now
+    snapshot = (dict(date_primary), dict(date_backup1), dict(date_backup2))
+    metadata = {'year': year, 'journal_seq': journal_seq}
+    if counts is not None:
+        metadata['counts'] = get_store_counts(*counts)
+    save_workbook(workbook, get_schedule_file(year),
+                  then=lambda: write_schedule_store(get_store_file(year), *snapshot, metadata))
+    logger.debug('Schedule data saved for year %d', year)
+
+@timed('sheet_rendering')
+def render_calendar_months(workbook, year, months, date_primary, date_backup1, date_backup2):
+    # Recreate only the listed month sheets, keeping their position in the workbook
+    register_calendar_styles(workbook)
+    for month in sorted(months):
         month_name = datetime.date(year, month, 1).strftime('%B')
+        index = None
         if month_name in workbook.sheetnames:
+            index = workbook.sheetnames.index(month_name)
             del workbook[month_name]
-            #logging.debug('Deleted sheet: %s', month_name)
-    # Recreate month sheets
-    for month in range(1, 13):
-        month_name = datetime.date(year, month, 1).strftime('%B')
-        workbook.create_sheet(month_name)
-        #logging.debug('Created sheet: %s', month_name)
-    create_calendar_sheets(workbook, date_primary, date_backup1, date_backup2, year)
-    workbook.save(get_schedule_file(year))
-    #logging.debug('Schedule data saved for year %d', year)
+            logger.debug('Deleted sheet: %s', month_name)
+        sheet = workbook.create_sheet(month_name, index)
+        create_calendar_sheet(sheet, year, month, date_primary, date_backup1, date_backup2)
 
+def get_calendar_cell_position(date):
+    # Row and column of a date on its month sheet; rows start at 3, Monday is column 1
+    offset = datetime.date(date.year, date.month, 1).weekday() + date.day - 1
+    return 3 + offset // 7, 1 + offset % 7
+
+@timed('cell_update')
+def update_calendar_cells(workbook, year, dates, date_primary, date_backup1, date_backup2):
+    # Rewrite the values of the given dates' cells, keeping styles and widths
+    # (columns only ever widen). Returns months whose sheet is missing or does
+    # not have the expected layout, so the caller can re-render them.
+    from openpyxl.utils import get_column_letter
+    stale_months = set()
+    for date in sorted(set(dates)):
+        if date.year != year or date.month in stale_months:
+            continue
+        month_name = date.strftime('%B')
+        if month_name not in workbook.sheetnames:
+            stale_months.add(date.month)
+            continue
+        sheet = workbook[month_name]
+        row, col = get_calendar_cell_position(date)
+        cell = sheet.cell(row=row, column=col)
+        if not str(cell.value or '').startswith(f"Day {date.day}\n"):
+            stale_months.add(date.month)
+            continue
+        cell.value = format_calendar_cell(date.day, date_primary.get(date, ''), date_backup1.get(date, ''), date_backup2.get(date, ''))
+        dimension = sheet.column_dimensions[get_column_letter(col)]
+        width = max(len(line) for line in cell.value.split('\n')) + 2
+        if dimension.width is None or dimension.width < width:
+            dimension.width = width
+    return stale_months
+
+# Batch schedule changes: (date, role, new employee) rows from CSV or JSON
+SCHEDULE_ROLES = ['Primary', 'Backup 1', 'Backup 2']
+ROLE_ALIASES = {
+    'p': 'Primary', 'primary': 'Primary',
+    'b1': 'Backup 1', 'backup1': 'Backup 1',
+    'b2': 'Backup 2', 'backup2': 'Backup 2',
+}
+
+def parse_role(value):
+    role = ROLE_ALIASES.get(str(value).replace(' ', '').replace('_', '').lower())
+    if role is None:
+        raise ValueError(f"Unknown role: {value}")
+    return role
+
+def parse_schedule_change(date_value, role_value, employee):
+    try:
+        date = datetime.datetime.strptime(str(date_value).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"Invalid date: {date_value}")
+    employee = str(employee or '').strip()
+    if not employee:
+        raise ValueError(f"Missing employee for {date_value}")
+    return date, parse_role(role_value), employee
+
+def read_schedule_changes(path):
+    # CSV with date,role,employee columns, or a JSON list of objects or triples
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            rows = json.load(f)
+        changes = []
+        for row in rows:
+            if isinstance(row, dict):
+                changes.append(parse_schedule_change(row.get('date'), row.get('role'), row.get('employee')))
+            else:
+                changes.append(parse_schedule_change(*row))
+        return changes
+    with open(path, newline='', encoding='utf-8') as f:
+        return [parse_schedule_change(row.get('date'), row.get('role'), row.get('employee')) for row in csv.DictReader(f)]
+
+def apply_schedule_changes(date_primary, date_backup1, date_backup2, changes, primary_counts, backup_counts):
+    # Apply changes in order and move counts by delta, one per changed day
+    # like recalculate_counts() counts them. Returns (date, role, old, new)
+    # for every assignment that actually changed.
+    role_maps = {'Primary': date_primary, 'Backup 1': date_backup1, 'Backup 2': date_backup2}
+    applied = []
+    for date, role, new_employee in changes:
+        mapping = role_maps[role]
+        if date not in mapping:
+            raise ValueError(f"No schedule entry for {date}")
+        old_employee = mapping[date]
+        if old_employee == new_employee:
+            continue
+        mapping[date] = new_employee
+        applied.append((date, role, old_employee, new_employee))
+        move_count(primary_counts if role == 'Primary' else backup_counts, old_employee, new_employee)
+    return applied
+
+def move_count(counts, old_employee, new_employee):
+    # Same rule as recalculate_counts(): only employees on the list are counted
+    if old_employee in counts:
+        counts[old_employee] -= 1
+    if new_employee in counts:
+        counts[new_employee] += 1
+
+def batch_edit_schedule(changes):
+    # Apply a list of (date, role, employee) changes. Each affected year is
+    # loaded once, only the changed calendar cells are rewritten and the
+    # workbook is written once.
+    employees = load_employees()
+    unknown = sorted({emp for _, _, emp in changes if emp not in employees})
+    if unknown:
+        raise ValueError(f"Not on the employee list: {', '.join(unknown)}")
+
+    by_year = defaultdict(list)
+    for change in changes:
+        by_year[change[0].year].append(change)
+
+    applied = []
+    for year, year_changes in sorted(by_year.items()):
+        if year not in get_existing_schedule_years():
+            raise ValueError(f"No schedule exists for {year}")
+        with workbook_session():
+            saved_counts = {}
+            date_primary, date_backup1, date_backup2 = load_schedule_data(year, counts=saved_counts)
+            workbook = get_workbook(year)
+            # Start from the counts saved with the store and move them by the
+            # changes; recount only when the store has none for this roster
+            if saved_counts and all(emp in saved_counts['primary'] and emp in saved_counts['backup'] for emp in employees):
+                primary_counts = {emp: saved_counts['primary'][emp] for emp in employees}
+                backup_counts = {emp: saved_counts['backup'][emp] for emp in employees}
+            else:
+                primary_counts, backup_counts = recalculate_counts(employees, date_primary, date_backup1, date_backup2)
 
+            year_applied = apply_schedule_changes(date_primary, date_backup1, date_backup2, year_changes, primary_counts, backup_counts)
+            if not year_applied:
+                continue
+            record_schedule_changes(year, year_applied)
+            dirty_dates = {date for date, _, _, _ in year_applied}
+            save_schedule_data(date_primary, date_backup1, date_backup2, year, dirty_dates=dirty_dates,
+                               counts=(primary_counts, backup_counts))
+            generate_reports(workbook, employees, primary_counts, backup_counts)
+            save_workbook(workbook, get_schedule_file(year))
+        applied.extend(year_applied)
+    return applied
+
+# iCalendar export: one .ics file per employee, or one combined feed, built
+# from the year stores. Assignments are merged into runs of consecutive days
+# per role, so a primary week becomes one event, and the calendar text is
+# written line by line as it is generated. A manifest of per-employee hashes
+# lets unchanged employees be skipped on the next export.
+ICS_FOLDER_NAME = 'Calendars'
+ICS_MANIFEST = 'manifest.json'
+ICS_ROLES = (('Primary', 'primary'), ('Backup 1', 'backup1'), ('Backup 2', 'backup2'))
+
+def iter_schedule_days(years):
+    # (date, primary, backup 1, backup 2) for every day, one year loaded at a time
+    for year in sorted(years):
+        date_primary, date_backup1, date_backup2 = load_schedule_data(year)
+        for date in sorted(date_primary):
+            yield date, date_primary[date], date_backup1.get(date, ''), date_backup2.get(date, '')
+
+def iter_assignment_runs(days):
+    # (employee, role, first date, last date), merging consecutive days with
+    # the same holder; runs continue across year boundaries
+    open_runs = [None] * len(ICS_ROLES)
+    for date, *holders in days:
+        for idx, holder in enumerate(holders):
+            run = open_runs[idx]
+            if run is not None and run[0] == holder and run[2] == date - datetime.timedelta(days=1):
+                run[2] = date
+                continue
+            if run is not None:
+                yield run[0], ICS_ROLES[idx][0], run[1], run[2]
+            open_runs[idx] = [holder, date, date] if holder else None
+    for idx, run in enumerate(open_runs):
+        if run is not None:
+            yield run[0], ICS_ROLES[idx][0], run[1], run[2]
+
+def escape_ics_text(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def fold_ics_line(line):
+    # Content lines are folded at 75 octets, continuation lines start with a space
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(data))
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1  # Never split a UTF-8 sequence
+        parts.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+    return '\r\n '.join(parts) + '\r\n'
+
+def iter_ics_lines(calendar_name, runs, stamp, with_names=False):
+    yield 'BEGIN:VCALENDAR'
+    yield 'VERSION:2.0'
+    yield 'PRODID:-//On Call Scheduling//EN'
+    yield 'CALSCALE:GREGORIAN'
+    yield f"X-WR-CALNAME:{escape_ics_text(calendar_name)}"
+    slugs = dict(ICS_ROLES)
+    for emp, role, start, end in runs:
+        summary = f"On call: {role} ({emp})" if with_names else f"On call: {role}"
+        yield 'BEGIN:VEVENT'
+        yield f"UID:{start:%Y%m%d}-{slugs[role]}-{hashlib.sha1(emp.encode('utf-8')).hexdigest()[:12]}@oncall"
+        yield f"DTSTAMP:{stamp}"
+        yield f"DTSTART;VALUE=DATE:{start:%Y%m%d}"
+        yield f"DTEND;VALUE=DATE:{end + datetime.timedelta(days=1):%Y%m%d}"
+        yield f"SUMMARY:{escape_ics_text(summary)}"
+        yield 'TRANSP:TRANSPARENT'
+        yield 'END:VEVENT'
+    yield 'END:VCALENDAR'
+
+def write_ics_file(path, lines):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            for line in lines:
+                f.write(fold_ics_line(line))
+    write_file_atomic(path, write)
+
+def get_ics_filename(emp):
+    return get_safe_name(emp) + '.ics'
+
+def hash_runs(runs):
+    digest = hashlib.sha1()
+    for emp, role, start, end in runs:
+        digest.update(f"{emp}|{role}|{start}|{end}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+@timed('ics_export')
+def export_calendars(years=None, out_dir=None, combined=False, force=False):
+    # Returns {'folder', 'written', 'skipped'}. Per-employee runs are kept as
+    # small tuples (bounded by days x roles, not by roster size); event text is
+    # never held in memory.
+    years = sorted(years or get_existing_schedule_years())
+    out_dir = out_dir or os.path.join(SCHEDULING_FOLDER, ICS_FOLDER_NAME)
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    manifest_path = os.path.join(out_dir, ICS_MANIFEST)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get('years') != years:
+        manifest = {}  # A different range changes every file
+    hashes = manifest.get('hashes', {})
+    written = skipped = 0
+
+    if combined:
+        name = 'On Call Schedule.ics'
+        path = os.path.join(out_dir, name)
+        # One pass over the years; the runs are kept for the write, like the
+        # per-employee runs below
+        runs = list(iter_assignment_runs(iter_schedule_days(years)))
+        digest = hash_runs(runs)
+        if force or hashes.get(name) != digest or not os.path.exists(path):
+            write_ics_file(path, iter_ics_lines('On call', runs, stamp, with_names=True))
+            hashes[name] = digest
+            written += 1
+        else:
+            skipped += 1
+    else:
+        runs_by_employee = defaultdict(list)
+        for run in iter_assignment_runs(iter_schedule_days(years)):
+            runs_by_employee[run[0]].append(run)
+        for emp, runs in runs_by_employee.items():
+            name = get_ics_filename(emp)
+            path = os.path.join(out_dir, name)
+            digest = hash_runs(runs)
+            if not force and hashes.get(name) == digest and os.path.exists(path):
+                skipped += 1
+                continue
+            runs.sort(key=lambda run: run[2])
+            write_ics_file(path, iter_ics_lines(f"On call - {emp}", runs, stamp))
+            hashes[name] = digest
+            written += 1
+
+    write_file_atomic(manifest_path, json.dumps({'years': years, 'hashes': hashes}, indent=2).encode('utf-8'))
+    return {'folder': out_dir, 'written': written, 'skipped': skipped}
+
+# Lookup service: a small local HTTP/JSON server for paging systems. Every
+# year's roles are held as AssignmentRuns; a watcher thread polls the schedule
+# files' mtimes and swaps in a freshly built index, so queries never touch
+# the disk and never see a half-loaded schedule.
+SERVICE_ROLE_KEYS = (('Primary', 'primary'), ('Backup 1', 'backup1'), ('Backup 2', 'backup2'))
+
+class ScheduleIndex:
+    def __init__(self):
+        self.years = {}  # year -> (file mtimes, {role: AssignmentRuns}); replaced, never mutated
+        self.loaded_at = None
+
+    def signature(self, year):
+        mtimes = []
+        for path in (get_schedule_file(year), get_store_file(year), get_journal_file(year)):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def refresh(self):
+        # Rebuild changed years into a new dict, then swap it in; returns
+        # whether anything changed
+        current = self.years
+        years = {}
+        for year in get_existing_schedule_years():
+            signature = self.signature(year)
+            if year in current and current[year][0] == signature:
+                years[year] = current[year]
+            else:
+                years[year] = (signature, load_schedule_runs(year))
+        changed = years.keys() != current.keys() or any(years[year] is not current[year] for year in years)
+        if changed or self.loaded_at is None:
+            self.years = years
+            self.loaded_at = datetime.datetime.now().isoformat(timespec='seconds')
+        return changed
+
+    def lookup(self, date):
+        entry = self.years.get(date.year)
+        if entry is None:
+            return None
+        result = {'date': date.isoformat()}
+        for role, key in SERVICE_ROLE_KEYS:
+            result[key] = entry[1][role].get(date) or None
+        return result
+
+    def lookup_range(self, start_date, end_date):
+        years = self.years
+        result = {'start': start_date.isoformat(), 'end': end_date.isoformat()}
+        for role, key in SERVICE_ROLE_KEYS:
+            result[key] = []
+        for year in range(start_date.year, end_date.year + 1):
+            if year not in years:
+                continue
+            first = max(start_date, datetime.date(year, 1, 1))
+            last = min(end_date, datetime.date(year, 12, 31))
+            for role, key in SERVICE_ROLE_KEYS:
+                for start, end, emp in years[year][1][role].between(first, last):
+                    result[key].append({'start': start.isoformat(), 'end': end.isoformat(), 'employee': emp})
+        return result
+
+    def watch(self, interval, stop):
+        while not stop.wait(interval):
+            try:
+                if self.refresh():
+                    log_event('schedule_reloaded', years=sorted(self.years))
+            except Exception:
+                # Keep serving the previous index until the files are readable again
+                logger.exception('Reloading the schedule index failed')
+
+def make_lookup_handler(index):
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs, urlsplit
+
+    class LookupHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive for pollers
+        disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                if url.path == '/health':
+                    self.send_json(200, {'years': sorted(index.years), 'loaded_at': index.loaded_at})
+                elif url.path == '/on-call' and ('start' in query or 'end' in query):
+                    start = datetime.date.fromisoformat(query.get('start') or query['end'])
+                    end = datetime.date.fromisoformat(query.get('end') or query['start'])
+                    if end < start:
+                        raise ValueError("end is before start")
+                    self.send_json(200, index.lookup_range(start, end))
+                elif url.path == '/on-call':
+                    date = datetime.date.fromisoformat(query['date']) if 'date' in query else datetime.date.today()
+                    result = index.lookup(date)
+                    if result is None:
+                        self.send_json(404, {'error': f"No schedule for {date.year}"})
+                    else:
+                        self.send_json(200, result)
+                else:
+                    self.send_json(404, {'error': f"Unknown path {url.path}"})
+            except ValueError as e:
+                self.send_json(400, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            logger.debug('%s - %s', self.address_string(), format % args)
+
+    return LookupHandler
+
+def serve_lookups(host='127.0.0.1', port=8765, interval=1.0, ready=None):
+    from http.server import ThreadingHTTPServer
+    index = ScheduleIndex()
+    index.refresh()
+    server = ThreadingHTTPServer((host, port), make_lookup_handler(index))
+    server.daemon_threads = True
+    stop = threading.Event()
+    threading.Thread(target=index.watch, args=(interval, stop), name='oncall-index-watch', daemon=True).start()
+    if ready is not None:
+        ready(server)
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
 
 def manage_schedule_changes():
     clear_screen()
@@ -598,7 +3086,13 @@ def manage_schedule_changes():
         else:
             print_centered("Please enter a valid year.", Fore.RED)
     workbook = get_workbook(year)
-    date_primary, date_backup1, date_backup2 = load_schedule_data(year)
+    replayed = []
+    try:
+        date_primary, date_backup1, date_backup2 = load_schedule_data(year, replayed)
+    except ValueError as e:
+        print_centered(f"Could not read the {year} schedule: {e}", Fore.RED)
+        pause()
+        return
     if not date_primary:
         print_centered("No schedule data available. Generate schedule first.", Fore.RED)
         pause()
@@ -636,6 +3130,8 @@ def manage_schedule_changes():
 
     employees = load_employees()
     employee_dict = {str(idx): emp for idx, emp in enumerate(employees, 1)}
+    changed_dates = {datetime.date.fromisoformat(entry['date']) for entry in replayed}
+    journal_changes = []
 
     for date in dates_to_modify:
         clear_screen()
@@ -682,23 +3178,30 @@ def manage_schedule_changes():
             date_backup1[date] = new_employee
         elif role == 'Backup 2':
             date_backup2[date] = new_employee
+        changed_dates.add(date)
+        if new_employee != current_employee:
+            journal_changes.append((date, role, current_employee, new_employee))
 
-        #logging.info('Changed %s on %s from %s to %s', role, date, current_employee, new_employee)
+        logger.info('Changed %s on %s from %s to %s', role, date, current_employee, new_employee)
 
         print_centered(f"{role} for {date.strftime('%Y-%m-%d')} updated to {new_employee}", Fore.GREEN)
         pause()
 
-    # Save updated schedule
-    save_schedule_data(date_primary, date_backup1, date_backup2, year)
-
-    # Recalculate counts and update reports
-    employees = load_employees()
-    primary_counts, backup_counts = recalculate_counts(employees, date_primary, date_backup1, date_backup2)
-    workbook = get_workbook(year)
-    generate_reports(workbook, employees, primary_counts, backup_counts)
-    workbook.save(get_schedule_file(year))
+    # Save updated schedule and reports with a single write of the workbook
+    record_schedule_changes(year, journal_changes)
+    with workbook_session():
+        # Recalculate counts and update reports
+        employees = load_employees()
+        primary_counts, backup_counts = recalculate_counts(employees, date_primary, date_backup1, date_backup2)
+        save_schedule_data(date_primary, date_backup1, date_backup2, year, dirty_dates=changed_dates,
+                           counts=(primary_counts, backup_counts))
+        workbook = get_workbook(year)
+        generate_reports(workbook, employees, primary_counts, backup_counts)
+        save_workbook(workbook, get_schedule_file(year))
 
     print_centered("Schedule changes saved and reports updated.", Fore.BLUE)
+    if load_numpy() is not None:
+        print_violations(validate_schedule(date_primary, date_backup1, date_backup2, employees))
     pause()
 
 
@@ -779,9 +3282,13 @@ def view_reports():
 
 
 def main_menu():
+    writer = start_background_writer()
     response = ""
     previous_responses = []
     while True:
+        errors = writer.take_errors()
+        if errors:
+            response = "\n".join([response] + [Fore.RED + error + Style.RESET_ALL for error in errors]).strip()
         clear_screen()
         for res in previous_responses[-5:]:
             print(res)
@@ -814,6 +3321,9 @@ def main_menu():
             response = ""
         elif choice == '5':
             clear_screen()
+            if writer.is_pending():
+                print_centered("Saving...", Fore.YELLOW)
+            writer.flush()
             sys.exit()
         elif choice == 'devintest':
             employees = DEVINTEST_EMPLOYEES.copy()
@@ -822,5 +3332,438 @@ def main_menu():
         else:
             response = "Invalid choice. Please try again."
 
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date: {value}")
+
+def read_employee_file(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def build_candidates(args, employees, horizon, prior_primary_counts, prior_backup_counts):
+    if args.candidates <= 1:
+        return build_seeded_schedule(employees, horizon, prior_primary_counts, prior_backup_counts, args.seed)
+    schedule, report = generate_best_schedule(employees, horizon, prior_primary_counts, prior_backup_counts,
+                                              candidates=args.candidates, base_seed=args.seed or 0, workers=args.workers)
+    gap, variance = report['score']
+    print(f"Best of {report['candidates']} seeds on {report['workers']} workers: seed {report['seed']} "
+          f"(max-min gap {gap}, variance {variance:.2f}) in {report['elapsed']:.2f}s")
+    return schedule
+
+def run_solver(args, employees, schedule, prior_primary_counts, prior_backup_counts):
+    if args.solver != 'local-search':
+        return schedule
+    schedule, report = improve_schedule(employees, schedule, prior_primary_counts, prior_backup_counts,
+                                        time_budget=args.time_budget, seed=schedule['seed'], iterations=args.iterations)
+    for line in format_solver_report(report):
+        print(line)
+    return schedule
+
+def describe_generation(schedule):
+    # What 'generate' needs to rebuild this schedule
+    if schedule.get('solver_iterations') is None:
+        return f"seed {schedule['seed']}"
+    return f"seed {schedule['seed']}, --iterations {schedule['solver_iterations']}"
+
+def cli_generate(args):
+    if args.devintest:
+        employees = DEVINTEST_EMPLOYEES.copy()
+    elif args.employees:
+        employees = read_employee_file(args.employees)
+    else:
+        employees = load_employees()
+    if not employees:
+        print("Employee list is empty. Add employees first.", file=sys.stderr)
+        return 1
+    teams = load_employee_teams() if not (args.devintest or args.employees) else None
+
+    horizon = bool(args.years or args.start or args.end)
+    if horizon:
+        if args.year is None and args.start is None:
+            print("Give --year or --start for a horizon schedule.", file=sys.stderr)
+            return 1
+        start_date = args.start or datetime.date(args.year, 1, 1)
+        end_date = args.end or datetime.date(start_date.year + (args.years or 1) - 1, 12, 31)
+        if end_date < start_date:
+            print("End date must not be before the start date.", file=sys.stderr)
+            return 1
+        replaced = get_replaced_partial_years(start_date, end_date, args.out_dir)
+        if replaced and not args.force:
+            print(f"A schedule already exists for {', '.join(map(str, replaced))} and the range only covers part of it; "
+                  f"the whole year would be replaced. Use --force to overwrite it.", file=sys.stderr)
+            return 1
+        first_year = start_date.year
+    elif args.year is None:
+        print("Give --year to generate a schedule.", file=sys.stderr)
+        return 1
+    else:
+        first_year = args.year
+
+    if args.no_prior:
+        prior_primary_counts, prior_backup_counts = {}, {}
+    else:
+        prior_primary_counts, prior_backup_counts = load_prior_counts(first_year, employees, compensate=args.compensate,
+                                                                     decay=args.history_decay)
+
+    if horizon:
+        schedule = build_candidates(args, employees, (start_date, end_date), prior_primary_counts, prior_backup_counts)
+        schedule = run_solver(args, employees, schedule, prior_primary_counts, prior_backup_counts)
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+        for path in write_horizon_workbooks(schedule, employees, out_dir=args.out_dir, teams=teams, force=args.force):
+            print(f"Saved {path}")
+        print(f"Schedule for {start_date} to {end_date} ({describe_generation(schedule)}) generated")
+        return 0
+
+    schedule = build_candidates(args, employees, args.year, prior_primary_counts, prior_backup_counts)
+    schedule = run_solver(args, employees, schedule, prior_primary_counts, prior_backup_counts)
+    path = write_schedule_workbook(schedule, employees, path=args.out, teams=teams)
+    print(f"Schedule for {args.year} ({describe_generation(schedule)}) saved to {path}")
+    return 0
+
+def cli_apply_changes(args):
+    try:
+        changes = read_schedule_changes(args.file)
+        applied = batch_edit_schedule(changes)
+    except (OSError, ValueError) as e:
+        print(f"Could not apply changes: {e}", file=sys.stderr)
+        return 1
+    for date, role, old_employee, new_employee in applied:
+        print(f"{date} {role}: {old_employee} -> {new_employee}")
+    print(f"Applied {len(applied)} of {len(changes)} changes")
+    if load_numpy() is not None:
+        for year in sorted({date.year for date, _, _, _ in applied}):
+            for violation in validate_schedule(*load_schedule_data(year), load_employees()):
+                print(f"Warning: {violation['date']}: {violation['detail']}")
+    return 0
+
+def parse_absence(value):
+    # 'Employee Name:YYYY-MM-DD' or 'Employee Name:YYYY-MM-DD:YYYY-MM-DD'
+    name, _, dates = value.partition(':')
+    bounds = [parse_date(part) for part in dates.split(':')] if dates else []
+    if not name.strip() or len(bounds) not in (1, 2):
+        raise argparse.ArgumentTypeError(f"Expected EMPLOYEE:START[:END], got {value!r}")
+    start, end = bounds[0], bounds[-1]
+    return name.strip(), [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+
+def cli_simulate(args):
+    if not args.absent and not args.runs:
+        print("Give --absent blackout dates and/or --runs for Monte-Carlo runs.", file=sys.stderr)
+        return 1
+    if args.year not in get_existing_schedule_years():
+        print(f"No schedule exists for {args.year}.", file=sys.stderr)
+        return 1
+    employees = load_employees()
+    try:
+        date_primary, date_backup1, date_backup2 = load_schedule_data(args.year)
+    except ValueError as e:
+        print(f"Could not read the {args.year} schedule: {e}", file=sys.stderr)
+        return 1
+    primary_counts, backup_counts = recalculate_counts(employees, date_primary, date_backup1, date_backup2)
+    schedule = {
+        'year': args.year,
+        'date_primary': date_primary,
+        'date_backup1': date_backup1,
+        'date_backup2': date_backup2,
+        'primary_counts': primary_counts,
+        'backup_counts': backup_counts,
+    }
+
+    if args.absent:
+        blackouts = defaultdict(list)
+        for emp, dates in args.absent:
+            blackouts[emp].extend(dates)
+        unknown = sorted(emp for emp in blackouts if emp not in employees)
+        if unknown:
+            print(f"Not on the employee list: {', '.join(unknown)}", file=sys.stderr)
+            return 1
+        # Monte-Carlo runs below then start from the schedule with these absences in
+        schedule, report = apply_blackouts(employees, schedule, blackouts)
+        for date, role, old_employee, new_employee in report['changes']:
+            print(f"{date} {role}: {old_employee} -> {new_employee or '(uncovered)'}")
+        print(f"{len(report['changes'])} slots reassigned, {len(report['gaps'])} left uncovered")
+        if args.apply:
+            applied = batch_edit_schedule([(date, role, new) for date, role, _, new in report['changes'] if new])
+            print(f"Applied {len(applied)} changes to the {args.year} schedule")
+
+    if args.runs:
+        summary = simulate_absences(employees, schedule, runs=args.runs, absence_rate=args.absence_rate,
+                                    max_days=args.max_days, base_seed=args.seed, workers=args.workers)
+        for line in format_simulation_report(summary):
+            print(line)
+    return 0
+
+def cli_export_ics(args):
+    years = args.years or sorted(get_existing_schedule_years())
+    missing = sorted(set(years) - get_existing_schedule_years())
+    if not years or missing:
+        print(f"No schedule exists for {', '.join(map(str, missing)) or 'any year'}.", file=sys.stderr)
+        return 1
+    try:
+        report = export_calendars(years, out_dir=args.out_dir, combined=args.combined, force=args.force)
+    except ValueError as e:
+        print(f"Could not read the schedule: {e}", file=sys.stderr)
+        return 1
+    print(f"{report['written']} calendar(s) written, {report['skipped']} unchanged, in {report['folder']}")
+    return 0
+
+def cli_report(args):
+    # Served from the history cache; a workbook is only opened when it changed
+    entry = load_schedule_history().get(args.year)
+    key = 'original_reports' if args.original else 'reports'
+    if not entry or not entry[key]:
+        print(f"No {'original ' if args.original else ''}report exists for {args.year}.", file=sys.stderr)
+        return 1
+    counts = entry[key]
+    print(f"{'Employee':<30}{'Primary Count':>15}{'Backup Count':>15}")
+    for emp in counts['primary']:
+        print(f"{emp:<30}{counts['primary'][emp]:>15}{counts['backup'].get(emp, 0):>15}")
+    return 0
+
+def cli_on_call(args):
+    end = args.end or args.date
+    if end < args.date:
+        print("--end is before --date.", file=sys.stderr)
+        return 1
+    existing_years = get_existing_schedule_years()
+    for year in range(args.date.year, end.year + 1):
+        if year not in existing_years:
+            print(f"No schedule exists for {year}.", file=sys.stderr)
+            return 1
+        try:
+            runs = load_schedule_runs(year)
+        except ValueError as e:
+            print(f"Could not read the {year} schedule: {e}", file=sys.stderr)
+            return 1
+        first = max(args.date, datetime.date(year, 1, 1))
+        last = min(end, datetime.date(year, 12, 31))
+        for role in SCHEDULE_ROLES:
+            for start, stop, emp in runs[role].between(first, last):
+                when = str(start) if start == stop else f"{start} to {stop}"
+                print(f"{when}\t{role}\t{emp}")
+    return 0
+
+def cli_serve(args):
+    def ready(server):
+        host, port = server.server_address[:2]
+        print(f"Serving on-call lookups on http://{host}:{port}/on-call (Ctrl+C to stop)")
+
+    try:
+        serve_lookups(args.host, args.port, args.interval, ready=ready)
+    except KeyboardInterrupt:
+        pass
+    except ValueError as e:
+        print(f"Could not read the schedule: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+def cli_generate_teams(args):
+    teams = load_employee_teams()
+    if not teams:
+        print("No employee has a team. Add a 'Team' column to the Employee List.", file=sys.stderr)
+        return 1
+    without_team = [emp for emp in load_employees() if emp not in teams]
+    if without_team:
+        print(f"Skipping {len(without_team)} employee(s) without a team: {', '.join(without_team)}")
+    paths, _, team_rows = generate_team_schedules(teams, args.year, seed=args.seed, workers=args.workers,
+                                                   use_prior=not args.no_prior)
+    for row in team_rows:
+        print(f"{row['team']}: {row['employees']} employees, primary spread {row['primary_spread']}, "
+              f"backup spread {row['backup_spread']}, {row['reassigned']} shared-day slots reassigned, "
+              f"{row['gaps']} uncovered")
+    for path in paths:
+        print(f"Saved {path}")
+    return 1 if any(row['gaps'] for row in team_rows) else 0
+
+def read_holiday_file(path):
+    with open(path, encoding='utf-8') as f:
+        return {parse_date(line.strip()) for line in f if line.strip() and not line.startswith('#')}
+
+def cli_analytics(args):
+    if load_numpy() is None:
+        print("Fairness analytics need NumPy (pip install numpy).", file=sys.stderr)
+        return 1
+    years = args.years or sorted(get_existing_schedule_years())
+    missing = sorted(set(years) - get_existing_schedule_years())
+    if not years or missing:
+        print(f"No schedule exists for {', '.join(map(str, missing)) or 'any year'}.", file=sys.stderr)
+        return 1
+    holidays = read_holiday_file(args.holidays) if args.holidays else None
+    try:
+        rows, summary = compute_fairness_analytics(years, employees=load_employees(), holidays=holidays)
+    except ValueError as e:
+        print(f"Could not read the schedule: {e}", file=sys.stderr)
+        return 1
+    print(f"{summary['employees']} employees over {summary['days']} days ({years[0]}-{years[-1]})")
+    for key in ('primary', 'backup', 'weekend'):
+        print(f"{key.capitalize()} load: Gini {summary[key + '_gini']:.3f}, variance {summary[key + '_variance']:.2f}")
+    if args.out:
+        write_analytics_table(args.out, rows)
+        print(f"Per-employee table written to {args.out}")
+    return 0
+
+def format_journal_entry(entry):
+    line = (f"{entry['seq']:>5} {entry['timestamp']} {entry['date']} {entry['role']}: "
+            f"{entry['old'] or '-'} -> {entry['new'] or '-'} ({entry['who']})")
+    if 'undo_of' in entry:
+        line += f" [undo of {entry['undo_of']}]"
+    return line
+
+def cli_journal(args):
+    entries = read_journal(get_journal_file(args.year))
+    if not entries:
+        print(f"No recorded changes for {args.year}.")
+        return 0
+    for entry in entries[-args.limit:] if args.limit else entries:
+        print(format_journal_entry(entry))
+    return 0
+
+def cli_undo(args):
+    if args.year not in get_existing_schedule_years():
+        print(f"No schedule exists for {args.year}.", file=sys.stderr)
+        return 1
+    try:
+        entry = undo_schedule_change(args.year, seq=args.seq, force=args.force)
+    except (OSError, ValueError) as e:
+        print(f"Could not undo: {e}", file=sys.stderr)
+        return 1
+    print(format_journal_entry(entry))
+    return 0
+
+def cli_validate(args):
+    if load_numpy() is None:
+        print("Schedule validation needs NumPy (pip install numpy).", file=sys.stderr)
+        return 1
+    if args.year not in get_existing_schedule_years():
+        print(f"No schedule exists for {args.year}.", file=sys.stderr)
+        return 1
+    try:
+        date_primary, date_backup1, date_backup2 = load_schedule_data(args.year)
+    except ValueError as e:
+        print(f"Could not read the {args.year} schedule: {e}", file=sys.stderr)
+        return 1
+    violations = validate_schedule(date_primary, date_backup1, date_backup2, load_employees(),
+                                   max_primary_days=args.max_primary_days, max_backup_days=args.max_backup_days)
+    for violation in violations:
+        when = violation['date'] or 'whole schedule'
+        print(f"{when}\t{violation['rule']}\t{violation['detail']}")
+    print(f"{len(violations)} violation(s) in {args.year}")
+    return 1 if violations else 0
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="On Call Scheduling Program")
+    parser.add_argument('--profile', action='store_true', help="Log phase timings and counters to the schedule log")
+    parser.add_argument('--profile-dump', default=None, help="Also write a cProfile dump to this file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help="Generate a schedule without prompts")
+    gen.add_argument('--year', type=int, default=None, help="Year to generate (first year in horizon mode)")
+    gen.add_argument('--seed', type=int, default=None)
+    gen.add_argument('--out', default=None, help="Output .xlsx path (defaults to the scheduling folder)")
+    gen.add_argument('--years', type=int, default=None, help="Generate this many consecutive years in one pass")
+    gen.add_argument('--start', type=parse_date, default=None, help="Horizon start date (YYYY-MM-DD)")
+    gen.add_argument('--end', type=parse_date, default=None, help="Horizon end date (YYYY-MM-DD)")
+    gen.add_argument('--out-dir', default=None, help="Folder for horizon workbooks (defaults to the scheduling folder)")
+    gen.add_argument('--force', action='store_true',
+                     help="Replace existing years that the horizon only partly covers")
+    gen.add_argument('--employees', default=None, help="Text file with one employee name per line")
+    gen.add_argument('--devintest', action='store_true', help="Use the built-in test employee list")
+    gen.add_argument('--no-prior', action='store_true', help="Ignore the previous year's counts")
+    gen.add_argument('--compensate', action='store_true', help="Compensate for last year's schedule edits")
+    gen.add_argument('--history-decay', type=float, default=None,
+                     help="Weigh every earlier year, multiplying by this factor per year back")
+    gen.add_argument('--candidates', type=int, default=1,
+                     help="Try this many seeds (starting at --seed) in parallel and keep the fairest")
+    gen.add_argument('--workers', type=int, default=None, help="Worker processes for --candidates (defaults to CPU count)")
+    gen.add_argument('--solver', choices=['greedy', 'local-search'], default='greedy',
+                     help="'local-search' improves the greedy result within the time budget")
+    gen.add_argument('--time-budget', type=float, default=2.0, help="Seconds the local-search solver may spend")
+    gen.add_argument('--iterations', type=int, default=None,
+                     help="Run the local-search solver for exactly this many steps instead of the time budget")
+    gen.set_defaults(func=cli_generate)
+
+    changes = subparsers.add_parser('apply-changes', help="Apply a CSV/JSON list of (date, role, employee) changes")
+    changes.add_argument('file', help="CSV with date,role,employee columns or a JSON list")
+    changes.set_defaults(func=cli_apply_changes)
+
+    simulate = subparsers.add_parser('simulate', help="What-if absences: blackout dates or Monte-Carlo runs")
+    simulate.add_argument('--year', type=int, required=True)
+    simulate.add_argument('--absent', type=parse_absence, action='append', default=[], metavar='EMPLOYEE:START[:END]',
+                          help="Blackout dates for an employee (repeatable)")
+    simulate.add_argument('--apply', action='store_true', help="Write the --absent reassignments to the schedule")
+    simulate.add_argument('--runs', type=int, default=0, help="Monte-Carlo runs of random absences")
+    simulate.add_argument('--absence-rate', type=float, default=0.1, help="Chance each employee is away in a run")
+    simulate.add_argument('--max-days', type=int, default=10, help="Longest random absence in days")
+    simulate.add_argument('--seed', type=int, default=0, help="Seed of the first Monte-Carlo run")
+    simulate.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to CPU count)")
+    simulate.set_defaults(func=cli_simulate)
+
+    ics = subparsers.add_parser('export-ics', help="Write iCalendar files of each employee's on-call days")
+    ics.add_argument('--years', type=int, nargs='+', default=None, help="Years to include (defaults to every schedule)")
+    ics.add_argument('--out-dir', default=None, help="Output folder (defaults to Calendars in the scheduling folder)")
+    ics.add_argument('--combined', action='store_true', help="One feed with everyone instead of a file per employee")
+    ics.add_argument('--force', action='store_true', help="Rewrite files even when nothing changed")
+    ics.set_defaults(func=cli_export_ics)
+
+    report = subparsers.add_parser('report', help="Print a year's primary and backup counts")
+    report.add_argument('--year', type=int, required=True)
+    report.add_argument('--original', action='store_true', help="Counts as generated, before any edits")
+    report.set_defaults(func=cli_report)
+
+    on_call = subparsers.add_parser('on-call', help="Who is on call on a date or over a date range")
+    on_call.add_argument('--date', type=parse_date, required=True)
+    on_call.add_argument('--end', type=parse_date, default=None, help="Last date of the range (defaults to --date)")
+    on_call.set_defaults(func=cli_on_call)
+
+    serve = subparsers.add_parser('serve', help="Answer on-call lookups over local HTTP/JSON")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--interval', type=float, default=1.0, help="Seconds between schedule file checks")
+    serve.set_defaults(func=cli_serve)
+
+    team_gen = subparsers.add_parser('generate-teams', help="Generate every team's schedule in parallel")
+    team_gen.add_argument('--year', type=int, required=True)
+    team_gen.add_argument('--seed', type=int, default=0, help="Seed of the first team; later teams count up")
+    team_gen.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to CPU count)")
+    team_gen.add_argument('--no-prior', action='store_true', help="Ignore each team's previous-year counts")
+    team_gen.set_defaults(func=cli_generate_teams)
+
+    analytics = subparsers.add_parser('analytics', help="Fairness analytics across years")
+    analytics.add_argument('--years', type=int, nargs='+', default=None, help="Years to include (defaults to every schedule)")
+    analytics.add_argument('--holidays', default=None, help="Text file with one holiday date (YYYY-MM-DD) per line")
+    analytics.add_argument('--out', default=None, help="CSV file for the per-employee table")
+    analytics.set_defaults(func=cli_analytics)
+
+    journal = subparsers.add_parser('journal', help="List the recorded schedule changes for a year")
+    journal.add_argument('--year', type=int, required=True)
+    journal.add_argument('--limit', type=int, default=None, help="Only the most recent entries")
+    journal.set_defaults(func=cli_journal)
+
+    undo = subparsers.add_parser('undo', help="Revert a recorded schedule change without rewriting the workbook")
+    undo.add_argument('--year', type=int, required=True)
+    undo.add_argument('--seq', type=int, default=None, help="Journal entry to revert (defaults to the latest one)")
+    undo.add_argument('--force', action='store_true', help="Revert even if the assignment has changed since")
+    undo.set_defaults(func=cli_undo)
+
+    validate = subparsers.add_parser('validate', help="Check a year's schedule against the scheduling rules")
+    validate.add_argument('--year', type=int, required=True)
+    validate.add_argument('--max-primary-days', type=int, default=None)
+    validate.add_argument('--max-backup-days', type=int, default=None)
+    validate.set_defaults(func=cli_validate)
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.profile or args.profile_dump:
+        start_profiling(dump_path=args.profile_dump)
+    else:
+        profiling_from_env()
+    return args.func(args)
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    profiling_from_env()
     main_menu()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import oncall
+
+
+@pytest.fixture
+def scheduling_folder(tmp_path, monkeypatch):
+    # Point the module at an empty scheduling folder with cold caches
+    folder = str(tmp_path / 'On-Call Scheduling')
+    monkeypatch.setattr(oncall, 'SCHEDULING_FOLDER', folder)
+    monkeypatch.setattr(oncall, 'HISTORY_FILE', os.path.join(folder, 'schedule_history.json'))
+    monkeypatch.setattr(oncall, '_history_cache', None)
+    oncall._workbook_cache.clear()
+    yield folder
+    oncall._workbook_cache.clear()
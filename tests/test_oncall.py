@@ -0,0 +1,717 @@
+import datetime
+import os
+import random
+import subprocess
+import sys
+from collections import Counter
+
+import pytest
+
+import oncall
+
+
+def linear_scan_primaries(employees, week_dates, total_primary_counts, rng):
+    # The rotation as it was before the heap: re-sort the cycle every week
+    primary_counts = {emp: 0 for emp in employees}
+    primary_schedule = {}
+    employee_cycle = employees.copy()
+    rng.shuffle(employee_cycle)
+    for week_start in week_dates:
+        employee_cycle.sort(key=lambda emp: total_primary_counts.get(emp, 0) + primary_counts[emp])
+        emp = employee_cycle[0]
+        primary_schedule[week_start] = emp
+        primary_counts[emp] += 1
+        employee_cycle = employee_cycle[1:] + [emp]
+    return primary_schedule, primary_counts
+
+
+def test_heap_rotation_matches_linear_scan():
+    for case in range(200):
+        rng = random.Random(case)
+        employees = [f"Employee {idx}" for idx in range(rng.randint(1, 40))]
+        priors = {emp: rng.choice([0, 0, 1, 2, 3, 0.5, 1.25]) for emp in employees if rng.random() < 0.7}
+        week_dates = oncall.get_week_dates(2020 + case % 10)
+        expected = linear_scan_primaries(employees, week_dates, priors, random.Random(case))
+        assert oncall.assign_primaries(employees, week_dates, priors, random.Random(case)) == expected
+
+
+def linear_scan_backups(employees, all_dates, date_primary, total_backup_counts):
+    # The selection as it was before the load index: filter and sort the whole
+    # roster every day
+    backup_counts = {emp: 0 for emp in employees}
+    date_backup1 = {}
+    date_backup2 = {}
+    one_day = datetime.timedelta(days=1)
+    for date in all_dates:
+        primary = date_primary[date]
+        excluded = {primary, date_backup1.get(date - one_day), date_backup2.get(date - one_day),
+                    date_primary.get(date + one_day)}
+        eligible = [emp for emp in employees if emp not in excluded]
+        eligible.sort(key=lambda emp: total_backup_counts.get(emp, 0) + backup_counts[emp])
+        emp = eligible[0] if eligible else [e for e in employees if e != primary][0]
+        date_backup1[date] = emp
+        backup_counts[emp] += 1
+        eligible = [e for e in eligible if e != emp]
+        eligible.sort(key=lambda emp: total_backup_counts.get(emp, 0) + backup_counts[emp])
+        emp = eligible[0] if eligible else [e for e in employees if e not in (primary, date_backup1[date])][0]
+        date_backup2[date] = emp
+        backup_counts[emp] += 1
+    return date_backup1, date_backup2, backup_counts
+
+
+def test_backup_load_index_matches_linear_scan():
+    for case in range(300):
+        rng = random.Random(case)
+        employees = [f"Employee {idx}" for idx in range(rng.randint(3, 30))]
+        priors = {emp: rng.choice([0, 0, 1, 2, 5, 0.5]) for emp in employees if rng.random() < 0.7}
+        schedule = oncall.build_schedule(employees, 2020 + case % 10, seed=case)
+        all_dates = sorted(schedule['date_primary'])
+        expected = linear_scan_backups(employees, all_dates, schedule['date_primary'], priors)
+        assert oncall.assign_backups(employees, all_dates, schedule['date_primary'], priors) == expected
+
+
+def test_import_does_not_load_the_optional_packages():
+    # A fresh interpreter, so modules other tests imported do not count
+    code = ("import sys, oncall; "
+            "print(sorted(name for name in ('openpyxl', 'numpy', 'colorama') if name in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
+
+
+def test_horizon_refuses_to_replace_a_partly_covered_year(scheduling_folder):
+    assert oncall.main(['generate', '--devintest', '--year', '2030', '--seed', '1']) == 0
+    before = oncall.load_schedule_data(2030)[0]
+
+    argv = ['generate', '--devintest', '--start', '2030-06-03', '--end', '2031-12-31', '--seed', '2']
+    assert oncall.main(argv) == 1
+    assert oncall.load_schedule_data(2030)[0] == before
+    assert 2031 not in oncall.get_existing_schedule_years()
+
+    assert oncall.main(argv + ['--force']) == 0
+    assert 2031 in oncall.get_existing_schedule_years()
+    assert before[datetime.date(2030, 2, 4)]
+    assert not oncall.load_schedule_data(2030)[0][datetime.date(2030, 2, 4)]
+
+
+def test_schedule_store_round_trip(tmp_path):
+    schedule = oncall.build_schedule(oncall.DEVINTEST_EMPLOYEES, 2031, seed=3)
+    date_primary = dict(schedule['date_primary'])
+    date_backup1 = dict(schedule['date_backup1'])
+    date_backup2 = dict(schedule['date_backup2'])
+    date_backup2[datetime.date(2031, 3, 4)] = ''
+    path = str(tmp_path / 'year.oncall')
+    oncall.write_schedule_store(path, date_primary, date_backup1, date_backup2, {'year': 2031, 'seed': 3})
+
+    store = oncall.read_schedule_store(path)
+    assert store['metadata'] == {'year': 2031, 'seed': 3}
+    assert len(store['days']) == 365
+    loaded = oncall.unpack_schedule(store)
+    # Every calendar day is stored; days outside the generated weeks come back unassigned
+    for written, read in zip((date_primary, date_backup1, date_backup2), loaded):
+        assert {date: emp for date, emp in read.items() if emp} == {date: emp for date, emp in written.items() if emp}
+        assert set(read) == set(oncall.get_year_dates(2031))
+
+
+def test_stale_store_is_ignored_after_a_workbook_edit(scheduling_folder):
+    schedule = oncall.build_schedule(oncall.DEVINTEST_EMPLOYEES, 2031, seed=3)
+    oncall.write_schedule_workbook(schedule, oncall.DEVINTEST_EMPLOYEES)
+    assert oncall.load_schedule_store(2031) is not None
+    store_mtime = os.path.getmtime(oncall.get_store_file(2031))
+    os.utime(oncall.get_schedule_file(2031), (store_mtime + 10, store_mtime + 10))
+    assert oncall.load_schedule_store(2031) is None
+
+
+def test_regenerating_keeps_sheets_the_user_added(scheduling_folder):
+    from openpyxl import load_workbook
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.write_schedule_workbook(oncall.build_schedule(employees, 2031, seed=1), employees)
+    path = oncall.get_schedule_file(2031)
+    workbook = load_workbook(path)
+    workbook.create_sheet('Notes')['A1'] = 'Swap agreed with Bob'
+    workbook.save(path)
+
+    schedule = oncall.build_schedule(employees, 2031, seed=2)
+    oncall.write_schedule_workbook(schedule, employees)
+    workbook = load_workbook(path)
+    assert workbook.sheetnames == oncall.get_schedule_sheet_names(2031) + ['Notes']
+    assert workbook['Notes']['A1'].value == 'Swap agreed with Bob'
+    parsed = oncall.parse_calendar_sheets(workbook, 2031)
+    for mapping, expected in zip(parsed, (schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'])):
+        assert {date: emp for date, emp in mapping.items() if emp} == expected
+    assert oncall.read_report_counts(workbook) == (schedule['primary_counts'], schedule['backup_counts'])
+    assert oncall.get_extra_sheets(path, 2031) == ['Notes']
+
+
+def test_workbook_cache_reloads_a_file_changed_on_disk(scheduling_folder):
+    from openpyxl import load_workbook
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.write_schedule_workbook(oncall.build_schedule(employees, 2031, seed=1), employees)
+    path = oncall.get_schedule_file(2031)
+    cached = oncall.open_workbook(path)
+    assert oncall.open_workbook(path) is cached
+
+    # Saved by someone else, e.g. Excel
+    workbook = load_workbook(path)
+    workbook['Reports']['B2'] = 99
+    workbook.save(path)
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+    reloaded = oncall.open_workbook(path)
+    assert reloaded is not cached
+    assert reloaded['Reports']['B2'].value == 99
+    assert oncall.open_workbook(path) is reloaded
+
+
+def edit_interactively(monkeypatch, year, first, last, role_choice, employee):
+    # Drive manage_schedule_changes() with the same answer for every date
+    employee_number = str(oncall.load_employees().index(employee) + 1)
+    answers = [str(year), f"{first} to {last}"] + [role_choice, employee_number] * ((last - first).days + 1)
+    monkeypatch.setattr('builtins.input', lambda *args: answers.pop(0))
+    monkeypatch.setattr(oncall, 'clear_screen', lambda: None)
+    monkeypatch.setattr(oncall, 'pause', lambda *args: None)
+    monkeypatch.setattr(oncall, 'center_text', lambda text, width=None: text)
+    oncall.manage_schedule_changes()
+
+
+def read_reports(year):
+    oncall.evict_workbook(oncall.get_schedule_file(year))
+    return oncall.read_report_counts(oncall.get_workbook(year))
+
+
+@pytest.mark.parametrize('days', [1, 4, 7])
+def test_batch_and_interactive_edits_write_the_same_reports(scheduling_folder, monkeypatch, days):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.save_employees(employees)
+    schedule = oncall.build_schedule(employees, 2031, seed=4)
+    first = datetime.date(2031, 3, 3)
+    last = first + datetime.timedelta(days=days - 1)
+    cover = next(emp for emp in employees if emp != schedule['date_primary'][first])
+    dates = [first + datetime.timedelta(days=offset) for offset in range(days)]
+
+    oncall.write_schedule_workbook(schedule, employees)
+    assert read_reports(2031) == (schedule['primary_counts'], schedule['backup_counts'])
+    oncall.batch_edit_schedule([(date, 'Primary', cover) for date in dates])
+    batch_reports = read_reports(2031)
+
+    oncall.write_schedule_workbook(schedule, employees)
+    edit_interactively(monkeypatch, 2031, first, last, '1', cover)
+    interactive_reports = read_reports(2031)
+
+    assert batch_reports == interactive_reports
+    assert batch_reports == oncall.recalculate_counts(employees, *oncall.load_schedule_data(2031))
+    # Edited reports count primary days
+    original = schedule['date_primary'][first]
+    recount = oncall.recalculate_counts(employees, schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'])
+    assert batch_reports[0][cover] == recount[0][cover] + days
+    assert batch_reports[0][original] == recount[0][original] - days
+
+
+def test_batch_edits_move_the_saved_counts_without_recounting(scheduling_folder, monkeypatch):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.save_employees(employees)
+    schedule = oncall.build_schedule(employees, 2031, seed=4)
+    oncall.write_schedule_workbook(schedule, employees)
+    first = datetime.date(2031, 3, 3)
+    cover = next(emp for emp in employees if emp != schedule['date_primary'][first])
+    oncall.batch_edit_schedule([(first, 'Primary', cover)])
+    # Logged but not yet written into the workbook
+    second = first + datetime.timedelta(days=1)
+    oncall.record_schedule_changes(2031, [(second, 'Backup 1', schedule['date_backup1'][second], cover)])
+
+    def recount(*args):
+        raise AssertionError('batch edit recounted the calendar')
+    with monkeypatch.context() as patch:
+        patch.setattr(oncall, 'recalculate_counts', recount)
+        oncall.batch_edit_schedule([(first + datetime.timedelta(days=2), 'Primary', cover)])
+
+    expected = oncall.recalculate_counts(employees, *oncall.load_schedule_data(2031))
+    assert read_reports(2031) == expected
+    assert oncall.load_schedule_store(2031)['metadata']['counts'] == oncall.get_store_counts(*expected)
+
+
+def reference_violations(date_primary, date_backup1, date_backup2):
+    # The scheduling rules checked one day at a time
+    one_day = datetime.timedelta(days=1)
+    backups = lambda date: {date_backup1.get(date), date_backup2.get(date)} - {None, ''}
+    found = set()
+    for date in set(date_primary) | set(date_backup1) | set(date_backup2):
+        holders = [date_primary.get(date), date_backup1.get(date), date_backup2.get(date)]
+        for emp in {emp for emp in holders if emp and holders.count(emp) > 1}:
+            found.add(('double-role', date, emp))
+        for emp in backups(date) & backups(date - one_day):
+            found.add(('consecutive-backup', date, emp))
+        next_primary = date_primary.get(date + one_day)
+        if next_primary and next_primary != date_primary.get(date) and next_primary in backups(date):
+            found.add(('backup-before-primary', date, next_primary))
+    return found
+
+
+def test_validator_matches_a_per_day_reference():
+    pytest.importorskip('numpy')
+    employees = oncall.DEVINTEST_EMPLOYEES[:8]
+    for seed in range(20):
+        schedule = oncall.build_schedule(employees, 2032, seed=seed)
+        rng = random.Random(seed)
+        mappings = [dict(schedule[key]) for key in ('date_primary', 'date_backup1', 'date_backup2')]
+        dates = sorted(mappings[0])
+        for _ in range(30):
+            mapping = rng.choice(mappings)
+            mapping[rng.choice(dates)] = rng.choice(employees + [''])
+        found = {(v['rule'], v['date'], v['employee']) for v in oncall.validate_schedule(*mappings, employees)}
+        assert found == reference_violations(*mappings)
+
+
+def test_validator_reports_each_rule():
+    pytest.importorskip('numpy')
+    monday = datetime.date(2032, 3, 1)
+    day = lambda offset: monday + datetime.timedelta(days=offset)
+    date_primary = {day(offset): 'A' if offset < 7 else 'B' for offset in range(10)}
+    date_backup1 = {day(offset): 'C' for offset in range(10)}
+    date_backup2 = {day(offset): 'D' if offset % 2 else 'E' for offset in range(10)}
+    date_backup2[day(6)] = 'B'
+    date_backup1[day(2)] = 'A'
+    rules = {(v['rule'], v['date']) for v in oncall.validate_schedule(date_primary, date_backup1, date_backup2,
+                                                                    max_primary_days=6, max_backup_days=20)}
+    assert ('double-role', day(2)) in rules
+    assert ('consecutive-backup', day(1)) in rules
+    assert ('backup-before-primary', day(6)) in rules
+    assert ('max-primary-load', None) in rules
+    assert ('max-backup-load', None) not in rules
+
+
+def test_local_search_replays_from_seed_and_iterations(monkeypatch):
+    employees = [f"Employee {idx}" for idx in range(60)]
+    priors = {emp: idx % 5 for idx, emp in enumerate(employees)}
+    schedule = oncall.build_schedule(employees, 2033, prior_primary_counts=priors, seed=9)
+    full_run, full_report = oncall.improve_schedule(employees, schedule, priors, time_budget=60, seed=9)
+    assert oncall.improve_schedule(employees, schedule, priors, seed=9, iterations=full_report['iterations'])[0] == full_run
+
+    # A clock that ticks on every read runs out part way through the search
+    ticks = iter(range(10 ** 9))
+    monkeypatch.setattr(oncall.time, 'perf_counter', lambda: next(ticks))
+    cut_run, cut_report = oncall.improve_schedule(employees, schedule, priors, time_budget=100, seed=9)
+    monkeypatch.undo()
+    assert 0 < cut_report['iterations'] < full_report['iterations']
+    replayed, replay_report = oncall.improve_schedule(employees, schedule, priors, time_budget=0, seed=9,
+                                                      iterations=cut_report['iterations'])
+    assert replay_report['iterations'] == cut_report['iterations']
+    assert replayed == cut_run
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_improved_counts_match_a_recount(seed):
+    # 2031 ends on a Wednesday, so the last primary week is a partial one
+    employees = [f"E{idx}" for idx in range(10)]
+    schedule = oncall.build_schedule(employees, 2031, seed=seed)
+    for offset in range(42):
+        schedule['date_primary'][datetime.date(2031, 12, 31) - datetime.timedelta(days=offset)] = 'E0'
+    improved, report = oncall.improve_schedule(employees, schedule, seed=seed, iterations=5000)
+    recount = oncall.recalculate_counts(employees, improved['date_primary'], improved['date_backup1'],
+                                        improved['date_backup2'])
+    assert (improved['primary_counts'], improved['backup_counts']) == recount
+    assert report['improved']['primary_spread'] <= report['greedy']['primary_spread']
+
+
+def test_best_of_seeds_is_reproduced_from_the_reported_seed(scheduling_folder, capsys):
+    argv = ['generate', '--devintest', '--year', '2034', '--seed', '10', '--candidates', '6', '--workers', '1',
+            '--solver', 'local-search']
+    assert oncall.main(argv + ['--out', os.path.join(scheduling_folder, 'best.xlsx')]) == 0
+    best = oncall.read_schedule_store(os.path.join(scheduling_folder, 'best.oncall'))
+    seed = best['metadata']['seed']
+    iterations = best['metadata']['solver_iterations']
+    assert f"seed {seed}, --iterations {iterations}" in capsys.readouterr().out
+
+    replay = ['generate', '--devintest', '--year', '2034', '--seed', str(seed), '--solver', 'local-search',
+              '--iterations', str(iterations), '--out', os.path.join(scheduling_folder, 'replay.xlsx')]
+    assert oncall.main(replay) == 0
+    replayed = oncall.read_schedule_store(os.path.join(scheduling_folder, 'replay.oncall'))
+    assert oncall.unpack_schedule(replayed) == oncall.unpack_schedule(best)
+
+
+def test_years_created_in_the_same_folder_tick_are_seen(scheduling_folder):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.write_schedule_workbook(oncall.build_schedule(employees, 2035, seed=1), employees)
+    folder_mtime = os.path.getmtime(scheduling_folder)
+    assert 2035 in oncall.load_schedule_history()
+    oncall.write_schedule_workbook(oncall.build_schedule(employees, 2036, seed=1), employees)
+    # Coarse timestamps on network folders leave the folder mtime unchanged
+    os.utime(scheduling_folder, (folder_mtime, folder_mtime))
+    assert {2035, 2036} <= oncall.get_existing_schedule_years()
+    history = oncall.load_schedule_history()
+    assert history[2036]['reports']['primary'] == oncall.build_schedule(employees, 2036, seed=1)['primary_counts']
+    assert not [name for name in os.listdir(scheduling_folder) if name.endswith('.tmp')]
+
+
+def scan_calendar_cells(workbook, year):
+    # The original parser: scan every cell below the weekday row for 'Day N'
+    # text and read the line after each role label
+    mappings = ({}, {}, {})
+    for month in range(1, 13):
+        month_name = datetime.date(year, month, 1).strftime('%B')
+        for row in workbook[month_name].iter_rows(min_row=3, values_only=True):
+            for content in row:
+                if not content:
+                    continue
+                lines = str(content).split('\n')
+                day_num = int(lines[0].split()[1])
+                holders = ['', '', '']
+                for idx, line in enumerate(lines[:-1]):
+                    if line.strip() in ('P:', 'B1:', 'B2:'):
+                        holders[('P:', 'B1:', 'B2:').index(line.strip())] = lines[idx + 1].strip()
+                for mapping, holder in zip(mappings, holders):
+                    mapping[datetime.date(year, month, day_num)] = holder
+    return mappings
+
+
+def test_calendar_parser_matches_a_full_cell_scan(scheduling_folder):
+    from openpyxl import load_workbook
+    employees = oncall.DEVINTEST_EMPLOYEES + ["Siobhan O'Neil-Ross Jr."]
+    schedule = oncall.build_schedule(employees, 2032, seed=5)
+    path = oncall.write_schedule_workbook(schedule, employees)
+    workbook = load_workbook(path)
+    assert oncall.parse_calendar_sheets(workbook, 2032) == scan_calendar_cells(workbook, 2032)
+
+    # A hand edit in Excel the hidden sheet does not know about: a changed
+    # name, a blank role and CRLF line breaks
+    workbook['March']['B3'] = oncall.format_calendar_cell(2, 'Hand Edit', '', 'Eve Brown').replace('\n', '\r\n')
+    parsed = oncall.parse_calendar_sheets(workbook, 2032)
+    assert parsed[0][datetime.date(2032, 3, 2)] == 'Hand Edit'
+    assert parsed[1][datetime.date(2032, 3, 2)] == ''
+    assert parsed == scan_calendar_cells(workbook, 2032)
+
+
+def test_schedule_data_sheet_round_trips_the_mappings(scheduling_folder):
+    from openpyxl import load_workbook
+    employees = oncall.DEVINTEST_EMPLOYEES
+    schedule = oncall.build_schedule(employees, 2032, seed=3)
+    mappings = (schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'])
+    workbook = load_workbook(oncall.write_schedule_workbook(schedule, employees))
+    assert workbook[oncall.SCHEDULE_DATA_SHEET].sheet_state == 'hidden'
+    months = oncall.read_schedule_data_sheet(workbook)
+    assert sorted(months) == list(range(1, 13))
+    for date in mappings[0]:
+        assert months[date.month][date.day - 1] == tuple(mapping.get(date, '') for mapping in mappings)
+    assert oncall.parse_calendar_sheets(workbook, 2032) == scan_calendar_cells(workbook, 2032)
+
+    # Rewriting one month leaves the other rows alone
+    date = datetime.date(2032, 6, 9)
+    schedule['date_backup2'][date] = 'Round Trip'
+    oncall.write_schedule_data_sheet(workbook, 2032, *mappings, months=[6])
+    updated = oncall.read_schedule_data_sheet(workbook)
+    assert updated[6][8][2] == 'Round Trip'
+    assert {month: days for month, days in updated.items() if month != 6} == \
+        {month: days for month, days in months.items() if month != 6}
+
+    # An unreadable row drops the whole sheet and the cells are parsed instead
+    workbook[oncall.SCHEDULE_DATA_SHEET]['B5'] = 'not json'
+    assert oncall.read_schedule_data_sheet(workbook) == {}
+    assert oncall.parse_calendar_sheets(workbook, 2032) == scan_calendar_cells(workbook, 2032)
+
+
+def test_malformed_calendar_cell_is_reported_not_raised(scheduling_folder, monkeypatch, capsys):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.save_employees(employees)
+    oncall.write_schedule_workbook(oncall.build_schedule(employees, 2032, seed=5), employees)
+    workbook = oncall.get_workbook(2032)
+    workbook['April']['D3'] = 'not a calendar cell'
+    oncall.save_workbook(workbook, oncall.get_schedule_file(2032))
+
+    assert oncall.main(['validate', '--year', '2032']) == 1
+    assert 'Could not read the 2032 schedule: Malformed calendar cell April!D3' in capsys.readouterr().err
+
+    edit_interactively(monkeypatch, 2032, datetime.date(2032, 4, 1), datetime.date(2032, 4, 1), '1', employees[0])
+    assert 'Could not read the 2032 schedule' in capsys.readouterr().out
+
+
+def test_stale_lock_is_taken_over_with_a_warning(tmp_path, caplog):
+    path = str(tmp_path / 'schedule.xlsx')
+    with open(path + '.lock', 'w') as f:
+        f.write('4242 crashed-host token\n')
+    old = os.path.getmtime(path + '.lock') - 600
+    os.utime(path + '.lock', (old, old))
+    with caplog.at_level('WARNING', logger='oncall'):
+        with oncall.file_lock(path, timeout=1, stale=60):
+            assert '4242 crashed-host' not in open(path + '.lock').read()
+    assert 'crashed-host' in caplog.text
+    assert not os.path.exists(path + '.lock')
+
+
+def test_lock_held_by_someone_else_is_not_removed(tmp_path):
+    path = str(tmp_path / 'schedule.xlsx')
+    with oncall.file_lock(path):
+        # Another instance took the lock over while this one held it
+        with open(path + '.lock', 'w') as f:
+            f.write('4242 other-host token\n')
+    assert open(path + '.lock').read() == '4242 other-host token\n'
+    with pytest.raises(TimeoutError):
+        with oncall.file_lock(path, timeout=0.2):
+            pass
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_blackouts_recount_the_resulting_schedule(seed):
+    employees = [f"Employee {i}" for i in range(6)]
+    schedule = oncall.build_schedule(employees, 2032, seed=seed)
+    dates = sorted(schedule['date_primary'])
+    blackouts = oncall.random_blackouts(employees, dates, random.Random(seed), 0.8, 20)
+    simulated, report = oncall.apply_blackouts(employees, schedule, blackouts)
+    assert report['changes']
+    assert (simulated['primary_counts'], simulated['backup_counts']) == oncall.recalculate_counts(
+        employees, simulated['date_primary'], simulated['date_backup1'], simulated['date_backup2'])
+    assert min(simulated['primary_counts'].values()) >= 0
+    assert min(simulated['backup_counts'].values()) >= 0
+
+
+def test_team_workbooks_report_their_recounted_assignments(scheduling_folder):
+    teams = {'Shared A': ['Alpha', 'Beta'], 'Shared B': ['Alpha', 'Beta']}
+    teams.update({f"Alpha {i}": ['Alpha'] for i in range(3)})
+    teams.update({f"Beta {i}": ['Beta'] for i in range(3)})
+    paths, _, team_rows = oncall.generate_team_schedules(teams, 2032, workers=1)
+    assert any(row['reassigned'] for row in team_rows)
+    for team, employees in oncall.group_teams(teams).items():
+        workbook = oncall.open_workbook(oncall.get_team_schedule_file(team, 2032))
+        expected = oncall.recalculate_counts(employees, *oncall.parse_calendar_sheets(workbook, 2032))
+        for sheet_name in ('Reports', 'Original Reports'):
+            primary_counts, backup_counts = oncall.read_report_counts(workbook, sheet_name)
+            assert min(primary_counts.values()) >= 0 and min(backup_counts.values()) >= 0
+            assert (primary_counts, backup_counts) == expected
+
+
+def test_analytics_skip_empty_years_and_measure_edits_in_days(scheduling_folder):
+    pytest.importorskip('numpy')
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.save_employees(employees)
+    schedule = oncall.build_schedule(employees, 2031, seed=4)
+    oncall.write_schedule_workbook(schedule, employees)
+    oncall.get_workbook(2032)  # Opening a year creates an empty workbook
+    oncall.evict_workbook(oncall.get_schedule_file(2032))
+
+    rows, summary = oncall.compute_fairness_analytics([2031, 2032], employees=employees)
+    assert summary['days'] == 365
+    assert (rows, summary) == oncall.compute_fairness_analytics([2031], employees=employees)
+    assert all(row['primary_edit_delta'] == row['backup_edit_delta'] == 0 for row in rows)
+
+    first = datetime.date(2031, 3, 3)
+    original = schedule['date_primary'][first]
+    cover = next(emp for emp in employees if emp != original)
+    oncall.batch_edit_schedule([(first + datetime.timedelta(days=offset), 'Primary', cover) for offset in range(3)])
+    rows = {row['employee']: row for row in oncall.compute_fairness_analytics([2031, 2032], employees=employees)[0]}
+    assert rows[cover]['primary_edit_delta'] == 3
+    assert rows[original]['primary_edit_delta'] == -3
+    assert sum(row['primary_edit_delta'] for row in rows.values()) == 0
+
+
+def test_combined_calendar_loads_each_year_once(scheduling_folder, monkeypatch):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    for year in (2031, 2032):
+        oncall.write_schedule_workbook(oncall.build_schedule(employees, year, seed=year), employees)
+    loads = []
+    load_schedule_data = oncall.load_schedule_data
+    monkeypatch.setattr(oncall, 'load_schedule_data', lambda year, *args: loads.append(year) or load_schedule_data(year, *args))
+
+    report = oncall.export_calendars([2031, 2032], combined=True)
+    assert report['written'] == 1 and loads == [2031, 2032]
+    with open(os.path.join(report['folder'], 'On Call Schedule.ics'), encoding='utf-8', newline='') as f:
+        text = f.read()
+    assert text.count('BEGIN:VEVENT') == sum(1 for _ in oncall.iter_assignment_runs(oncall.iter_schedule_days([2031, 2032])))
+    assert oncall.export_calendars([2031, 2032], combined=True)['skipped'] == 1
+
+
+def check_runs(runs, reference):
+    # Sorted, non-overlapping, maximal runs that hold exactly the reference days
+    spans = list(zip(runs.starts, runs.ends, runs.holders))
+    for (_, end, holder), (next_start, _, next_holder) in zip(spans, spans[1:]):
+        assert end < next_start
+        assert not (end + 1 == next_start and holder == next_holder)
+    assert runs.to_mapping() == {date: emp for date, emp in reference.items() if emp}
+    assert runs.day_counts() == Counter(emp for emp in reference.values() if emp)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_assignment_runs_match_a_per_day_mapping(seed):
+    rng = random.Random(seed)
+    schedule = oncall.build_schedule(oncall.DEVINTEST_EMPLOYEES, 2031, seed=seed)
+    reference = dict(schedule['date_primary'])
+    runs = oncall.AssignmentRuns.from_mapping(reference)
+    check_runs(runs, reference)
+    dates = sorted(reference)
+    names = oncall.DEVINTEST_EMPLOYEES + ['']
+    for _ in range(200):
+        first = rng.randrange(len(dates))
+        last = min(first + rng.randrange(10), len(dates) - 1)
+        name = rng.choice(names)
+        runs.assign(dates[first], dates[last], name)
+        for date in dates[first:last + 1]:
+            reference[date] = name
+        check_runs(runs, reference)
+    for date in dates:
+        assert runs.get(date) == reference[date]
+    start, end = dates[40], dates[60]
+    clipped = {}
+    for first, last, emp in runs.between(start, end):
+        assert start <= first <= last <= end
+        clipped.update((first + datetime.timedelta(days=offset), emp) for offset in range((last - first).days + 1))
+    assert clipped == {date: emp for date, emp in reference.items() if start <= date <= end and emp}
+
+
+def test_assignment_runs_from_the_store_match_the_mapping(scheduling_folder):
+    schedule = oncall.build_schedule(oncall.DEVINTEST_EMPLOYEES, 2031, seed=2)
+    oncall.write_schedule_workbook(schedule, oncall.DEVINTEST_EMPLOYEES)
+    from_store = oncall.load_schedule_runs(2031)
+    for role, key in zip(oncall.SCHEDULE_ROLES, ('date_primary', 'date_backup1', 'date_backup2')):
+        assert list(from_store[role]) == list(oncall.AssignmentRuns.from_mapping(schedule[key]))
+    # A primary week is a single run
+    monday = datetime.date(2031, 3, 3)
+    assert list(from_store['Primary'].between(monday, monday + datetime.timedelta(days=6))) == \
+        [(monday, monday + datetime.timedelta(days=6), schedule['date_primary'][monday])]
+
+
+def test_schedule_index_reloads_changed_years_and_looks_up_ranges(scheduling_folder):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.save_employees(employees)
+    schedule = oncall.build_horizon_schedule(employees, datetime.date(2031, 1, 1), datetime.date(2032, 12, 31), seed=6)
+    oncall.write_horizon_workbooks(schedule, employees)
+    index = oncall.ScheduleIndex()
+    assert index.refresh()
+    # The roster lives in the current year's workbook, which is indexed too
+    assert set(index.years) == {2031, 2032, datetime.date.today().year}
+    assert not index.refresh()
+    unchanged = index.years[2032]
+
+    date = datetime.date(2031, 8, 12)
+    assert index.lookup(date) == {'date': '2031-08-12', 'primary': schedule['date_primary'][date],
+                                  'backup1': schedule['date_backup1'][date], 'backup2': schedule['date_backup2'][date]}
+    assert index.lookup(datetime.date(2030, 8, 12)) is None
+
+    cover = next(emp for emp in employees if emp != schedule['date_primary'][date])
+    oncall.batch_edit_schedule([(date, 'Primary', cover)])
+    for path in (oncall.get_schedule_file(2031), oncall.get_store_file(2031), oncall.get_journal_file(2031)):
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+    assert index.refresh()
+    assert index.lookup(date)['primary'] == cover
+    assert index.years[2032] is unchanged
+
+    # Runs across the year boundary, clipped to the range, for every role
+    start, end = datetime.date(2031, 12, 20), datetime.date(2032, 1, 10)
+    result = index.lookup_range(start, end)
+    assert (result['start'], result['end']) == ('2031-12-20', '2032-01-10')
+    for key, mapping in zip(('primary', 'backup1', 'backup2'),
+                            (schedule['date_primary'], schedule['date_backup1'], schedule['date_backup2'])):
+        days = {}
+        for run in result[key]:
+            first = datetime.date.fromisoformat(run['start'])
+            last = datetime.date.fromisoformat(run['end'])
+            assert start <= first <= last <= end
+            days.update((first + datetime.timedelta(days=offset), run['employee']) for offset in range((last - first).days + 1))
+        assert days == {day: emp for day, emp in mapping.items() if start <= day <= end and emp}
+
+
+def test_journal_tail_is_replayed_without_writing(scheduling_folder):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    schedule = oncall.build_schedule(employees, 2031, seed=5)
+    oncall.write_schedule_workbook(schedule, employees)
+    store_file = oncall.get_store_file(2031)
+    before = os.stat(store_file)
+
+    # An append whose save never happened, e.g. an interrupted edit
+    date = datetime.date(2031, 5, 6)
+    old = schedule['date_backup1'][date]
+    new = next(emp for emp in employees if emp not in (old, schedule['date_primary'][date], schedule['date_backup2'][date]))
+    changes = [(date, 'Backup 1', old, new)] * 150
+    oncall.record_schedule_changes(2031, changes)
+
+    replayed = []
+    assert oncall.load_schedule_data(2031, replayed)[1][date] == new
+    assert [entry['seq'] for entry in replayed] == list(range(1, 151))
+    assert os.stat(store_file).st_mtime_ns == before.st_mtime_ns
+    assert not [name for name in os.listdir(scheduling_folder) if name.endswith('.tmp')]
+
+
+def test_undo_only_appends_to_the_journal(scheduling_folder):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.save_employees(employees)
+    schedule = oncall.build_schedule(employees, 2031, seed=5)
+    oncall.write_schedule_workbook(schedule, employees)
+    recount = oncall.recalculate_counts(employees, schedule['date_primary'], schedule['date_backup1'],
+                                        schedule['date_backup2'])
+
+    date = datetime.date(2031, 5, 6)
+    old = schedule['date_backup1'][date]
+    new = next(emp for emp in employees if emp not in (old, schedule['date_primary'][date], schedule['date_backup2'][date]))
+    oncall.batch_edit_schedule([(date, 'Backup 1', new)])
+    edited_reports = read_reports(2031)
+    assert edited_reports[1][new] == recount[1][new] + 1
+    assert oncall.load_schedule_history()[2031]['reports']['backup'] == edited_reports[1]
+    path = oncall.get_schedule_file(2031)
+    store_file = oncall.get_store_file(2031)
+    workbook_mtime = os.stat(path).st_mtime_ns
+    store_mtime = os.stat(store_file).st_mtime_ns
+
+    entry = oncall.undo_schedule_change(2031)
+    assert (entry['old'], entry['new'], entry['undo_of']) == (new, old, 1)
+    assert os.stat(path).st_mtime_ns == workbook_mtime
+    assert os.stat(store_file).st_mtime_ns == store_mtime
+    assert read_reports(2031) == edited_reports
+    # Loads and the history cache replay the undo
+    assert oncall.load_schedule_data(2031)[1][date] == old
+    history = oncall.load_schedule_history()[2031]['reports']
+    assert (history['primary'], history['backup']) == recount
+    with pytest.raises(ValueError):
+        oncall.undo_schedule_change(2031, seq=1)
+
+    # The next edit writes the undo out with its own change
+    other = datetime.date(2031, 9, 9)
+    cover = next(emp for emp in employees if emp != schedule['date_primary'][other])
+    oncall.batch_edit_schedule([(other, 'Primary', cover)])
+    workbook = oncall.get_workbook(2031)
+    assert oncall.parse_calendar_sheets(workbook, 2031)[1][date] == old
+    assert oncall.get_journal_sheet_seq(workbook) == 3
+    assert read_reports(2031) == oncall.recalculate_counts(employees, *oncall.load_schedule_data(2031))
+
+
+def test_long_journal_tail_is_compacted_by_an_undo(scheduling_folder):
+    employees = oncall.DEVINTEST_EMPLOYEES
+    oncall.save_employees(employees)
+    schedule = oncall.build_schedule(employees, 2031, seed=5)
+    oncall.write_schedule_workbook(schedule, employees)
+    path = oncall.get_schedule_file(2031)
+    workbook_mtime = os.stat(path).st_mtime_ns
+
+    def replacement(date, role):
+        holders = [schedule[key][date] for key in ('date_primary', 'date_backup1', 'date_backup2')]
+        return holders[oncall.SCHEDULE_ROLES.index(role)], next(emp for emp in employees if emp not in holders)
+
+    date, toggled = datetime.date(2031, 5, 6), datetime.date(2031, 7, 15)
+    old, new = replacement(date, 'Backup 1')
+    before, after = replacement(toggled, 'Backup 2')
+    changes = [(date, 'Backup 1', old, new)] + [(toggled, 'Backup 2', before, after), (toggled, 'Backup 2', after, before)] * 49
+    oncall.record_schedule_changes(2031, changes)
+    store = oncall.load_schedule_store(2031)
+    assert oncall.compact_journal(2031) is False
+    assert oncall.load_schedule_store(2031)['metadata'] == store['metadata']
+
+    oncall.undo_schedule_change(2031)
+    store = oncall.load_schedule_store(2031)
+    assert store['metadata']['journal_seq'] == oncall.JOURNAL_SNAPSHOT_EVERY
+    assert not oncall.has_journal_tail(2031, store)
+    assert os.stat(path).st_mtime_ns == workbook_mtime
+    mappings = oncall.load_schedule_data(2031)
+    assert (mappings[1][date], mappings[2][toggled]) == (new, after)
+    assert store['metadata']['counts'] == oncall.get_store_counts(*oncall.recalculate_counts(employees, *mappings))
+
+    # Compacted entries the workbook never got are written out by the next edit
+    other = datetime.date(2031, 9, 9)
+    cover = next(emp for emp in employees if emp != schedule['date_primary'][other])
+    oncall.batch_edit_schedule([(other, 'Primary', cover)])
+    parsed = oncall.parse_calendar_sheets(oncall.get_workbook(2031), 2031)
+    assert (parsed[1][date], parsed[2][toggled]) == (new, after)
+
+
+def test_bench_runs_a_one_year_case(scheduling_folder, capsys):
+    import bench_oncall
+    os.makedirs(scheduling_folder)
+    out = os.path.join(scheduling_folder, 'bench.json')
+    assert bench_oncall.main(['--sizes', '18', '--years', '1', '--out', out]) == 0
+    assert 'save' in capsys.readouterr().out